@@ -1 +1,3 @@
-from date_range_parser import parse, to_json
+from date_range_parser import parse, parse_many, parse_all, parse_session, to_json, to_json_bytes, DateRangeParser, warmup
+from streaming import iter_extract
+from service import ParseService, ServiceBusy
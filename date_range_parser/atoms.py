@@ -11,25 +11,84 @@ import re
 import datetime
 import utils
 import operator
-from dateutil import rrule
-from utils import SequentialMatcher
+import natural_date_range
+from utils import SequentialMatcher, search_fragment
+from lazyregex import LazyRegex
 
 #
-# Modifiers
+# Base
 #
 
-class ModifierAtom(object):
+class Atom(object):
+    """Atom is the base of every atom. Atoms keep their attributes in __slots__ instead of a __dict__,
+    and each atom is its own (match, tag, atom) triple for the chunker, so to_tag() hands out the atom
+    instead of building a tuple.
+
+    JSON_FIELDS names the attributes to_json() writes out, in order, with u'tag' standing for
+    tag_name(). serialization.py encodes atoms from it directly.
+
+    LOCAL is True for atoms found by a regular expression, which only looks at the text near the
+    match. Atoms that look at the whole fragment they are found in set it to False.
+
+    Attributes:
+        match (string|unicode): Plain-text input that was used to generate this atom.
+    """
+    __slots__ = ('match',)
+    LOCAL = True
 
     def to_json(self):
-       raise NotImplementedError
+        return dict((field, self.tag_name() if field == u'tag' else getattr(self, field)) for field in self.JSON_FIELDS)
+
+    def to_tag(self):
+        return self
+
+    def chunk_tag(self):
+        """ The tag the grammar sees for this atom."""
+        return self.TAG
+
+    def __len__(self):
+        return 3
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return tuple(self)[index]
+        elif index == 0 or index == -3:
+            return self.match
+        elif index == 1 or index == -2:
+            return self.chunk_tag()
+        elif index == 2 or index == -1:
+            return self
+        raise IndexError(u'Atom tag index out of range')
+
+    def __iter__(self):
+        yield self.match
+        yield self.chunk_tag()
+        yield self
+
+    def __getstate__(self):
+        return dict((name, getattr(self, name)) for cls in type(self).__mro__
+                for name in cls.__dict__.get('__slots__', ()) if hasattr(self, name))
+
+    def __setstate__(self, state):
+        for name, value in state.iteritems():
+            setattr(self, name, value)
+
+#
+# Modifiers
+#
+
+class ModifierAtom(Atom):
+    __slots__ = ()
 
 
 class RelativeOneWayMultiDayModifierAtom(ModifierAtom):
+    __slots__ = ('direction', 'src_time')
+    JSON_FIELDS = (u'match', u'direction', u'src_time', u'tag')
 
     EXTRACTION_EXP = r'''
                     (?P<after>\bafter\b)|
                     (?P<before>\b(before|prior|no\slater)\b)'''
-    EXTRACTION_REGEX = re.compile(EXTRACTION_EXP, flags=re.X|re.I)
+    EXTRACTION_REGEX = LazyRegex(EXTRACTION_EXP, flags=re.X|re.I)
 
     TAG = u'MOD'
 
@@ -67,6 +126,13 @@ class RelativeOneWayMultiDayModifierAtom(ModifierAtom):
             else:
                 return None
 
+    @staticmethod
+    def __span_function(nltext, pos, endpos):
+        dir_match = RelativeOneWayMultiDayModifierAtom.EXTRACTION_REGEX.search(nltext, pos, endpos)
+        if dir_match and (dir_match.groupdict().get(u'after') or dir_match.groupdict().get(u'before')):
+            return dir_match.span()
+        return None
+
     @staticmethod
     def extract_atom(text, src_time, **kwargs_ignore):
         # Wrap function to pass through params.
@@ -80,6 +146,14 @@ class RelativeOneWayMultiDayModifierAtom(ModifierAtom):
                 match_transformer=wrapped_match_transformer)
         return matcher.extract(text)
 
+    @staticmethod
+    def extract_atom_spans(text, pos, endpos, src_time, deadline=None, **kwargs_ignore):
+        def wrapped_match_transformer(match):
+            return RelativeOneWayMultiDayModifierAtom(match, src_time)
+        matcher = SequentialMatcher(span_function=RelativeOneWayMultiDayModifierAtom.__span_function,\
+                match_transformer=wrapped_match_transformer)
+        return matcher.extract_spans(text, pos, endpos, deadline)
+
     @staticmethod
     def extract_tags(text, src_time):
         # Wrap function to pass through params.
@@ -91,12 +165,6 @@ class RelativeOneWayMultiDayModifierAtom(ModifierAtom):
                 label=RelativeOneWayMultiDayModifierAtom.TAG)
         return matcher.extract(text)
 
-    def to_json(self):
-        return dict(match=self.match, direction=self.direction, src_time=self.src_time, tag=self.tag_name())
-
-    def to_tag(self):
-        return (self.match, self.TAG, self)
-
     def tag_name(self):
         return u'MOD_RELONEWAYMULTIDAY'
 
@@ -123,6 +191,8 @@ class RelativeOneWayMultiDayModifierAtom(ModifierAtom):
 
 
 class ReferencePointModifierAtom(ModifierAtom):
+    __slots__ = ('src_time', 'modification')
+    JSON_FIELDS = (u'match', u'src_time', u'modification', u'tag')
 
     EXTRACTION_EXP = r'''
                     ((?P<bound_type>\bat\b)\s*)?
@@ -131,7 +201,7 @@ class ReferencePointModifierAtom(ModifierAtom):
                     (\s*(?P<meridian>(a|p)\.?m\.?))?
                     '''
     # TODO Made meridien not optional.
-    EXTRACTION_REGEX = re.compile(EXTRACTION_EXP, flags=re.X|re.I)
+    EXTRACTION_REGEX = LazyRegex(EXTRACTION_EXP, flags=re.X|re.I)
     TAG = u'REF'
 
     def __init__(self, match, src_time, modification=None):
@@ -165,6 +235,11 @@ class ReferencePointModifierAtom(ModifierAtom):
         match = ReferencePointModifierAtom.EXTRACTION_REGEX.search(nltext)
         return match.group() if match else None
 
+    @staticmethod
+    def __span_function(nltext, pos, endpos):
+        match = ReferencePointModifierAtom.EXTRACTION_REGEX.search(nltext, pos, endpos)
+        return match.span() if match else None
+
     @staticmethod
     def __match_transformer(match, src_time):
         return ReferencePointModifierAtom(match, src_time)
@@ -178,6 +253,13 @@ class ReferencePointModifierAtom(ModifierAtom):
                 match_transformer=wrapped_match_transformer)
         return matcher.extract(text)
 
+    @staticmethod
+    def extract_atom_spans(text, pos, endpos, src_time, deadline=None, **kwargs_ignore):
+        def wrapped_match_transformer(match): return ReferencePointModifierAtom.__match_transformer(match, src_time)
+        matcher = SequentialMatcher(span_function=ReferencePointModifierAtom.__span_function,\
+                match_transformer=wrapped_match_transformer)
+        return matcher.extract_spans(text, pos, endpos, deadline)
+
     @staticmethod
     def extract_tags(text, src_time):
         # Wrap static methods for match function and match transform to close over src_time.
@@ -186,12 +268,6 @@ class ReferencePointModifierAtom(ModifierAtom):
         matcher = SequentialMatcher(wrapped_match_function, label=ReferencePointModifierAtom.TAG)
         return matcher.extract(text)
 
-    def to_json(self):
-        return dict(match=self.match, src_time=self.src_time, modification=self.modification, tag=self.tag_name())
-
-    def to_tag(self):
-        return (self.match, self.TAG, self)
-
     def tag_name(self):
         return u'MOD_REFPOINT'
 
@@ -210,6 +286,8 @@ class ReferencePointModifierAtom(ModifierAtom):
 
 
 class AbsoluteOneWayInnerDayModifierAtom(ModifierAtom):
+    __slots__ = ('src_time', 'direction', 'modification')
+    JSON_FIELDS = (u'match', u'src_time', u'modification', u'tag')
 
     EXTRACTION_EXP = r'''
                     (?P<bound_type>before|after)\s*
@@ -218,7 +296,7 @@ class AbsoluteOneWayInnerDayModifierAtom(ModifierAtom):
                     (\s*(?P<meridian>(a|p)\.?m\.?))?
                     '''
     # TODO Made meridien not optional.
-    EXTRACTION_REGEX = re.compile(EXTRACTION_EXP, flags=re.X|re.I)
+    EXTRACTION_REGEX = LazyRegex(EXTRACTION_EXP, flags=re.X|re.I)
     TAG = u'MOD'
 
     def __init__(self, match, src_time, modification=None):
@@ -272,6 +350,11 @@ class AbsoluteOneWayInnerDayModifierAtom(ModifierAtom):
         match = AbsoluteOneWayInnerDayModifierAtom.EXTRACTION_REGEX.search(nltext)
         return match.group() if match else None
 
+    @staticmethod
+    def __span_function(nltext, pos, endpos):
+        match = AbsoluteOneWayInnerDayModifierAtom.EXTRACTION_REGEX.search(nltext, pos, endpos)
+        return match.span() if match else None
+
     @staticmethod
     def __match_transformer(match, src_time):
         return AbsoluteOneWayInnerDayModifierAtom(match, src_time)
@@ -285,6 +368,13 @@ class AbsoluteOneWayInnerDayModifierAtom(ModifierAtom):
                 match_transformer=wrapped_match_transformer)
         return matcher.extract(text)
 
+    @staticmethod
+    def extract_atom_spans(text, pos, endpos, src_time, deadline=None, **kwargs_ignore):
+        def wrapped_match_transformer(match): return AbsoluteOneWayInnerDayModifierAtom.__match_transformer(match, src_time)
+        matcher = SequentialMatcher(span_function=AbsoluteOneWayInnerDayModifierAtom.__span_function,\
+                match_transformer=wrapped_match_transformer)
+        return matcher.extract_spans(text, pos, endpos, deadline)
+
     @staticmethod
     def extract_tags(text, src_time):
         # Wrap static methods for match function and match transform to close over src_time.
@@ -293,12 +383,6 @@ class AbsoluteOneWayInnerDayModifierAtom(ModifierAtom):
         matcher = SequentialMatcher(wrapped_match_function, label=AbsoluteOneWayInnerDayModifierAtom.TAG)
         return matcher.extract(text)
 
-    def to_json(self):
-        return dict(match=self.match, src_time=self.src_time, modification=self.modification, tag=self.tag_name())
-
-    def to_tag(self):
-        return (self.match, self.TAG, self)
-
     def tag_name(self):
         return u'MOD_ABSONEWAYINNERDAY'
 
@@ -327,6 +411,8 @@ class AbsoluteOneWayInnerDayModifierAtom(ModifierAtom):
 
 
 class AbsoluteInnerDayModifierAtom(ModifierAtom):
+    __slots__ = ('modification',)
+    JSON_FIELDS = (u'match', u'modification', u'tag')
 
     # Be sure to escape '{-type' quantifiers since we're using .format() to construct match groups.
     # Look for a time like 5, 13:00, 5:30 etc.
@@ -353,7 +439,10 @@ class AbsoluteInnerDayModifierAtom(ModifierAtom):
                         '''.format(time_exp_0=_time_exp_0, time_exp_f=_time_exp_f,
                             mer_exp_0=_mer_exp_0, mer_exp_f=_mer_exp_f, div_subex=_div_subex)
     # Construct the actual extraction regular expression object.
-    EXTRACTION_REGEX = re.compile(EXTRACTION_EXP, flags=re.X|re.I|re.M)
+    EXTRACTION_REGEX = LazyRegex(EXTRACTION_EXP, flags=re.X|re.I|re.M)
+    # Same expression with the leading `^` dropped, tried only at the start of a fragment (see search_fragment).
+    SPAN_HEAD_EXP = EXTRACTION_EXP.replace(r'(\s|^)', r'(\s|)', 1)
+    SPAN_HEAD_REGEX = LazyRegex(SPAN_HEAD_EXP, flags=re.X|re.I|re.M)
     # Define the tag name.
     TAG = u'MOD'
 
@@ -424,6 +513,14 @@ class AbsoluteInnerDayModifierAtom(ModifierAtom):
         else:
             return None
 
+    @staticmethod
+    def __span_function(nltext, pos, endpos):
+        match = search_fragment(AbsoluteInnerDayModifierAtom.EXTRACTION_REGEX, nltext, pos, endpos,
+                head_regex=AbsoluteInnerDayModifierAtom.SPAN_HEAD_REGEX)
+        if match and match.groupdict()[u't0hr'] and match.groupdict()[u'tfhr']:
+            return match.span()
+        return None
+
     @staticmethod
     def __match_transformer(match):
         return AbsoluteInnerDayModifierAtom(match)
@@ -434,17 +531,17 @@ class AbsoluteInnerDayModifierAtom(ModifierAtom):
                 match_transformer=AbsoluteInnerDayModifierAtom.__match_transformer)
         return matcher.extract(text)
 
+    @staticmethod
+    def extract_atom_spans(text, pos, endpos, src_time=None, deadline=None, **kwargs_ignore):
+        matcher = SequentialMatcher(span_function=AbsoluteInnerDayModifierAtom.__span_function,\
+                match_transformer=AbsoluteInnerDayModifierAtom.__match_transformer)
+        return matcher.extract_spans(text, pos, endpos, deadline)
+
     @staticmethod
     def extract_tags(text, *ignore):
         matcher = SequentialMatcher(AbsoluteInnerDayModifierAtom.__match_function, label=u'MOD')
         return matcher.extract(text)
 
-    def to_json(self):
-        return dict(match=self.match, modification=self.modification, tag=self.tag_name())
-
-    def to_tag(self):
-        return (self.match, self.TAG, self)
-
     def tag_name(self):
         return u'MOD_ABSINNERDAY'
 
@@ -467,6 +564,8 @@ class AbsoluteInnerDayModifierAtom(ModifierAtom):
 
 
 class NaturalInnerDayModifierAtom(ModifierAtom):
+    __slots__ = ('name', 'modification')
+    JSON_FIELDS = (u'match', u'modification', u'tag')
 
     # Use combination of subcomponents to make more complicated EXTRACTION_EXP.
     EXTRACTION_SUBCOMPS = {u'morning_seed':r'morn(ing)?|breakfast',
@@ -498,7 +597,7 @@ class NaturalInnerDayModifierAtom(ModifierAtom):
                         (?P<MOD_NGT>{night_seed})|
                         (?P<MOD_WKD>{workday_seed})
                         '''.format(**EXTRACTION_SUBCOMPS)
-    EXTRACTION_REGEX = re.compile(EXTRACTION_EXP, flags=re.X|re.I)
+    EXTRACTION_REGEX = LazyRegex(EXTRACTION_EXP, flags=re.X|re.I)
 
     NAME_TO_HOURS = {
         u'MOD_EMRN': (5, 8),
@@ -588,6 +687,11 @@ class NaturalInnerDayModifierAtom(ModifierAtom):
         match = NaturalInnerDayModifierAtom.EXTRACTION_REGEX.search(nltext)
         return match.group() if match else None
 
+    @staticmethod
+    def __span_function(nltext, pos, endpos):
+        match = NaturalInnerDayModifierAtom.EXTRACTION_REGEX.search(nltext, pos, endpos)
+        return match.span() if match else None
+
     @staticmethod
     def __match_transformer(match):
         return NaturalInnerDayModifierAtom(match)
@@ -598,16 +702,19 @@ class NaturalInnerDayModifierAtom(ModifierAtom):
                 match_transformer=NaturalInnerDayModifierAtom.__match_transformer)
         return matcher.extract(text)
 
+    @staticmethod
+    def extract_atom_spans(text, pos, endpos, src_time=None, deadline=None, **kwargs_ignore):
+        matcher = SequentialMatcher(span_function=NaturalInnerDayModifierAtom.__span_function,\
+                match_transformer=NaturalInnerDayModifierAtom.__match_transformer)
+        return matcher.extract_spans(text, pos, endpos, deadline)
+
     @staticmethod
     def extract_tags(text, *ignore):
         matcher = SequentialMatcher(NaturalInnerDayModifierAtom.__match_function, label=u'MOD')
         return matcher.extract(text)
 
-    def to_json(self):
-        return dict(match=self.match, modification=self.modification, tag=self.tag_name())
-
-    def to_tag(self):
-        return (self.match, u'MOD', self)
+    def chunk_tag(self):
+        return u'MOD'
 
     def modify(self, daterange):
         if isinstance(daterange, DaterangeAtom):
@@ -629,9 +736,14 @@ class NaturalInnerDayModifierAtom(ModifierAtom):
 #
 # Fillers
 #
-class FillerAtom(object):
+class FillerAtom(Atom):
+    __slots__ = ()
+    JSON_FIELDS = (u'match',)
 
     TAG = u'FILL'
+    LOCAL = False
+    # A fragment is filler when it is a single run of non-whitespace.
+    SPAN_HEAD_REGEX = LazyRegex('\S+$')
 
     def __init__(self, match):
         self.match = match
@@ -642,6 +754,12 @@ class FillerAtom(object):
         match = only_garbage.search(nltext)
         return match.group() if match else None
 
+    @staticmethod
+    def __span_function(nltext, pos, endpos):
+        # Anchored on both ends of the fragment, so there is nothing to search for past `pos`.
+        match = FillerAtom.SPAN_HEAD_REGEX.match(nltext, pos, endpos)
+        return match.span() if match else None
+
     @staticmethod
     def __match_transformer(match):
         return FillerAtom(match)
@@ -651,17 +769,16 @@ class FillerAtom(object):
         matcher = SequentialMatcher(FillerAtom.__match_function, match_transformer=FillerAtom.__match_transformer)
         return matcher.extract(text)
 
+    @staticmethod
+    def extract_atom_spans(text, pos, endpos, src_time=None, deadline=None, **kwargs_ignore):
+        matcher = SequentialMatcher(span_function=FillerAtom.__span_function, match_transformer=FillerAtom.__match_transformer)
+        return matcher.extract_spans(text, pos, endpos, deadline)
+
     @staticmethod
     def extract_tags(text, *ignore):
         matcher = SequentialMatcher(FillerAtom.__match_function, label=FillerAtom.TAG)
         return matcher.extract(text)
 
-    def to_json(self):
-        return dict(match=self.match)
-
-    def to_tag(self):
-        return (self.match, FillerAtom.TAG, self)
-
     def tag_name(self):
         return self.TAG
 
@@ -670,7 +787,9 @@ class FillerAtom(object):
 # Operands
 #
 
-class OperandAtom(object):
+class OperandAtom(Atom):
+    __slots__ = ('operand',)
+    JSON_FIELDS = (u'match', u'operand', u'tag')
 
     # Class Variables.
     EXTRACTION_EXP = r'''
@@ -684,7 +803,10 @@ class OperandAtom(object):
                         (?P<TO>(^|.)\bto\b(.|$))|
                         (?P<AT>(^|.)\bat\b(.|$))
                         '''
-    EXTRACTION_REGEX = re.compile(EXTRACTION_EXP, flags=re.X|re.I)
+    EXTRACTION_REGEX = LazyRegex(EXTRACTION_EXP, flags=re.X|re.I)
+    # Same expression with the leading `^` dropped, tried only at the start of a fragment (see search_fragment).
+    SPAN_HEAD_EXP = EXTRACTION_EXP.replace(r'(^|.)', r'(|.)')
+    SPAN_HEAD_REGEX = LazyRegex(SPAN_HEAD_EXP, flags=re.X|re.I)
 
     def __init__(self, match, operand=None):
         if operand and match:
@@ -710,6 +832,11 @@ class OperandAtom(object):
         match = OperandAtom.EXTRACTION_REGEX.search(nltext)
         return match.group() if match else None
 
+    @staticmethod
+    def __span_function(nltext, pos, endpos):
+        match = search_fragment(OperandAtom.EXTRACTION_REGEX, nltext, pos, endpos, head_regex=OperandAtom.SPAN_HEAD_REGEX)
+        return match.span() if match else None
+
     @staticmethod
     def __match_transformer(match):
         return OperandAtom(match)
@@ -719,6 +846,11 @@ class OperandAtom(object):
         matcher = SequentialMatcher(OperandAtom.__match_function, match_transformer=OperandAtom.__match_transformer)
         return matcher.extract(text)
 
+    @staticmethod
+    def extract_atom_spans(text, pos, endpos, src_time=None, deadline=None, **kwargs_ignore):
+        matcher = SequentialMatcher(span_function=OperandAtom.__span_function, match_transformer=OperandAtom.__match_transformer)
+        return matcher.extract_spans(text, pos, endpos, deadline)
+
     @staticmethod
     def extract_tags(text, *ignore):
         matcher = SequentialMatcher(OperandAtom.__match_function, label=u'OP')
@@ -734,11 +866,8 @@ class OperandAtom(object):
         else:
             raise ValueError(u'daterange must be a subclass of DaterangeAtom')
 
-    def to_json(self):
-        return dict(match=self.match, operand=self.operand, tag=self.tag_name())
-
-    def to_tag(self):
-        return (self.match, self.operand, self)
+    def chunk_tag(self):
+        return self.operand
 
     def tag_name(self):
         return self.operand
@@ -747,7 +876,7 @@ class OperandAtom(object):
 # Dateranges.
 #
 
-class DaterangeAtom(object):
+class DaterangeAtom(Atom):
     """DaterangeAtom a top level abstract object that can be recognized by the DateRangeParser.
 
     Attributes:
@@ -757,6 +886,9 @@ class DaterangeAtom(object):
         src_time (datetime): The source time to base all calculation on. Preferably localized.
 
     """
+    __slots__ = ('start', 'end', 'src_time')
+    JSON_FIELDS = (u'start', u'end', u'match', u'src_time', u'tag')
+
     def __init__(self, start, end, match, src_time):
         """ Initialize a DaterangeAtom with all three parameters. """
         if all([start, end, match, src_time]):
@@ -769,29 +901,14 @@ class DaterangeAtom(object):
 
     def split(self, split_on=u'days'):
         """ Convenience function that allows a DateRange to be split into a list of single days."""
-        # Map split on string to a recurrence rule.
-        split_on_rules = {u'days': rrule.DAILY,
-                          u'weeks': rrule.WEEKLY,
-                          u'months': rrule.MONTHLY}
-        # If there is a valid rule return a split date range.
-        rule = split_on_rules.get(split_on)
-        if rule:
-            splits = list(rrule.rrule(rule, count=((self.end - utils.start_of_day(self.start)).days),
-                                    dtstart=self.start,
-                                    until=self.end))
-            return [(s, utils.end_of_day(s)) for s in splits]
-        else:
-            raise ValueError(u'split_on value not supported.')
+        return utils.split_range(self.start, self.end, split_on)
 
     def to_markup(self):
         return [(self.start, self.end)]
 
-    def to_json(self):
-        return dict(start=self.start, end=self.end, match=self.match, src_time=self.src_time, tag=self.tag_name())
-
-    def to_tag(self):
-        """ Atoms and TaggedAtoms can also be represented as TaggedObjects for RegexTagging."""
-        return (self.match, u'DR', self)
+    def chunk_tag(self):
+        """ Calendar and natural dateranges look the same to the grammar."""
+        return u'DR'
 
     def tag_name(self):
         return self.TAG
@@ -807,6 +924,8 @@ class NaturalDaterangeAtom(DaterangeAtom):
 
     Attributes:
     """
+    __slots__ = ()
+
     TAG = u'NDR'
 
     def __init__(self, match, src_time, start=None, end=None):
@@ -838,6 +957,15 @@ class NaturalDaterangeAtom(DaterangeAtom):
         matcher = SequentialMatcher(match_function, match_transformer=match_transformer)
         return matcher.extract(text)
 
+    @staticmethod
+    def extract_atom_spans(text, pos, endpos, src_time, deadline=None, **kwargs_ignore):
+        def span_function(nltext, pos, endpos):
+            match = natural_date_range.NATURAL_RANGE_REGEX.search(nltext, pos, endpos)
+            return match.span() if match else None
+        def match_transformer(match): return NaturalDaterangeAtom(match, src_time)
+        matcher = SequentialMatcher(span_function=span_function, match_transformer=match_transformer)
+        return matcher.extract_spans(text, pos, endpos, deadline)
+
     @staticmethod
     def extract_tags(text, src_time):
         parser = utils.safe_natural_daterange_parser
@@ -854,9 +982,12 @@ class NaturalDaterangeAtom(DaterangeAtom):
 
 
 class CalendarDateRangeAtom(DaterangeAtom):
+    __slots__ = ('parse_type',)
 
     # Class Variables.
     TAG = u'CDR'
+    # parsedatetime reads the whole fragment.
+    LOCAL = False
 
     def __init__(self, match, src_time, start=None, end=None, parse_type=u'range'):
         """ Initialize a CalendarDateRangeAtom with plaintext that can successfully translate to
@@ -896,6 +1027,16 @@ class CalendarDateRangeAtom(DaterangeAtom):
         matcher = SequentialMatcher(match_function, match_transformer=match_transformer);
         return matcher.extract(text)
 
+    @staticmethod
+    def extract_atom_spans(text, pos, endpos, src_time, parse_type=u'range', deadline=None, **kwargs_ignore):
+        # parsedatetime needs a string of its own, so each fragment is parsed once and its matches are
+        # handed out in order.
+        spans = utils.parsedatetime_nlp_spans(text, pos, endpos, src_time, ignore='time')
+        def span_function(nltext, pos, endpos): return next(spans, None)
+        def match_transformer(match): return CalendarDateRangeAtom(match, src_time, parse_type=parse_type)
+        matcher = SequentialMatcher(span_function=span_function, match_transformer=match_transformer)
+        return matcher.extract_spans(text, pos, endpos, deadline)
+
     @staticmethod
     def extract_tags(text, src_time):
         def match_function(nltext): return utils.safe_parsedatetime_first_nlp(nltext, src_time, ignore='time').get(u'match')
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""benchmarks
+
+Benchmarks for the date_range_parser. Like user_tests.py they are meant to be run from inside the
+date_range_parser directory, e.g.
+
+    python -m benchmarks.parser_reuse
+"""
+
+import os
+import ast
+import random
+import time
+import datetime
+import pytz
+
+CORPUS_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'test_inputs.txt')
+
+TZ_NAME = u'America/New_York'
+
+def reference_time():
+    """ The source time used throughout user_tests.py."""
+    return pytz.timezone(TZ_NAME).localize(datetime.datetime(2014, 8, 3, 10, 0, 32))
+
+def load_corpus(path=CORPUS_PATH):
+    """ Reads the quoted one-per-line inputs from data/test_inputs.txt."""
+    def unquote(line):
+        try:
+            return ast.literal_eval(line)
+        except SyntaxError:
+            # A few lines contain unescaped quotes, just strip the outer ones.
+            return line[1:-1]
+    lines = [line.strip().rstrip(']') for line in open(path)]
+    return [unicode(unquote(line)) for line in lines if line]
+
+def synthetic_text(corpus, size, seed=0):
+    """ Builds an email-like text of about `size` characters by joining randomly picked corpus inputs
+    with sentences that have no dates in them."""
+    filler = [u'Let me know what works for you.', u'Thanks for the quick reply!', u'Looping in the rest of the team.']
+    rnd = random.Random(seed)
+    parts = []
+    length = 0
+    while length < size:
+        part = rnd.choice(corpus) + u'. ' + rnd.choice(filler)
+        parts.append(part)
+        length += len(part) + 1
+    return u' '.join(parts)
+
+def time_calls(fn, inputs, repeat=5):
+    """ Calls `fn` on every input `repeat` times and returns the per-call latencies in seconds."""
+    timings = []
+    for _ in range(repeat):
+        for item in inputs:
+            t0 = time.time()
+            fn(item)
+            timings.append(time.time() - t0)
+    return timings
+
+def percentile(timings, pct):
+    """ Nearest-rank percentile of a list of timings."""
+    if not timings:
+        return None
+    ordered = sorted(timings)
+    rank = int(round(pct / 100.0 * (len(ordered) - 1)))
+    return ordered[rank]
+
+def summarize(name, timings):
+    """ Formats mean and percentile latencies in milliseconds."""
+    mean = sum(timings) / len(timings)
+    return u'{name:<28} n={n:<6} mean={mean:8.3f}ms p50={p50:8.3f}ms p95={p95:8.3f}ms'.format(
+            name=name, n=len(timings), mean=mean * 1000,
+            p50=percentile(timings, 50) * 1000, p95=percentile(timings, 95) * 1000)
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""atom_memory.py
+
+Measures what the atoms made for the inputs in data/test_inputs.txt cost in memory and in work for the
+garbage collector. tracemalloc is not available on Python 2, so sizes come from sys.getsizeof() on each
+atom, its __dict__ when it has one and the tuple to_tag() returns when that is not the atom itself.
+Allocations are the gc tracked objects created while tagging and chunking, counted with gc disabled.
+
+    python -m benchmarks.atom_memory
+"""
+
+import gc
+import sys
+import date_range_parser
+import preprocessing
+from benchmarks import TZ_NAME, load_corpus, reference_time, time_calls, summarize
+
+def atom_bytes(atom):
+    """ Bytes held by one atom and its tag, not counting the strings and datetimes they point to."""
+    size = sys.getsizeof(atom)
+    if hasattr(atom, '__dict__'):
+        size += sys.getsizeof(atom.__dict__)
+    tag = atom.to_tag()
+    if tag is not atom:
+        size += sys.getsizeof(tag)
+    return size
+
+def tag_and_chunk(parser, text, src_time):
+    extractions = parser.tagger.tag(text, src_time)
+    return extractions, parser.grammar_parser.parse([e.to_tag() for e in extractions])
+
+def main(repeat=5):
+    texts = [preprocessing.preprocess_input(text) for text in load_corpus()]
+    src_time = reference_time()
+    parser = date_range_parser.DateRangeParser(TZ_NAME)
+    parser.warmup()
+
+    atoms = [atom for text in texts for atom in parser.tagger.tag(text, src_time)]
+    sizes = [atom_bytes(atom) for atom in atoms]
+    print u'{label:<28} atoms={n} bytes per atom={mean:.1f} total={total}'.format(label=u'atoms',
+            n=len(atoms), mean=sum(sizes) / float(len(sizes)), total=sum(sizes))
+
+    gc.collect()
+    gc.disable()
+    try:
+        before = gc.get_count()[0]
+        for text in texts:
+            tag_and_chunk(parser, text, src_time)
+        allocations = gc.get_count()[0] - before
+    finally:
+        gc.enable()
+    print u'{label:<28} tracked objects per text={per_text:.1f}'.format(label=u'tag + chunk',
+            per_text=allocations / float(len(texts)))
+    print summarize(u'tag + chunk', time_calls(lambda text: tag_and_chunk(parser, text, src_time), texts, repeat))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+"""batch.py
+
+Compares a loop over date_range_parser.parse() with one call to date_range_parser.parse_many() for the
+inputs in data/test_inputs.txt, once as they are and once repeated to look like an inbox export where
+the same sentences come up again and again.
+
+    python -m benchmarks.batch
+"""
+
+import time
+import date_range_parser
+from benchmarks import TZ_NAME, load_corpus, reference_time
+
+def time_batch(fn, texts, repeat=5):
+    """ Returns the best of `repeat` runs of fn(texts) in seconds."""
+    best = None
+    for _ in range(repeat):
+        t0 = time.time()
+        fn(texts)
+        elapsed = time.time() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def main(repeat=5, copies=10):
+    corpus = load_corpus()
+    src_time = reference_time()
+
+    def parse_loop(texts):
+        return [date_range_parser.parse(text, src_time, TZ_NAME) for text in texts]
+
+    def parse_many(texts):
+        return date_range_parser.parse_many(texts, src_time, TZ_NAME)
+
+    parse_loop(corpus[:1])
+    for label, texts in ((u'unique', corpus), (u'x%d' % copies, corpus * copies)):
+        loop = time_batch(parse_loop, texts, repeat)
+        many = time_batch(parse_many, texts, repeat)
+        print u'{label:<8} n={n:<6} parse() loop={loop:8.1f}ms parse_many={many:8.1f}ms speedup={speedup:5.2f}x'.format(
+                label=label, n=len(texts), loop=loop * 1000, many=many * 1000, speedup=loop / many)
+
+if __name__ == '__main__':
+    main()
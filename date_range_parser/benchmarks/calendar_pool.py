@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+"""calendar_pool.py
+
+Reports how many parsedatetime calendars are built and reused per parse, and the per-call latency,
+with utils.calendar_registry pooling turned off and on.
+
+    python -m benchmarks.calendar_pool
+"""
+
+import utils
+import date_range_parser
+from benchmarks import TZ_NAME, load_corpus, reference_time, time_calls, summarize
+
+def main(repeat=5):
+    corpus = load_corpus()
+    src_time = reference_time()
+    parser = date_range_parser.DateRangeParser(TZ_NAME)
+    registry = utils.calendar_registry
+
+    def parse(text):
+        return parser.parse(text, src_time)
+
+    for pooled in (False, True):
+        registry.configure(pooled=pooled)
+        parse(corpus[0])
+        registry.reset_stats()
+        timings = time_calls(parse, corpus, repeat)
+        stats = registry.stats()
+        label = u'pooled' if pooled else u'unpooled'
+        print summarize(label, timings)
+        print u'{label:<28} built/parse={built:.2f} reused/parse={reused:.2f}'.format(label=u'',
+                built=stats[u'built'] / float(len(timings)), reused=stats[u'reused'] / float(len(timings)))
+    registry.configure()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+"""calendar_tables.py
+
+Resolves natural ranges like "next 3 weekends" and "in 2 months" from the day_table and with the
+relativedelta arithmetic it stands in for, over a year of source days, and reports the latency of
+each. Both localize the bounds of the range on their own day.
+
+    python -m benchmarks.calendar_tables
+"""
+
+import datetime
+import pytz
+import natural_date_range
+from benchmarks import TZ_NAME, reference_time, time_calls, summarize
+
+TEXTS = (u'this weekend', u'next week', u'next month', u'next 3 weekends', u'in 2 months', u'12 months')
+
+def main(repeat=5):
+    tz = pytz.timezone(TZ_NAME)
+    start = reference_time()
+    days = [tz.localize(datetime.datetime(start.year, start.month, start.day) + datetime.timedelta(days=i))
+            for i in range(365)]
+    matches = [natural_date_range.NATURAL_RANGE_REGEX.search(text) for text in TEXTS]
+    inputs = [(match, day) for match in matches for day in days]
+    table = natural_date_range.__dict__['__parse_range_match']
+    arithmetic = natural_date_range.__dict__['__parse_range_arithmetic']
+    localized = natural_date_range.__dict__['__localized']
+    # Builds the tables up front, as the first parse of the day would.
+    table(*inputs[0])
+    print summarize(u'natural range arithmetic',
+            time_calls(lambda item: tuple(localized(dt) for dt in arithmetic(*item)), inputs, repeat))
+    print summarize(u'natural range table', time_calls(lambda item: table(*item), inputs, repeat))
+
+if __name__ == '__main__':
+    main()
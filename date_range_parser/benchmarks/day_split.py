@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""day_split.py
+
+Compares utils.split_by_days() with the dateutil rrule version it replaced, on ranges of a day up to
+three months, and times whole parses of inputs that split long ranges, like "next 3 months after 5pm".
+The split cache is cleared before every cold call.
+
+    python -m benchmarks.day_split
+"""
+
+import datetime
+import utils
+import date_range_parser
+from benchmarks import TZ_NAME, reference_time, time_calls, summarize
+
+LONG_RANGE_INPUTS = [u'next 3 months after 5pm', u'this month before noon', u'next week in the morning',
+        u'between 9/1/2014 and 11/30/2014']
+
+def rrule_split_by_days(start, end):
+    """ utils.split_by_days() as it was before, for comparison."""
+    from dateutil import rrule
+    if (end-start).total_seconds() >= 60*60*24:
+        splits = list(rrule.rrule(rrule.DAILY, count=((end - utils.start_of_day(start)).days),
+                                    dtstart=start,
+                                    until=end))
+        return [(s, utils.end_of_day(s)) for s in splits[0:1]] + [(utils.start_of_day(s), utils.end_of_day(s)) for s in splits[1:]]
+    else:
+        return [(start, end)]
+
+def main(repeat=20):
+    start = reference_time()
+    ranges = [(start, start + datetime.timedelta(days=days)) for days in (1, 7, 31, 92)]
+
+    def cold(bounds):
+        utils.split_cache.clear()
+        return utils.split_by_days(*bounds)
+
+    print summarize(u'rrule', time_calls(lambda bounds: rrule_split_by_days(*bounds), ranges, repeat))
+    print summarize(u'split_by_days cold', time_calls(cold, ranges, repeat))
+    print summarize(u'split_by_days memoized', time_calls(lambda bounds: utils.split_by_days(*bounds), ranges, repeat))
+
+    parser = date_range_parser.DateRangeParser(TZ_NAME)
+    parser.warmup()
+    print summarize(u'parse long ranges', time_calls(lambda text: parser.parse(text, start), LONG_RANGE_INPUTS, repeat))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+"""fused_preprocessing.py
+
+Compares preprocessing.preprocess_input(), which normalizes in one substitution, with chaining the
+single-purpose steps over the inputs in data/test_inputs.txt.
+
+    python -m benchmarks.fused_preprocessing
+"""
+
+import preprocessing
+from benchmarks import load_corpus, time_calls, summarize
+
+def chained(nltext):
+    return preprocessing.remove_stop_words(preprocessing.correct_spelling(preprocessing.replace_ordinals(
+            preprocessing.replace_words(preprocessing.sanitize_string(nltext)))))
+
+def main(repeat=20):
+    corpus = load_corpus()
+    print summarize(u'chained steps', time_calls(chained, corpus, repeat))
+    print summarize(u'preprocess_input', time_calls(preprocessing.preprocess_input, corpus, repeat))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""http_load.py
+
+Load generator for server.py. Starts the server in a process of its own for each worker count and
+executor, then has `clients` threads send the inputs in data/test_inputs.txt over kept alive
+connections, one text per /parse request and then `batch` texts per /batch request. Reports requests
+and texts per second and request latency. Each input gets a suffix so the result cache does not hide
+the parsing work.
+
+    python -m benchmarks.http_load [worker counts...]
+"""
+
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import httplib
+import threading
+import subprocess
+import multiprocessing
+from benchmarks import TZ_NAME, load_corpus, percentile
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+def start_server(port, workers, executor_type):
+    process = subprocess.Popen([sys.executable, '-m', 'server', '--port', str(port), '--workers', str(workers),
+            '--executor', executor_type, '--tz-name', TZ_NAME], cwd=PACKAGE_DIR)
+    # Start up and warm up are kept out of the timing.
+    for _ in range(600):
+        try:
+            connection = httplib.HTTPConnection('127.0.0.1', port)
+            connection.request('GET', '/metrics')
+            connection.getresponse().read()
+            connection.close()
+            return process
+        except socket.error:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(u'Server did not start')
+
+def stop_server(process):
+    process.send_signal(signal.SIGINT)
+    process.wait()
+
+def drive(port, bodies, path, clients):
+    """ Sends every body in `bodies` to `path` from `clients` threads, each on its own connection.
+    Returns the elapsed time, the latency of each request and how many did not get a 200."""
+    queue = list(reversed(bodies))
+    latencies = []
+    failed = [0]
+
+    def client():
+        connection = httplib.HTTPConnection('127.0.0.1', port)
+        while True:
+            try:
+                body = queue.pop()
+            except IndexError:
+                break
+            sent = time.time()
+            connection.request('POST', path, body, {'Content-Type': 'application/json'})
+            response = connection.getresponse()
+            response.read()
+            latencies.append(time.time() - sent)
+            if response.status != 200:
+                failed[0] += 1
+        connection.close()
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    t0 = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.time() - t0, latencies, failed[0]
+
+def report(label, texts, elapsed, latencies, failed):
+    print (u'{label:<24} n={n:<5} {rate:8.1f} req/s {texts:8.1f} texts/s p50={p50:8.3f}ms p95={p95:8.3f}ms '
+            u'p99={p99:8.3f}ms failed={failed}').format(label=label, n=len(latencies), rate=len(latencies) / elapsed,
+            texts=texts / elapsed, p50=percentile(latencies, 50) * 1000, p95=percentile(latencies, 95) * 1000,
+            p99=percentile(latencies, 99) * 1000, failed=failed)
+
+def main(worker_counts=None, copies=3, clients=8, batch=20):
+    worker_counts = worker_counts or sorted(set([1, 2, multiprocessing.cpu_count()]))
+    date = u'2014-08-03'
+    for executor_type in (u'thread', u'process'):
+        for workers in worker_counts:
+            # A fresh suffix per route and run, so nothing hits results cached before.
+            texts = lambda route: [u'%s (%d %s %d %s)' % (text, i, executor_type, workers, route)
+                    for i in range(copies) for text in load_corpus()]
+            singles = [json.dumps({u'text': text, u'date': date}) for text in texts(u'parse')]
+            batched = texts(u'batch')
+            batches = [json.dumps({u'texts': batched[i:i + batch], u'date': date}) for i in range(0, len(batched), batch)]
+            port = free_port()
+            process = start_server(port, workers, executor_type)
+            try:
+                label = u'{0} workers={1}'.format(executor_type, workers)
+                report(label + u' /parse', len(singles), *drive(port, singles, '/parse', clients))
+                report(label + u' /batch', len(batched), *drive(port, batches, '/batch', clients))
+            finally:
+                stop_server(process)
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+"""json_output.py
+
+Times turning full parse results for the inputs in data/test_inputs.txt into JSON with the
+DateRangeParserEncoder that to_json() used to call, with to_json() and its compact form and with
+to_json_bytes(), which uses ujson or simplejson when either is installed.
+
+    python -m benchmarks.json_output
+"""
+
+import utils
+import serialization
+import date_range_parser
+from benchmarks import TZ_NAME, load_corpus, reference_time, time_calls, summarize
+
+def main(repeat=10):
+    src_time = reference_time()
+    parser = date_range_parser.DateRangeParser(TZ_NAME)
+    results = [parser.parse(text, src_time) for text in load_corpus()]
+    encoder = utils.DateRangeParserEncoder()
+
+    print summarize(u'DateRangeParserEncoder', time_calls(encoder.encode, results, repeat))
+    print summarize(u'to_json', time_calls(date_range_parser.to_json, results, repeat))
+    print summarize(u'to_json compact', time_calls(lambda result: date_range_parser.to_json(result, compact=True), results, repeat))
+    print summarize(u'to_json_bytes ' + serialization.json_backend().__name__,
+            time_calls(date_range_parser.to_json_bytes, results, repeat))
+    for label, encode in ((u'DateRangeParserEncoder', encoder.encode), (u'to_json compact',
+            lambda result: date_range_parser.to_json(result, compact=True))):
+        print u'{label:<28} json bytes={size}'.format(label=label, size=sum(len(encode(result)) for result in results))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+"""latency_budget.py
+
+Parses pasted threads of growing length built from data/test_inputs.txt with no limit, with a
+`deadline_ms` budget and with `max_length`, and reports latency and how many results came back partial.
+
+    python -m benchmarks.latency_budget
+"""
+
+import date_range_parser
+from benchmarks import TZ_NAME, load_corpus, reference_time, synthetic_text, time_calls, summarize
+
+def main(sizes=(1000, 4000, 16000), threads=5, repeat=3, deadline_ms=20, max_length=2000):
+    corpus = load_corpus()
+    src_time = reference_time()
+    parser = date_range_parser.DateRangeParser(TZ_NAME)
+    parser.warmup()
+    for size in sizes:
+        inputs = [synthetic_text(corpus, size, seed) for seed in range(threads)]
+        print summarize(u'{0} no limit'.format(size), time_calls(lambda text: parser.parse(text, src_time), inputs, repeat))
+        partial = [parser.parse(text, src_time, deadline_ms=deadline_ms).get(u'partial', False) for text in inputs]
+        print summarize(u'{0} deadline {1}ms'.format(size, deadline_ms),
+                time_calls(lambda text: parser.parse(text, src_time, deadline_ms=deadline_ms), inputs, repeat)), \
+                u'partial={0}/{1}'.format(sum(partial), len(partial))
+        print summarize(u'{0} max_length {1}'.format(size, max_length),
+                time_calls(lambda text: parser.parse(text, src_time, max_length=max_length), inputs, repeat))
+
+if __name__ == '__main__':
+    main()
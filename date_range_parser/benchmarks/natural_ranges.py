@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+"""natural_ranges.py
+
+Reports the per-call latency of natural_date_range.natural_daterange_parser() over the inputs in
+data/test_inputs.txt, the way the sequential tagger calls it on whole sentences, and over just the
+natural ranges found in them, the way NaturalDaterangeAtom parses its own match.
+
+    python -m benchmarks.natural_ranges
+"""
+
+import natural_date_range
+from benchmarks import load_corpus, reference_time, time_calls, summarize
+
+def main(repeat=20):
+    corpus = load_corpus()
+    src_time = reference_time()
+    matches = [m.group() for text in corpus for m in natural_date_range.NATURAL_RANGE_REGEX.finditer(text)]
+
+    def parse(text):
+        return natural_date_range.natural_daterange_parser(text, src_time)
+
+    print summarize(u'sentences', time_calls(parse, corpus, repeat))
+    print summarize(u'matches', time_calls(parse, matches, repeat))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+"""output_formats.py
+
+Compares the result formats in date_range_parser.OUTPUT_FORMATS on inputs that cover many days. It
+reports per-call latency of parse() followed by to_json() and the size of the JSON.
+
+    python -m benchmarks.output_formats
+"""
+
+import date_range_parser
+from benchmarks import TZ_NAME, reference_time, time_calls, summarize
+
+LONG_RANGE_INPUTS = [u'between 8/4/2014 and 1/31/2015', u'8/4/2014 - 1/31/2015 after 5pm', u'next month',
+        u'this week in the morning']
+
+def main(repeat=20):
+    src_time = reference_time()
+    for output_format in date_range_parser.OUTPUT_FORMATS:
+        parser = date_range_parser.DateRangeParser(TZ_NAME, output_format=output_format)
+        parser.warmup()
+        def parse_to_json(text):
+            return date_range_parser.to_json(parser.parse(text, src_time)[u'result'])
+        size = sum(len(parse_to_json(text)) for text in LONG_RANGE_INPUTS)
+        print summarize(output_format, time_calls(parse_to_json, LONG_RANGE_INPUTS, repeat)), u'json bytes={0}'.format(size)
+
+if __name__ == '__main__':
+    main()
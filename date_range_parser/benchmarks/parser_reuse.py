@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+"""parser_reuse.py
+
+Compares per-call latency of building a DateRangeParser for every call against reusing one instance
+over the inputs in data/test_inputs.txt.
+
+    python -m benchmarks.parser_reuse
+"""
+
+import date_range_parser
+from benchmarks import TZ_NAME, load_corpus, reference_time, time_calls, summarize
+
+def main(repeat=5):
+    corpus = load_corpus()
+    src_time = reference_time()
+
+    def per_call_setup(text):
+        return date_range_parser.DateRangeParser(TZ_NAME).parse(text, src_time)
+
+    reused = date_range_parser.DateRangeParser(TZ_NAME)
+    def reused_parser(text):
+        return reused.parse(text, src_time)
+
+    # Without a src_time the timezone has to be resolved to find "now".
+    def per_call_setup_now(text):
+        return date_range_parser.DateRangeParser(TZ_NAME).parse(text)
+    def reused_parser_now(text):
+        return reused.parse(text)
+
+    # Warm up imports and regex caches before timing anything.
+    reused_parser(corpus[0])
+    print summarize(u'per-call setup', time_calls(per_call_setup, corpus, repeat))
+    print summarize(u'reused DateRangeParser', time_calls(reused_parser, corpus, repeat))
+    print summarize(u'per-call setup (now)', time_calls(per_call_setup_now, corpus, repeat))
+    print summarize(u'reused DateRangeParser (now)', time_calls(reused_parser_now, corpus, repeat))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+"""result_cache.py
+
+Replays the inputs in data/test_inputs.txt the way real traffic repeats them, every input showing up
+`copies` times in a shuffled order, and compares per-call latency with and without a ResultCache.
+
+    python -m benchmarks.result_cache
+"""
+
+import random
+import cache
+import date_range_parser
+from benchmarks import TZ_NAME, load_corpus, reference_time, time_calls, summarize
+
+def main(repeat=1, copies=10, max_size=1024):
+    corpus = load_corpus()
+    replay = corpus * copies
+    random.Random(0).shuffle(replay)
+    src_time = reference_time()
+
+    result_cache = cache.ResultCache(max_size=max_size)
+    uncached = date_range_parser.DateRangeParser(TZ_NAME)
+    cached = date_range_parser.DateRangeParser(TZ_NAME, result_cache=result_cache)
+
+    uncached.parse(corpus[0], src_time)
+    print summarize(u'uncached', time_calls(lambda text: uncached.parse(text, src_time), replay, repeat))
+    print summarize(u'cached', time_calls(lambda text: cached.parse(text, src_time), replay, repeat))
+    stats = result_cache.stats()
+    print u'{label:<28} hits={hits} misses={misses} evictions={evictions} hit ratio={ratio:.2f}'.format(
+            label=u'', ratio=stats[u'hits'] / float(stats[u'hits'] + stats[u'misses']), **stats)
+
+if __name__ == '__main__':
+    main()
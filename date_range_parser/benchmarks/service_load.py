@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""service_load.py
+
+Drives service.ParseService with a fake client that keeps `concurrency` requests outstanding, the way
+an event loop serving many connections would, and reports throughput and latency from submit() to
+the Future being done. Requests are drawn from a small set of texts built from data/test_inputs.txt,
+so some of them arrive while the same parse is in flight and get coalesced. A client that gets
+ServiceBusy counts it and waits for room.
+
+    python -m benchmarks.service_load [requests]
+"""
+
+import sys
+import time
+import random
+import threading
+from service import ParseService, ServiceBusy
+from benchmarks import TZ_NAME, load_corpus, reference_time, synthetic_text, percentile
+
+def drive(service, requests, src_time, concurrency):
+    """ Submits every text in `requests` with at most `concurrency` outstanding. Returns the elapsed
+    time, the latency of each request and how many submits were turned away."""
+    slots = threading.Semaphore(concurrency)
+    latencies = []
+    rejected = 0
+
+    def done(sent):
+        latencies.append(time.time() - sent)
+        slots.release()
+
+    t0 = time.time()
+    for text in requests:
+        slots.acquire()
+        sent = time.time()
+        try:
+            future = service.submit(text, src_time)
+        except ServiceBusy:
+            rejected += 1
+            future = service.submit(text, src_time, block=True)
+        future.add_done_callback(lambda _, sent=sent: done(sent))
+    for _ in range(concurrency):
+        slots.acquire()
+    return time.time() - t0, latencies, rejected
+
+def report(label, elapsed, latencies, rejected, coalesced):
+    print (u'{label:<20} n={n:<5} {rate:8.1f} req/s p50={p50:8.3f}ms p95={p95:8.3f}ms p99={p99:8.3f}ms '
+            u'busy={rejected} coalesced={coalesced}').format(label=label, n=len(latencies),
+            rate=len(latencies) / elapsed, p50=percentile(latencies, 50) * 1000,
+            p95=percentile(latencies, 95) * 1000, p99=percentile(latencies, 99) * 1000, rejected=rejected,
+            coalesced=coalesced)
+
+def main(count=400, distinct=100, size=400, concurrency=16, workers=2, max_pending=8):
+    corpus = load_corpus()
+    src_time = reference_time()
+    texts = [synthetic_text(corpus, size, seed) for seed in range(distinct)]
+    rnd = random.Random(0)
+    requests = [rnd.choice(texts) for _ in range(count)]
+    for executor_type in (u'thread', u'process'):
+        # Each run starts from cold workers and an empty result cache, so repeats are only saved by
+        # coalescing and by whichever cache the workers built up during this run.
+        with ParseService(workers, executor_type, max_pending, TZ_NAME) as service:
+            elapsed, latencies, rejected = drive(service, requests, src_time, concurrency)
+            report(u'{0} workers={1}'.format(executor_type, workers), elapsed, latencies, rejected,
+                    service.coalesced)
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
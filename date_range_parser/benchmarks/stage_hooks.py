@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+"""stage_hooks.py
+
+Parses the inputs in data/test_inputs.txt with no instrument installed, with a MetricsRegistry and
+with a LoggingInstrument whose logger drops everything, and reports the latency of each so the cost
+of the hooks in instrumentation.py can be seen. Then prints where the time went according to the
+registry.
+
+    python -m benchmarks.stage_hooks
+"""
+
+import logging
+import date_range_parser
+import instrumentation
+from benchmarks import TZ_NAME, load_corpus, reference_time, time_calls, summarize
+
+def main(repeat=5):
+    corpus = load_corpus()
+    src_time = reference_time()
+    parser = date_range_parser.DateRangeParser(TZ_NAME)
+    parser.warmup()
+    parse = lambda text: parser.parse(text, src_time)
+    print summarize(u'no instrument', time_calls(parse, corpus, repeat))
+    registry = instrumentation.MetricsRegistry()
+    with instrumentation.installed(registry):
+        print summarize(u'MetricsRegistry', time_calls(parse, corpus, repeat))
+    logger = logging.getLogger(u'benchmarks.stage_hooks')
+    logger.addHandler(logging.NullHandler())
+    logger.propagate = False
+    with instrumentation.installed(instrumentation.LoggingInstrument(logger, logging.INFO)):
+        logger.setLevel(logging.INFO)
+        print summarize(u'LoggingInstrument', time_calls(parse, corpus, repeat))
+    stages = registry.snapshot()
+    total = stages[u'parse'][u'seconds']
+    for stage, counters in sorted(stages.iteritems(), key=lambda item: -item[1][u'seconds']):
+        print u'  {stage:<40} n={count:<6} {seconds:8.3f}s {share:6.1%} atoms={atoms}'.format(stage=stage,
+                share=counters[u'seconds'] / total, **counters)
+
+if __name__ == '__main__':
+    main()
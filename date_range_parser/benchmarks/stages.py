@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""stages.py
+
+Times every stage of DateRangeParser.parse() separately over the inputs in data/test_inputs.txt and
+over synthetic long texts built from them:
+
+    preprocess  preprocessing.preprocess_input
+    tag         DateGrammarAtomTagger.tag
+    chunk       to_tag() on every atom and TagSequenceChunker.parse
+    traverse    grammar.traverse
+    metadata    metadata.display_text and metadata.reconvertible_text
+    json        dt_tup_to_js_json_format on the first markup
+
+and reports p50/p95/p99 latencies and allocations per call. Python 2 has no tracemalloc, so
+allocations are counted as the net number of gc tracked objects (dicts, lists, atoms, ...) a stage
+leaves alive, measured with the collector turned off.
+
+The numbers can be saved as JSON and a later run compared against them, which exits with status 1 when
+a stage got slower than the threshold allows:
+
+    python -m benchmarks.stages --save baseline.json
+    python -m benchmarks.stages --compare baseline.json [--threshold 0.2]
+"""
+
+import gc
+import sys
+import json
+import argparse
+import datetime
+import subprocess
+import timeit
+from collections import OrderedDict
+import date_range_parser
+import preprocessing
+import grammar
+import metadata
+from benchmarks import TZ_NAME, load_corpus, reference_time, percentile, synthetic_text
+
+STAGES = [u'preprocess', u'tag', u'chunk', u'traverse', u'metadata', u'json']
+
+# Sizes in characters of the synthetic long texts.
+LONG_TEXT_SIZES = [2000, 20000]
+
+# Slowdowns smaller than this many seconds are timer noise, not regressions.
+NOISE_FLOOR = 0.00005
+
+def annotate(parse):
+    for p in parse:
+        p[u'display_text'] = metadata.display_text(p)
+        p[u'reconvertible_text'] = metadata.reconvertible_text(p)
+
+def to_result(parse):
+    first_markup = parse[0].get(u'markup') if parse else None
+    return [item for mu in first_markup or [] for item in date_range_parser.dt_tup_to_js_json_format(mu)]
+
+def parse_in_stages(parser, text, src_time, measure):
+    """ Does what DateRangeParser.parse() does with every stage run through measure(stage, fn, *args)."""
+    text = measure(u'preprocess', preprocessing.preprocess_input, text)
+    extractions = measure(u'tag', parser.tagger.tag, text, src_time)
+    tree = measure(u'chunk', lambda: parser.grammar_parser.parse([e.to_tag() for e in extractions]))
+    parse = measure(u'traverse', grammar.traverse, tree)
+    measure(u'metadata', annotate, parse)
+    return measure(u'json', to_result, parse)
+
+def time_stages(parser, texts, src_time, repeat):
+    """ Returns the latencies in seconds of every stage, keyed on stage."""
+    timings = dict((stage, []) for stage in STAGES)
+    def measure(stage, fn, *args):
+        t0 = timeit.default_timer()
+        result = fn(*args)
+        timings[stage].append(timeit.default_timer() - t0)
+        return result
+    for _ in range(repeat):
+        for text in texts:
+            parse_in_stages(parser, text, src_time, measure)
+    return timings
+
+def count_allocations(parser, texts, src_time):
+    """ Returns the net gc tracked objects left by every stage, keyed on stage."""
+    counts = dict((stage, []) for stage in STAGES)
+    def measure(stage, fn, *args):
+        before = gc.get_count()[0]
+        result = fn(*args)
+        counts[stage].append(gc.get_count()[0] - before)
+        return result
+    gc.collect()
+    gc.disable()
+    try:
+        for text in texts:
+            parse_in_stages(parser, text, src_time, measure)
+    finally:
+        gc.enable()
+    return counts
+
+def stage_stats(timings, allocations):
+    stats = OrderedDict()
+    for stage in STAGES + [u'total']:
+        if stage == u'total':
+            stage_timings = [sum(calls) for calls in zip(*[timings[s] for s in STAGES])]
+            stage_allocations = [sum(calls) for calls in zip(*[allocations[s] for s in STAGES])]
+        else:
+            stage_timings, stage_allocations = timings[stage], allocations[stage]
+        stats[stage] = OrderedDict([
+            (u'n', len(stage_timings)),
+            (u'mean', sum(stage_timings) / len(stage_timings)),
+            (u'p50', percentile(stage_timings, 50)),
+            (u'p95', percentile(stage_timings, 95)),
+            (u'p99', percentile(stage_timings, 99)),
+            (u'allocations', sum(stage_allocations) / float(len(stage_allocations)))])
+    return stats
+
+def run(repeat=5):
+    """ Returns the stage stats for the corpus and every long text size, keyed on label."""
+    corpus = load_corpus()
+    src_time = reference_time()
+    parser = date_range_parser.DateRangeParser(TZ_NAME)
+    parser.parse(corpus[0], src_time)
+    inputs = [(u'corpus', corpus, repeat)]
+    inputs += [(u'long-%d' % size, [synthetic_text(corpus, size, seed) for seed in range(5)], repeat)
+            for size in LONG_TEXT_SIZES]
+    results = OrderedDict()
+    for label, texts, label_repeat in inputs:
+        results[label] = stage_stats(time_stages(parser, texts, src_time, label_repeat),
+                count_allocations(parser, texts, src_time))
+    return results
+
+def report(results):
+    for label, stats in results.items():
+        print label
+        for stage, s in stats.items():
+            print u'  {stage:<12} n={n:<6} mean={mean:9.3f}ms p50={p50:9.3f}ms p95={p95:9.3f}ms p99={p99:9.3f}ms allocs={allocations:9.1f}'.format(
+                    stage=stage, n=s[u'n'], mean=s[u'mean'] * 1000, p50=s[u'p50'] * 1000, p95=s[u'p95'] * 1000,
+                    p99=s[u'p99'] * 1000, allocations=s[u'allocations'])
+
+def git_commit():
+    try:
+        return subprocess.check_output([u'git', u'rev-parse', u'HEAD'], stderr=subprocess.STDOUT).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def save(results, path):
+    baseline = OrderedDict([
+        (u'commit', git_commit()),
+        (u'python', sys.version.split()[0]),
+        (u'created', datetime.datetime.utcnow().isoformat()),
+        (u'results', results)])
+    with open(path, 'w') as f:
+        json.dump(baseline, f, indent=2)
+
+def compare(results, path, threshold):
+    """ Prints every stage's p50 and p95 against the baseline at `path` and returns the regressions,
+    stages whose p50 or p95 grew by more than `threshold` (0.2 is 20%)."""
+    with open(path) as f:
+        baseline = json.load(f)
+    print u'against {commit} ({created})'.format(commit=baseline.get(u'commit'), created=baseline.get(u'created'))
+    regressions = []
+    for label, stats in results.items():
+        for stage, s in stats.items():
+            old = baseline[u'results'].get(label, {}).get(stage)
+            if not old:
+                continue
+            ratios = dict((key, s[key] / old[key] if old[key] else 1.0) for key in (u'p50', u'p95'))
+            regressed = any(ratios[key] > 1 + threshold and s[key] - old[key] > NOISE_FLOOR for key in ratios)
+            if regressed:
+                regressions.append((label, stage))
+            print u'  {label:<12} {stage:<12} p50 x{p50:5.2f} p95 x{p95:5.2f} allocs {old_allocs:9.1f} -> {allocs:9.1f}{flag}'.format(
+                    label=label, stage=stage, p50=ratios[u'p50'], p95=ratios[u'p95'], old_allocs=old[u'allocations'],
+                    allocs=s[u'allocations'], flag=u'  REGRESSION' if regressed else u'')
+    return regressions
+
+def main(argv=None):
+    args = argparse.ArgumentParser(description=u'Per-stage parse timings.')
+    args.add_argument(u'--repeat', type=int, default=5, help=u'Passes over the corpus.')
+    args.add_argument(u'--save', metavar=u'PATH', help=u'Write the results as a JSON baseline.')
+    args.add_argument(u'--compare', metavar=u'PATH', help=u'Compare against a saved JSON baseline.')
+    args.add_argument(u'--threshold', type=float, default=0.2, help=u'Allowed slowdown before a stage counts as a regression.')
+    args = args.parse_args(argv)
+
+    results = run(args.repeat)
+    report(results)
+    if args.save:
+        save(results, args.save)
+    if args.compare and compare(results, args.compare, args.threshold):
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+"""stream_extract.py
+
+Runs streaming.iter_extract() over synthetic documents of growing size built from the inputs in
+data/test_inputs.txt, and reports throughput and the peak resident memory of the process after each.
+The documents are generated piece by piece, so memory should level off instead of growing with the
+document.
+
+    python -m benchmarks.stream_extract
+"""
+
+import time
+import resource
+import streaming
+from benchmarks import TZ_NAME, load_corpus, reference_time, synthetic_text
+
+def iter_document(corpus, size, piece_size=10000):
+    for seed in range(size // piece_size):
+        yield synthetic_text(corpus, piece_size, seed) + u' '
+
+def main(sizes=(50000, 200000, 800000)):
+    corpus = load_corpus()
+    src_time = reference_time()
+    for size in sizes:
+        t0 = time.time()
+        found = sum(1 for _ in streaming.iter_extract(iter_document(corpus, size), src_time, TZ_NAME))
+        elapsed = time.time() - t0
+        print u'{size:>9} chars {elapsed:8.2f}s {rate:8.1f} KB/s spans={found:<6} maxrss={rss}KB'.format(
+                size=size, elapsed=elapsed, rate=size / elapsed / 1000, found=found,
+                rss=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+"""tagger_modes.py
+
+Compares the time spent in DateGrammarAtomTagger.tag for each tagger mode over the preprocessed
+inputs in data/test_inputs.txt.
+
+    python -m benchmarks.tagger_modes
+"""
+
+import extraction
+import preprocessing
+from benchmarks import load_corpus, reference_time, time_calls, summarize
+
+def main(repeat=5):
+    corpus = [preprocessing.preprocess_input(text) for text in load_corpus()]
+    src_time = reference_time()
+    for mode in extraction.DateGrammarAtomTagger.MODES:
+        tagger = extraction.DateGrammarAtomTagger(src_time, mode=mode)
+        tagger.tag(corpus[0])
+        print summarize(mode, time_calls(tagger.tag, corpus, repeat))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+"""typing_latency.py
+
+Types a sentence with a date in it one character at a time at the end of texts of growing length, and
+reports the latency of each keystroke with DateRangeParser.parse() and with a ParseSession. parse()
+grows with the text while the session should stay flat.
+
+    python -m benchmarks.typing_latency
+"""
+
+import date_range_parser
+from benchmarks import TZ_NAME, load_corpus, reference_time, synthetic_text, time_calls, summarize
+
+TYPED = u' Can we meet next tuesday between 2 and 4pm?'
+
+def keystrokes(text):
+    return [text + TYPED[:i] for i in range(1, len(TYPED) + 1)]
+
+def main(sizes=(200, 1000, 4000, 16000), repeat=3):
+    corpus = load_corpus()
+    src_time = reference_time()
+    parser = date_range_parser.DateRangeParser(TZ_NAME)
+    parser.warmup()
+    for size in sizes:
+        inputs = keystrokes(synthetic_text(corpus, size))
+        print summarize(u'parse {0}'.format(size), time_calls(lambda text: parser.parse(text, src_time), inputs, repeat))
+        session = parser.session(src_time)
+        session.parse(inputs[0])
+        print summarize(u'session {0}'.format(size), time_calls(session.parse, inputs, repeat))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+"""worker_pool.py
+
+Reports the throughput of parallel.ParallelParser for a range of worker counts over the inputs in
+data/test_inputs.txt, with the in-process parse_many() as the single process reference. Each input
+gets a suffix so deduplication within a batch does not hide the parsing work.
+
+    python -m benchmarks.worker_pool [worker counts...]
+"""
+
+import sys
+import time
+import multiprocessing
+import date_range_parser
+import parallel
+from benchmarks import TZ_NAME, load_corpus, reference_time
+
+def main(worker_counts=None, copies=20):
+    worker_counts = worker_counts or sorted(set([1, 2, multiprocessing.cpu_count()]))
+    src_time = reference_time()
+    texts = [u'%s (%d)' % (text, i) for i in range(copies) for text in load_corpus()]
+
+    def report(label, fn):
+        t0 = time.time()
+        fn(texts)
+        elapsed = time.time() - t0
+        print u'{label:<16} n={n:<6} {elapsed:8.2f}s {rate:8.1f} inputs/s'.format(
+                label=label, n=len(texts), elapsed=elapsed, rate=len(texts) / elapsed)
+
+    date_range_parser.parse_many(texts[:1], src_time, TZ_NAME)
+    report(u'in-process', lambda batch: date_range_parser.parse_many(batch, src_time, TZ_NAME))
+    for workers in worker_counts:
+        # Start up and warm up are kept out of the timing.
+        with parallel.ParallelParser(workers, TZ_NAME) as parser:
+            report(u'workers=%d' % workers, lambda batch: parser.parse_many(batch, src_time))
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]])
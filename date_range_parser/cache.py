@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""cache.py
+
+A bounded LRU cache for parse results.
+
+DateRangeParser.source_time() cuts `src_time` down to the start of the day, so a result only depends
+on the preprocessed text, that day (including its tzinfo), the tz_name, the parse_type, the
+output_format and the tagger's atom_precedence and mode. ResultCache keys on exactly those. Cached
+results are handed to every caller that asks for the same key, so they are frozen first: dicts and
+lists become FrozenDict and FrozenList, and atoms become instances of a frozen_class() of their own.
+They compare and serialize like the originals but refuse to be changed.
+"""
+
+import time
+import threading
+from collections import OrderedDict
+
+class FrozenDict(dict):
+    """ A dict that raises TypeError on any attempt to change it."""
+
+    def __readonly(self, *args, **kwargs):
+        raise TypeError(u'Cached parse results are read-only')
+
+    __setitem__ = __delitem__ = __readonly
+    clear = pop = popitem = setdefault = update = __readonly
+
+    def __reduce__(self):
+        return (FrozenDict, (dict(self),))
+
+class FrozenList(list):
+    """ A list that raises TypeError on any attempt to change it."""
+
+    def __readonly(self, *args, **kwargs):
+        raise TypeError(u'Cached parse results are read-only')
+
+    __setitem__ = __delitem__ = __setslice__ = __delslice__ = __iadd__ = __imul__ = __readonly
+    append = extend = insert = pop = remove = reverse = sort = __readonly
+
+    def __reduce__(self):
+        return (FrozenList, (list(self),))
+
+def _readonly_atom(self, *args):
+    raise TypeError(u'Cached parse results are read-only')
+
+def _reduce_atom(self):
+    # Pickled as the atom it was frozen from, and frozen again on the way back.
+    atom = object.__new__(type(self).__bases__[0])
+    atom.__setstate__(self.__getstate__())
+    return (freeze, (atom,))
+
+# frozen_class() of every atom class frozen so far.
+_frozen_classes = {}
+
+def frozen_class(cls):
+    """ A subclass of the atom class `cls` whose instances raise TypeError on any attempt to change them."""
+    frozen = _frozen_classes.get(cls)
+    if frozen is None:
+        frozen = _frozen_classes.setdefault(cls, type('Frozen' + cls.__name__, (cls,), {'__slots__': (),
+                'FROZEN': True, '__setattr__': _readonly_atom, '__delattr__': _readonly_atom,
+                '__reduce__': _reduce_atom}))
+    return frozen
+
+def freeze(obj, memo=None):
+    """ Returns a read-only copy of the dicts, lists, tuples and atoms in `obj`. An atom that shows up
+    more than once is frozen once. Anything else, like datetimes, is shared as it is."""
+    # atoms imports utils, which imports this module.
+    import atoms
+    memo = {} if memo is None else memo
+    if isinstance(obj, dict):
+        return FrozenDict((key, freeze(value, memo)) for key, value in obj.iteritems())
+    elif isinstance(obj, list):
+        return FrozenList(freeze(value, memo) for value in obj)
+    elif isinstance(obj, tuple):
+        return tuple(freeze(value, memo) for value in obj)
+    elif isinstance(obj, atoms.Atom) and not getattr(obj, 'FROZEN', False):
+        frozen = memo.get(id(obj))
+        if frozen is None:
+            frozen = memo[id(obj)] = object.__new__(frozen_class(type(obj)))
+            for name, value in obj.__getstate__().iteritems():
+                object.__setattr__(frozen, name, freeze(value, memo))
+        return frozen
+    return obj
+
+def result_key(text, src_time, tz_name, parse_type, output_format=u'days', atom_precedence=None, tagger_mode=u'span'):
+    """ The cache key for a preprocessed `text` parsed against the day `src_time`. The tzinfo is kept
+    apart from the naive day because aware datetimes in different zones can compare equal.
+    `atom_precedence` is a tuple of atom classes, None for the default of the parse_type."""
+    return (text, src_time.replace(tzinfo=None), src_time.tzinfo, tz_name, parse_type, output_format,
+            atom_precedence, tagger_mode)
+
+class ResultCache(object):
+    """ ResultCache keeps the most recently used parse results up to `max_size` entries, each for at most
+    `ttl` seconds. It is safe to share between threads and between parsers.
+
+    Attributes:
+        max_size (int): Most entries kept before the least recently used one is evicted.
+        ttl (float|None): Seconds an entry stays valid. None keeps entries until they are evicted.
+        enabled (bool): When False get() always misses and put() stores nothing.
+        hits (int): Lookups answered from the cache since the last reset_stats().
+        misses (int): Lookups that were not, including expired entries.
+        evictions (int): Entries dropped to stay within `max_size`.
+        expirations (int): Entries dropped because they were older than `ttl`.
+    """
+
+    def __init__(self, max_size=1024, ttl=None, enabled=True, clock=time.time):
+        if max_size < 1:
+            raise ValueError(u'Invalid max_size. Must be at least 1')
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.max_size = max_size
+        self.ttl = ttl
+        self.enabled = enabled
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def configure(self, max_size=1024, ttl=None, enabled=True):
+        """ Change the limits or turn the cache on or off. Entries cached so far are dropped."""
+        if max_size < 1:
+            raise ValueError(u'Invalid max_size. Must be at least 1')
+        with self._lock:
+            self.max_size = max_size
+            self.ttl = ttl
+            self.enabled = enabled
+            self._entries.clear()
+
+    def get(self, key):
+        """ Returns the frozen result cached for `key` or None."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                stored, result = entry
+                if self.ttl is None or self.clock() - stored < self.ttl:
+                    # Re-insert to mark it as the most recently used.
+                    self._entries[key] = entry
+                    self.hits += 1
+                    return result
+                self.expirations += 1
+            self.misses += 1
+            return None
+
+    def put(self, key, result):
+        """ Freezes `result`, caches it for `key` and returns the frozen copy."""
+        result = freeze(result)
+        if not self.enabled:
+            return result
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (self.clock(), result)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return result
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        """ Snapshot of the counters and the current number of entries."""
+        with self._lock:
+            return {u'hits': self.hits, u'misses': self.misses, u'evictions': self.evictions,
+                    u'expirations': self.expirations, u'size': len(self._entries)}
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+            self.expirations = 0
+
+# Cache shared by the default parsers behind parse() and parse_many(). Off until configured, e.g.
+# cache.result_cache.configure(max_size=4096, ttl=3600).
+result_cache = ResultCache(enabled=False)
@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+"""cli.py
+
+Parses files of newline delimited inputs from the command line and writes one NDJSON result per input.
+
+Every line is either plain text or, with --format ndjson or a line starting with "{" in the default
+auto format, a JSON record with a "text" and optionally its own "tz_name", "date" (YYYY-MM-DD) or
+"src_time" (an ISO 8601 time on the source day) and "id". A file can be given a tz_name and date of
+its own with a query string after its path. Records override those, and they override --tz-name and
+--date:
+
+    python -m date_range_parser.cli data/test_inputs.txt 'mail.ndjson?tz_name=Europe/Paris&date=2014-08-03'
+
+Inputs are read a chunk at a time and parsed on --workers processes, and results are written in input
+order as soon as their chunk is done, so memory stays bounded however long the input is. Each result
+holds the "input" path, the "line" number and the "id" of the record, with the parse itself as chosen
+by --emit:
+
+    result   Only "result".
+    compact  "result" and "parse" in the form of parallel.compact_result().
+    full     Everything parse() returns, as to_json() writes it.
+
+Records that can not be parsed get an "error" instead. With --timing the time spent reading, parsing,
+encoding and writing and the throughput are reported on stderr when the input runs out.
+"""
+
+import os
+import sys
+import json
+import time
+import urlparse
+import argparse
+import itertools
+import collections
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import pytz
+import date_range_parser
+import parallel
+import utils
+
+INPUT_FORMATS = (u'auto', u'lines', u'ndjson')
+EMIT = (u'result', u'compact', u'full')
+
+STAGES = (u'read', u'parse', u'encode', u'write')
+
+# A record on its way to a worker: where it came from and what to parse it with. `error` is set
+# instead of `text` for records that could not be read.
+Record = collections.namedtuple('Record', 'input line id text tz_name day error')
+
+def split_input(arg):
+    """ Splits a command line input into its path and the tz_name and date of its query string. A path
+    that exists is taken as it is, "-" is stdin."""
+    if arg == u'-' or os.path.exists(arg) or u'?' not in arg:
+        return arg, None, None
+    path, query = arg.rsplit(u'?', 1)
+    options = dict((key, values[-1]) for key, values in urlparse.parse_qs(query).iteritems())
+    return path, options.get('tz_name'), options.get('date')
+
+def read_records(arg, input_format=u'auto', tz_name=None, day=None):
+    """ Yields a Record for every non blank line of the input `arg`, see split_input()."""
+    path, file_tz_name, file_day = split_input(arg)
+    tz_name = file_tz_name or tz_name
+    day = file_day or day
+    try:
+        stream = sys.stdin if path == u'-' else open(path)
+    except IOError as e:
+        # Reported like a bad record, so the other inputs still run.
+        yield Record(path, None, None, None, None, None, u'{0}: {1}'.format(type(e).__name__, e))
+        return
+    try:
+        for number, line in enumerate(stream, 1):
+            try:
+                line = line.decode('utf-8').rstrip(u'\r\n')
+            except UnicodeDecodeError as e:
+                yield Record(path, number, None, None, None, None, u'{0}: {1}'.format(type(e).__name__, e))
+                continue
+            if not line.strip():
+                continue
+            if input_format == u'lines' or input_format == u'auto' and not line.lstrip().startswith(u'{'):
+                yield Record(path, number, None, line, tz_name, day, None)
+                continue
+            try:
+                record = json.loads(line)
+                if not isinstance(record, dict) or not isinstance(record.get(u'text'), basestring):
+                    raise ValueError(u'Expected a JSON object with a "text"')
+            except ValueError as e:
+                yield Record(path, number, None, None, None, None, unicode(e))
+                continue
+            yield Record(path, number, record.get(u'id'), record[u'text'], record.get(u'tz_name') or tz_name,
+                    record.get(u'date') or record.get(u'src_time') or day, None)
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+def payload(result, emit):
+    if emit == u'result':
+        return {u'result': result.get(u'result')}
+    elif emit == u'compact':
+        return parallel.compact_result(result)
+    return dict(result)
+
+def parse_chunk(records, parse_type, output_format, emit):
+    """ Parses and encodes a chunk of records. Returns the NDJSON lines, the number of errors among them
+    and the seconds spent parsing and encoding."""
+    parse_seconds = encode_seconds = 0.0
+    lines = []
+    errors = 0
+    for record in records:
+        t0 = time.time()
+        output = {u'input': record.input, u'line': record.line, u'id': record.id}
+        if record.error is None:
+            try:
+                if record.tz_name and record.tz_name not in pytz.all_timezones_set:
+                    # Refused rather than getting a parser each.
+                    raise ValueError(u'Unknown tz_name {0}'.format(record.tz_name))
+                src_time = utils.source_day(record.day, record.tz_name) if record.day else None
+                parser = parallel.worker_parser(record.tz_name, parse_type, output_format)
+                output.update(payload(parser.parse(record.text, src_time), emit))
+            except Exception as e:
+                output[u'error'] = u'{0}: {1}'.format(type(e).__name__, e)
+        else:
+            output[u'error'] = record.error
+        errors += u'error' in output
+        t1 = time.time()
+        lines.append(date_range_parser.to_json_bytes(output) + '\n')
+        parse_seconds += t1 - t0
+        encode_seconds += time.time() - t1
+    return lines, errors, parse_seconds, encode_seconds
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+def run(inputs, out, input_format=u'auto', tz_name=None, day=None, parse_type=u'range', output_format=u'days',
+        emit=u'result', workers=None, chunk_size=64):
+    """ Parses every record of `inputs` and writes the results to `out` in order. With `workers` 0 the
+    records are parsed in this process. Returns the count of records, of errors and the seconds spent
+    in each of the STAGES. parse and encode are summed over the workers."""
+    workers = multiprocessing.cpu_count() if workers is None else workers
+    records = itertools.chain.from_iterable(read_records(arg, input_format, tz_name, day) for arg in inputs)
+    timings = dict((stage, 0.0) for stage in STAGES)
+    counts = {u'records': 0, u'errors': 0}
+
+    def write(lines, errors, parse_seconds, encode_seconds):
+        t0 = time.time()
+        out.writelines(lines)
+        out.flush()
+        timings[u'write'] += time.time() - t0
+        timings[u'parse'] += parse_seconds
+        timings[u'encode'] += encode_seconds
+        counts[u'records'] += len(lines)
+        counts[u'errors'] += errors
+
+    def read_chunks():
+        chunks = chunked(records, chunk_size)
+        while True:
+            t0 = time.time()
+            chunk = next(chunks, None)
+            timings[u'read'] += time.time() - t0
+            if chunk is None:
+                return
+            yield chunk
+
+    if not workers:
+        for chunk in read_chunks():
+            write(*parse_chunk(chunk, parse_type, output_format, emit))
+        return counts, timings
+    executor = ProcessPoolExecutor(max_workers=workers)
+    try:
+        # Two chunks per worker keep them busy while the oldest is written.
+        pending = collections.deque()
+        for chunk in read_chunks():
+            pending.append(executor.submit(parse_chunk, chunk, parse_type, output_format, emit))
+            if len(pending) >= 2 * workers:
+                write(*pending.popleft().result())
+        while pending:
+            write(*pending.popleft().result())
+    finally:
+        executor.shutdown(wait=True)
+    return counts, timings
+
+def report(counts, timings, elapsed, stream):
+    stream.write(u'{records} records, {errors} errors in {elapsed:.2f}s, {rate:.1f} records/s\n'.format(
+            elapsed=elapsed, rate=counts[u'records'] / elapsed if elapsed else 0.0, **counts))
+    for stage in STAGES:
+        per_record = timings[stage] / counts[u'records'] * 1000 if counts[u'records'] else 0.0
+        stream.write(u'  {stage:<8} {seconds:8.2f}s {per_record:8.3f}ms/record\n'.format(stage=stage,
+                seconds=timings[stage], per_record=per_record))
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=u'Parses newline delimited inputs into NDJSON results.')
+    parser.add_argument('inputs', nargs='*', default=[u'-'], metavar='INPUT',
+            help=u'Files to read, "-" for stdin. PATH?tz_name=...&date=... sets both for one file.')
+    parser.add_argument('--format', default=u'auto', choices=INPUT_FORMATS, help=u'How input lines are read.')
+    parser.add_argument('--tz-name')
+    parser.add_argument('--date', help=u'Source day, YYYY-MM-DD. Today when missing.')
+    parser.add_argument('--parse-type', default=u'range', choices=(u'range', u'exact'))
+    parser.add_argument('--output-format', default=u'days', choices=date_range_parser.OUTPUT_FORMATS)
+    parser.add_argument('--emit', default=u'result', choices=EMIT, help=u'What of each parse is written.')
+    parser.add_argument('--workers', type=int, help=u'Worker processes, 0 parses in this process. One per CPU by default.')
+    parser.add_argument('--chunk-size', type=int, default=64, help=u'Records sent to a worker at a time.')
+    parser.add_argument('--output', help=u'File to write to instead of stdout.')
+    parser.add_argument('--timing', action='store_true', help=u'Report time spent per stage on stderr.')
+    options = parser.parse_args(args)
+    if options.chunk_size < 1:
+        parser.error(u'--chunk-size must be at least 1')
+    out = open(options.output, 'wb') if options.output else sys.stdout
+    started = time.time()
+    try:
+        counts, timings = run(options.inputs, out, options.format, options.tz_name, options.date, options.parse_type,
+                options.output_format, options.emit, options.workers, options.chunk_size)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    if options.timing:
+        report(counts, timings, time.time() - started, sys.stderr)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -16,6 +16,16 @@ import datetime
 import extraction
 import preprocessing
 import metadata
+import cache
+import lazyregex
+import serialization
+import instrumentation
+
+# Shapes a result can come in, see markup_to_js_json_format().
+OUTPUT_FORMATS = (u'days', u'intervals', u'runs')
+
+# Text parsed by warmup(). It goes through every stage, including parsedatetime and splitting by days.
+WARMUP_TEXT = u'between monday 10 am and next friday afternoon'
 
 
 def dt_tup_to_js_json_format(tup):
@@ -24,6 +34,37 @@ def dt_tup_to_js_json_format(tup):
         splits = utils.split_by_days(tup[0], tup[1])
         return [js_format(s) for s in splits]
 
+def markup_to_js_json_format(markup, output_format=u'days'):
+    """ Turns markup into a result in one of the OUTPUT_FORMATS.
+        days: A {startDate, endDate} dict for every day of every markup tuple.
+        intervals: The same time as days, with overlapping and touching days merged into one dict each
+        and sorted.
+        runs: The days in order, with days that repeat the one before them a day later on the wall
+        clock folded into it. Each is a {startDate, endDate, days} dict for the first one.
+    Long ranges give one item with intervals and one per distinct daily window with runs.
+    """
+    if output_format == u'days':
+        return [item for mu in markup for item in dt_tup_to_js_json_format(mu)]
+    splits = [split for mu in markup if isinstance(mu, tuple) for split in utils.split_by_days(mu[0], mu[1])]
+    if output_format == u'intervals':
+        return [{u'startDate': dt_to_js_json_format(start), u'endDate': dt_to_js_json_format(end)}
+                for start, end in utils.merge_intervals(splits)]
+    return [{u'startDate': dt_to_js_json_format(start), u'endDate': dt_to_js_json_format(end), u'days': days}
+            for start, end, days in utils.daily_runs(splits)]
+
+def copy_result(result):
+    """ Returns a copy of the dicts, lists and tuples in `result`, sharing the datetimes and atoms in it.
+    Frozen results from a cache are returned as they are, nothing can change them."""
+    if isinstance(result, (cache.FrozenDict, cache.FrozenList)):
+        return result
+    elif isinstance(result, dict):
+        return dict((key, copy_result(value)) for key, value in result.iteritems())
+    elif isinstance(result, list):
+        return [copy_result(value) for value in result]
+    elif isinstance(result, tuple):
+        return tuple(copy_result(value) for value in result)
+    return result
+
 def dt_to_js_json_format(dt):
     if isinstance(dt, datetime.datetime):
         dt = dt.replace(second=0, microsecond=0)
@@ -31,52 +72,266 @@ def dt_to_js_json_format(dt):
     else:
         return None
 
-def parse(text, src_time=None, tz_name=None, parse_type=u'range', limit=1):
-    if not src_time:
-        try:
-            user_tz = pytz.timezone(tz_name)
-            src_time = user_tz.normalize(datetime.datetime.now(pytz.utc).astimezone(user_tz))
-        except pytz.exceptions.UnknownTimeZoneError:
-            # Should probably return a flag to the user that it was parsed with UTC defaults.
-            src_time = datetime.datetime.utcnow()
-    # src_time should represent today and nothing else.
-    src_time = src_time.replace(hour=0, minute=0, second=0, microsecond=0)
-    # Sanitize the string and apply spelling correction.
-    text = preprocessing.preprocess_input(text)
-
-    # Search through the text for Atoms.
-    tagger = extraction.DateGrammarAtomTagger(src_time, parse_type=parse_type);
-    # Convert the atoms to tags.
-    extractions = tagger.tag(text)
-    #print "------ extractions ------"
-    #print [e.to_tag() for e in extractions]
-    #print "-------------------------\n"
-
-    # Choose the correct grammar type we want to parse for.
-    if parse_type == u'range':
-        grammar_parser = grammar.range_grammar_regex_parser
-    elif parse_type == u'exact':
-        grammar_parser = grammar.exact_grammar_regex_parser
-    else:
-        return dict(result=[], parse=None)
-
-    # Run it through the NLTK tagger with our specified grammar.
-    parse_tree = grammar_parser.parse([e.to_tag() for e in extractions])
-    # Traverse the tree and compute the result.
-    parse = grammar.traverse(parse_tree)
-    # Append the plain text interpretation for each parse.
-    for p in parse:
-        p[u'display_text'] = metadata.display_text(p)
-        p[u'reconvertible_text'] = metadata.reconvertible_text(p)
-
-    if len(parse) > 0:
-        first_markup = parse[0].get(u'markup')
-        if first_markup:
-            # Return it in the format the client expects.
-            result = [item for mu in first_markup for item in dt_tup_to_js_json_format(mu)]
-            return dict(result=result, parse=parse)
-    return dict(result=[], parse=None)
-
-
-def to_json(results):
-    return utils.DateRangeParserEncoder().encode(results)
+class DateRangeParser(object):
+    """DateRangeParser holds everything a parse needs that does not depend on the input text, so it
+    can be built once and reused across calls.
+
+    Attributes:
+        tz_name (string|unicode): Timezone used to compute "now" when no `src_time` is given.
+        timezone (tzinfo): The resolved pytz timezone or None if `tz_name` is missing or unknown.
+        parse_type (unicode): Either u'range' or u'exact'.
+        tagger (DateGrammarAtomTagger): Tagger that is reused for every call to parse(). `tagger_mode`
+        is passed through as its `mode`.
+        grammar_parser (TagSequenceChunker): Grammar matching `parse_type`.
+        result_cache (ResultCache|None): Cache consulted before parsing. Results from a cache are frozen.
+        output_format (unicode): One of OUTPUT_FORMATS, see markup_to_js_json_format().
+
+    parse() can be given a time budget in `deadline_ms`. The tagger checks it before each atom class and
+    each match, and when it runs out the atoms found so far go through the grammar as usual. The result
+    then has `partial` set and is not cached. `max_length` cuts the text down before anything else is
+    done with it, see preprocessing.truncate(), and sets `truncated` on the result.
+    """
+
+    def __init__(self, tz_name=None, parse_type=u'range', atom_precedence=None, tagger_mode=u'span',
+            result_cache=None, output_format=u'days'):
+        self.tz_name = tz_name
+        self.timezone = None
+        if tz_name:
+            try:
+                self.timezone = pytz.timezone(tz_name)
+            except pytz.exceptions.UnknownTimeZoneError:
+                pass
+        self.parse_type = parse_type
+        # Choose the correct grammar type we want to parse for.
+        if parse_type == u'range':
+            self.grammar_parser = grammar.range_grammar_regex_parser
+        elif parse_type == u'exact':
+            self.grammar_parser = grammar.exact_grammar_regex_parser
+        else:
+            raise ValueError(u'Invalid parse_type. Try "range" or "exact"')
+        self.tagger = extraction.DateGrammarAtomTagger(parse_type=parse_type, atom_precedence=atom_precedence,
+                mode=tagger_mode)
+        self.result_cache = result_cache
+        # Parsers that tag differently can share a cache without seeing each other's results.
+        self.__precedence = tuple(atom_precedence) if atom_precedence else None
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(u'Invalid output_format. Try "days", "intervals" or "runs"')
+        self.output_format = output_format
+
+    def source_time(self, src_time=None):
+        """ Returns the start of the day `src_time` falls on, defaulting to today in the parser's timezone."""
+        if not src_time:
+            if self.timezone:
+                src_time = self.timezone.normalize(datetime.datetime.now(pytz.utc).astimezone(self.timezone))
+            else:
+                # Should probably return a flag to the user that it was parsed with UTC defaults.
+                src_time = datetime.datetime.utcnow()
+        # src_time should represent today and nothing else.
+        return src_time.replace(hour=0, minute=0, second=0, microsecond=0)
+
+    def warmup(self):
+        """ Parses WARMUP_TEXT so the first real parse does not pay for building calendars and patterns."""
+        # Without a timezone "now" is naive and parsedatetime results can't be localized to it.
+        self.parse(WARMUP_TEXT, None if self.timezone else datetime.datetime.now(pytz.utc))
+
+    def parse(self, text, src_time=None, deadline_ms=None, max_length=None):
+        # Anything but a string parses like an empty one, as preprocessing.sanitize_string() has it.
+        if not isinstance(text, basestring):
+            text = u''
+        with instrumentation.start(u'parse', len(text)) as timer:
+            deadline = utils.Deadline(deadline_ms) if deadline_ms is not None else None
+            src_time = self.source_time(src_time)
+            capped = preprocessing.truncate(text, max_length)
+            # Sanitize the string and apply spelling correction.
+            with instrumentation.start(u'preprocess', len(capped)) as preprocess_timer:
+                nltext = preprocessing.preprocess_input(capped)
+                preprocess_timer.stop()
+            result = self.__parse_cached(nltext, src_time, deadline)
+            if len(capped) < len(text):
+                result = dict(result, truncated=True)
+            timer.stop()
+        return result
+
+    def parse_many(self, texts, src_time=None):
+        """ Parses every text in `texts` against one `src_time` and returns the results in input order.
+
+        The source day is computed once for the whole batch and texts that are identical after
+        preprocessing are only parsed once. Their repeats get a copy_result() of the first one.
+        """
+        src_time = self.source_time(src_time)
+        parsed = {}
+        results = []
+        for text in texts:
+            text = preprocessing.preprocess_input(text)
+            result = parsed.get(text)
+            if result is None:
+                result = parsed[text] = self.__parse_cached(text, src_time)
+            else:
+                result = copy_result(result)
+            results.append(result)
+        return results
+
+    def parse_all(self, text, src_time=None):
+        """ Returns every parse in `text` in the order they appear, each as a dict with
+            result: The parse's markup in the format parse() returns for the first one.
+            parse: The parse itself, like the items of parse()['parse'].
+            start, end: Offsets in `text` of the text that produced the parse, with `match` set to it.
+            spans: (start, end) in `text` for each atom of the parse.
+        The atoms are found in one pass over the whole text, nothing is parsed twice.
+        """
+        src_time = self.source_time(src_time)
+        nltext, starts, ends = preprocessing.preprocess_with_offsets(text)
+        atom_spans = {}
+        extractions = []
+        for start, end, atom in self.tagger.tag_spans(nltext, src_time):
+            atom_spans[id(atom)] = self.__source_span(start, end, starts, ends, len(text))
+            extractions.append(atom)
+        parse_tree = self.grammar_parser.parse([e.to_tag() for e in extractions])
+        results = []
+        for p, leaves in grammar.traverse_chunks(parse_tree):
+            self.__annotate(p)
+            spans = [atom_spans[id(leaf[2])] for leaf in leaves]
+            # Filler at either end, like a full stop after the date, is not part of the match.
+            first, last = 0, len(leaves)
+            while last - first > 1 and leaves[first][1] == u'FILL':
+                first += 1
+            while last - first > 1 and leaves[last - 1][1] == u'FILL':
+                last -= 1
+            start = min(span[0] for span in spans[first:last])
+            end = max(span[1] for span in spans[first:last])
+            # Operand atoms carry the whitespace around them.
+            match = text[start:end]
+            start += len(match) - len(match.lstrip())
+            end -= len(match) - len(match.rstrip())
+            markup = p.get(u'markup')
+            results.append(dict(result=markup_to_js_json_format(markup, self.output_format) if markup else [], parse=p,
+                    start=start, end=end, match=text[start:end], spans=spans))
+        return results
+
+    def __source_span(self, start, end, starts, ends, length):
+        """ Maps offsets in the preprocessed text back to the original one."""
+        if start >= len(starts):
+            return (length, length)
+        elif end <= start:
+            return (starts[start], starts[start])
+        return (starts[start], ends[end - 1])
+
+    def __annotate(self, parse):
+        # Append the plain text interpretation for each parse.
+        parse[u'display_text'] = metadata.display_text(parse)
+        parse[u'reconvertible_text'] = metadata.reconvertible_text(parse)
+
+    def __parse_cached(self, text, src_time, deadline=None):
+        if self.result_cache is None or not self.result_cache.enabled:
+            return self.__parse_preprocessed(text, src_time, deadline)
+        key = cache.result_key(text, src_time, self.tz_name, self.parse_type, self.output_format, self.__precedence,
+                self.tagger.mode)
+        result = self.result_cache.get(key)
+        if result is None:
+            result = self.__parse_preprocessed(text, src_time, deadline)
+            if not result.get(u'partial'):
+                result = self.result_cache.put(key, result)
+        return result
+
+    def __parse_preprocessed(self, text, src_time, deadline=None):
+        # Search through the text for Atoms.
+        extractions = self.tagger.tag(text, src_time, deadline)
+        #print "------ extractions ------"
+        #print [e.to_tag() for e in extractions]
+        #print "-------------------------\n"
+
+        # Chunk the tags with our specified grammar.
+        parse_tree = self.grammar_parser.parse([e.to_tag() for e in extractions])
+        # Traverse the tree and compute the result.
+        parse = grammar.traverse(parse_tree)
+        with instrumentation.start(u'metadata', len(parse)) as timer:
+            for p in parse:
+                self.__annotate(p)
+            timer.stop()
+        result = self.to_result(parse)
+        if deadline is not None and deadline.reached:
+            result[u'partial'] = True
+        return result
+
+    def interpret(self, chunk):
+        """ Returns the annotated parse of a top level chunk of the grammar tree, or None if it has none."""
+        parse = grammar.traverse(chunk)
+        if parse:
+            with instrumentation.start(u'metadata', 1) as timer:
+                self.__annotate(parse)
+                timer.stop()
+        return parse
+
+    def to_result(self, parse, result=None):
+        """ Returns what parse() returns for the list of parses found in a text. `result` can be passed
+        in when the first parse's result is already known."""
+        with instrumentation.start(u'format', len(parse)) as timer:
+            formatted = dict(result=[], parse=None)
+            if len(parse) > 0:
+                first_markup = parse[0].get(u'markup')
+                if first_markup:
+                    # Return it in the format the client expects.
+                    if result is None:
+                        result = markup_to_js_json_format(first_markup, self.output_format)
+                    formatted = dict(result=result, parse=parse)
+            timer.stop()
+        return formatted
+
+    def session(self, src_time=None, margin=None):
+        """ Returns an incremental.ParseSession that parses successive edits of one text, as it is
+        typed, against `src_time`."""
+        import incremental
+        return incremental.ParseSession(self, src_time, margin)
+
+
+# Parsers shared by parse(), keyed on (tz_name, parse_type, output_format).
+_default_parsers = {}
+
+def default_parser(tz_name=None, parse_type=u'range', output_format=u'days'):
+    """ Returns the shared DateRangeParser for `tz_name`, `parse_type` and `output_format`, building it
+    on first use."""
+    key = (tz_name, parse_type, output_format)
+    parser = _default_parsers.get(key)
+    if parser is None:
+        parser = _default_parsers.setdefault(key, DateRangeParser(tz_name, parse_type=parse_type,
+                result_cache=cache.result_cache, output_format=output_format))
+    return parser
+
+def warmup(tz_name=None, parse_types=(u'range', u'exact')):
+    """ Does the work importing the package leaves for the first parse. It compiles every pattern, loads
+    parsedatetime and builds the default parsers for `tz_name`. Long running services can call it at
+    start up, one-off scripts can skip it."""
+    lazyregex.compile_lazy_regexes()
+    for parse_type in parse_types:
+        default_parser(tz_name, parse_type).warmup()
+
+def parse(text, src_time=None, tz_name=None, parse_type=u'range', limit=1, output_format=u'days', deadline_ms=None,
+        max_length=None):
+    return default_parser(tz_name, parse_type, output_format).parse(text, src_time, deadline_ms, max_length)
+
+def parse_all(text, src_time=None, tz_name=None, parse_type=u'range', output_format=u'days'):
+    """ Returns every parse in `text` with its offsets, see DateRangeParser.parse_all()."""
+    return default_parser(tz_name, parse_type, output_format).parse_all(text, src_time)
+
+def parse_session(src_time=None, tz_name=None, parse_type=u'range', output_format=u'days'):
+    """ Returns a session for parsing a text as it is typed, see DateRangeParser.session()."""
+    return default_parser(tz_name, parse_type, output_format).session(src_time)
+
+def parse_many(texts, src_time=None, tz_name=None, parse_type=u'range', workers=None, output_format=u'days'):
+    """ Parses a batch of texts in input order. With `workers` the batch is spread over that many
+    processes by parallel.ParallelParser and the results come back in its compact form. The pool is
+    kept for later calls with the same settings, see parallel.shared_parser()."""
+    if workers:
+        import parallel
+        return parallel.shared_parser(workers, tz_name, parse_type, output_format).parse_many(texts, src_time)
+    return default_parser(tz_name, parse_type, output_format).parse_many(texts, src_time)
+
+
+def to_json(results, compact=False):
+    """ Encodes `results` as a JSON string, see serialization.dumps()."""
+    return serialization.dumps(results, compact)
+
+def to_json_bytes(results, compact=False):
+    """ Encodes `results` as UTF-8 JSON bytes with the fastest JSON library installed, see
+    serialization.dumps_bytes()."""
+    return serialization.dumps_bytes(results, compact)
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""day_table.py
+
+Precomputed tables of the calendar, so natural ranges like "next 3 weekends" or "2 months" are index
+lookups rather than relativedelta arithmetic on every call.
+
+A DayTable covers whole months `years` years either side of its anchor day. For every day it holds
+the Monday its week starts on, the Saturday of the weekend natural_date_range counts it in (the
+coming one, or the day before on a Sunday), its month and the tzinfo in effect at its midnight in the
+table's timezone. For every month it holds the first day. Days are proleptic Gregorian ordinals, see
+date.toordinal().
+
+DayTables hands out tables per timezone. The one around today is built on first use and again once
+the day rolls over in that timezone. Days outside it get a table around themselves, and the last few
+of those are kept as well.
+"""
+
+import time
+import bisect
+import datetime
+import threading
+import pytz
+
+# Years either side of the anchor day a table covers.
+YEARS = 5
+
+# Tables kept per timezone besides the one around today.
+MAX_OTHER_TABLES = 4
+
+SATURDAY = 5
+SUNDAY = 6
+
+def weekday(ordinal):
+    """ Day of the week of a date ordinal, Monday is 0 like date.weekday()."""
+    return (ordinal - 1) % 7
+
+class DayTable(object):
+    """DayTable holds the calendar of the months around `anchor`.
+
+    Attributes:
+        zone (string|None): pytz timezone of the midnights, None leaves them to the caller.
+        anchor (int): Ordinal of the day the table was built around.
+        first, last (int): Ordinals of the first day covered and of the day after the last one.
+        week_starts, weekend_starts, months (list): Per day, indexed by ordinal - first. months holds
+        indexes into month_starts.
+        month_starts (list): Ordinal of the first day of every month covered, and of the month after.
+        tzinfos (list|None): Per day, the tzinfo pytz's localize() gives its midnight.
+    """
+
+    def __init__(self, zone, anchor, years=YEARS):
+        self.zone = zone
+        self.anchor = anchor
+        day = datetime.date.fromordinal(anchor)
+        first_month = (day.year - years) * 12 + day.month - 1
+        self.month_starts = [datetime.date(month // 12, month % 12 + 1, 1).toordinal()
+                for month in xrange(first_month, first_month + 24 * years + 2)]
+        self.first, self.last = self.month_starts[0], self.month_starts[-1]
+        self.months = []
+        for month in xrange(len(self.month_starts) - 1):
+            self.months.extend([month] * (self.month_starts[month + 1] - self.month_starts[month]))
+        self.week_starts = []
+        self.weekend_starts = []
+        for ordinal in xrange(self.first, self.last):
+            day_of_week = weekday(ordinal)
+            self.week_starts.append(ordinal - day_of_week)
+            self.weekend_starts.append(ordinal - 1 if day_of_week == SUNDAY else ordinal + SATURDAY - day_of_week)
+        self.tzinfos = self.__midnight_tzinfos(pytz.timezone(zone)) if zone else None
+
+    def __midnight_tzinfos(self, tz):
+        # The tzinfo only changes on the local day of a DST change or the day after, so it is only
+        # looked up there. UTC offsets are within a day, so that is at most two days either side of
+        # the change in UTC.
+        transitions = getattr(tz, '_utc_transition_times', None) or []
+        lo = bisect.bisect_left(transitions, datetime.datetime.fromordinal(max(self.first - 2, 1)))
+        hi = bisect.bisect_right(transitions, datetime.datetime.fromordinal(self.last + 2))
+        changes = set([self.first])
+        for transition in transitions[lo:hi]:
+            day = transition.toordinal()
+            changes.update(ordinal for ordinal in xrange(day - 1, day + 3) if self.first < ordinal < self.last)
+        changes = sorted(changes)
+        tzinfos = []
+        for start, end in zip(changes, changes[1:] + [self.last]):
+            tzinfos.extend([tz.localize(datetime.datetime.fromordinal(start)).tzinfo] * (end - start))
+        return tzinfos
+
+    def __contains__(self, ordinal):
+        return self.first <= ordinal < self.last
+
+    def week_start(self, ordinal):
+        return self.week_starts[ordinal - self.first]
+
+    def weekend_start(self, ordinal):
+        return self.weekend_starts[ordinal - self.first]
+
+    def month(self, ordinal):
+        """ Index in month_starts of the month of `ordinal`."""
+        return self.months[ordinal - self.first]
+
+    def month_start(self, month):
+        """ First day of the month at index `month`, or None when it is not covered."""
+        return self.month_starts[month] if 0 <= month < len(self.month_starts) else None
+
+    def midnight(self, ordinal, tzinfo=None):
+        """ The midnight that starts the day, localized in the table's zone. Tables without one attach
+        `tzinfo` as it is."""
+        if self.tzinfos is not None:
+            tzinfo = self.tzinfos[ordinal - self.first]
+        return datetime.datetime.fromordinal(ordinal).replace(tzinfo=tzinfo)
+
+class DayTables(object):
+    """DayTables builds and keeps DayTables per timezone.
+
+    Attributes:
+        years (int): Years either side of its anchor each table covers.
+        max_other_tables (int): Tables kept per timezone besides the one around today.
+        clock (function): Returns the time in seconds since the epoch, for telling when the day rolls
+        over.
+    """
+
+    def __init__(self, years=YEARS, max_other_tables=MAX_OTHER_TABLES, clock=time.time):
+        self.years = years
+        self.max_other_tables = max_other_tables
+        self.clock = clock
+        # Per zone, the table around today first and then the others, most recently built first.
+        self._tables = {}
+        # Per zone, (ordinal of today, when it stops being today).
+        self._today = {}
+        self._lock = threading.Lock()
+
+    def today(self, zone):
+        """ Ordinal of today in `zone`, UTC when it is None."""
+        now = self.clock()
+        today, expires = self._today.get(zone, (None, 0))
+        if now >= expires:
+            tz = pytz.timezone(zone) if zone else pytz.utc
+            day = datetime.datetime.fromtimestamp(now, tz).date()
+            midnight = tz.localize(datetime.datetime.fromordinal(day.toordinal() + 1))
+            today = day.toordinal()
+            self._today[zone] = (today, now + (midnight - datetime.datetime.fromtimestamp(now, tz)).total_seconds())
+        return today
+
+    def table(self, tzinfo, ordinal):
+        """ Returns a DayTable for the timezone of `tzinfo` that covers the day `ordinal`."""
+        zone = getattr(tzinfo, 'zone', None)
+        today = self.today(zone)
+        tables = self._tables.get(zone)
+        if tables is None or tables[0].anchor != today:
+            # First use, or the day rolled over.
+            current = DayTable(zone, today, self.years)
+            with self._lock:
+                tables = self._tables[zone] = [current] + (self._tables.get(zone) or [])[1:]
+        for table in tables:
+            if ordinal in table:
+                return table
+        table = DayTable(zone, ordinal, self.years)
+        with self._lock:
+            tables = self._tables[zone]
+            tables[1:] = ([table] + tables[1:])[:self.max_other_tables]
+        return table
+
+    def clear(self):
+        with self._lock:
+            self._tables.clear()
+            self._today.clear()
+
+# Tables used by natural_date_range.
+day_tables = DayTables()
@@ -7,42 +7,236 @@
 Looks for a sequence of tagged atoms in a string of text.
 """
 
+import re
 import atoms
+import natural_date_range
+import instrumentation
+from utils import search_fragment, expired
+
+# Order in which atoms get to claim text for each parse type.
+RANGE_ATOM_PRECEDENCE = [atoms.AbsoluteInnerDayModifierAtom,
+        atoms.AbsoluteOneWayInnerDayModifierAtom, atoms.NaturalInnerDayModifierAtom,
+        atoms.RelativeOneWayMultiDayModifierAtom, atoms.OperandAtom,
+        atoms.NaturalDaterangeAtom, atoms.CalendarDateRangeAtom, atoms.FillerAtom]
+
+EXACT_ATOM_PRECEDENCE = [
+        #atoms.ReferencePointModifierAtom,
+        atoms.AbsoluteInnerDayModifierAtom,
+        #atoms.AbsoluteOneWayInnerDayModifierAtom,
+        #atoms.NaturalInnerDayModifierAtom,
+        atoms.OperandAtom, atoms.NaturalDaterangeAtom, atoms.CalendarDateRangeAtom, atoms.FillerAtom]
+
+# Atoms that are found with a single regular expression and can be folded into DateGrammarLexer, as
+# (AtomClass, expression, head expression, factory). The combined pattern is compiled without re.M, so
+# the multiline `^` of AbsoluteInnerDayModifierAtom is spelled out as a newline lookbehind. Head
+# expressions are only tried at the start of a fragment, see utils.search_fragment.
+_ABS_INNER_DAY_EXP = atoms.AbsoluteInnerDayModifierAtom.EXTRACTION_EXP.replace(r'(\s|^)', r'(\s|(?<=\n))')
+_ABS_INNER_DAY_HEAD_EXP = atoms.AbsoluteInnerDayModifierAtom.SPAN_HEAD_EXP.replace(r'(\s|^)', r'(\s|(?<=\n))')
+LEXER_ATOMS = [
+        (atoms.AbsoluteInnerDayModifierAtom, _ABS_INNER_DAY_EXP, _ABS_INNER_DAY_HEAD_EXP,
+            lambda match, src_time: atoms.AbsoluteInnerDayModifierAtom(match)),
+        (atoms.AbsoluteOneWayInnerDayModifierAtom, atoms.AbsoluteOneWayInnerDayModifierAtom.EXTRACTION_EXP,
+            atoms.AbsoluteOneWayInnerDayModifierAtom.EXTRACTION_EXP,
+            lambda match, src_time: atoms.AbsoluteOneWayInnerDayModifierAtom(match, src_time)),
+        (atoms.NaturalInnerDayModifierAtom, atoms.NaturalInnerDayModifierAtom.EXTRACTION_EXP,
+            atoms.NaturalInnerDayModifierAtom.EXTRACTION_EXP,
+            lambda match, src_time: atoms.NaturalInnerDayModifierAtom(match)),
+        (atoms.RelativeOneWayMultiDayModifierAtom, atoms.RelativeOneWayMultiDayModifierAtom.EXTRACTION_EXP,
+            atoms.RelativeOneWayMultiDayModifierAtom.EXTRACTION_EXP,
+            lambda match, src_time: atoms.RelativeOneWayMultiDayModifierAtom(match, src_time)),
+        (atoms.OperandAtom, atoms.OperandAtom.EXTRACTION_EXP, atoms.OperandAtom.SPAN_HEAD_EXP,
+            lambda match, src_time: atoms.OperandAtom(match)),
+        (atoms.NaturalDaterangeAtom, natural_date_range.NATURAL_RANGE_EXP, natural_date_range.NATURAL_RANGE_EXP,
+            lambda match, src_time: atoms.NaturalDaterangeAtom(match, src_time))]
+
+class DateGrammarLexer(object):
+    """ DateGrammarLexer folds the regex based atoms at the front of an atom precedence into one
+    alternation with a named group per atom, ordered by precedence, and tokenizes the text in a single
+    scan. The atoms after them (parsedatetime and filler) are left for the gaps in between.
+
+    A plain leftmost scan would let a low precedence atom claim text that the pass based tagger gives
+    to a higher precedence one, so two corrections keep the output the same:
+        - A token only acts as the start of a fragment (`^`) for atoms of its own or lower precedence.
+        - When a higher precedence atom matches starting inside a token, it wins and the text before
+          it is tokenized again as a fragment of its own.
+
+    Attributes:
+        lexed_atoms (list): Atom classes matched by the combined regex, in order of precedence.
+        remaining_atoms (list): The rest of the atom precedence, still to be run over the gaps.
+    """
+
+    def __init__(self, atom_precedence):
+        known = dict((entry[0], entry) for entry in LEXER_ATOMS)
+        entries = []
+        for AtomClass in atom_precedence:
+            if AtomClass not in known:
+                break
+            entries.append(known[AtomClass])
+        self.lexed_atoms = [entry[0] for entry in entries]
+        self.remaining_atoms = list(atom_precedence[len(entries):])
+        self.factories = [entry[3] for entry in entries]
+        def alternation(head_from, end=len(entries)):
+            groups = [u'(?P<atom%d>%s)' % (i, entry[2] if i >= head_from else entry[1]) for i, entry in enumerate(entries[:end])]
+            return re.compile(u'|'.join(groups), flags=re.X|re.I) if groups else None
+        self.regex = alternation(len(entries))
+        # head_regexes[i] lets atoms i and after match at the start of a fragment.
+        self.head_regexes = [alternation(i) for i in range(len(entries) + 1)]
+        # higher_regexes[i] matches any atom of higher precedence than atom i.
+        self.higher_regexes = [alternation(len(entries), end=i) for i in range(len(entries))]
+
+    def tokenize(self, text, src_time, pos=0, endpos=None, previous=-1, deadline=None):
+        """ Returns the (start, end, atom) items of the text between pos and endpos, with atom None for
+        the gaps no lexed atom claimed. Blank gaps are left out. `previous` is the precedence of the
+        token that ends at pos, if any. Once `deadline` expires the rest is left as a gap."""
+        endpos = len(text) if endpos is None else endpos
+        chunks = []
+        while self.regex and pos < endpos and not expired(deadline):
+            match = search_fragment(self.regex, text, pos, endpos, head_regex=self.head_regexes[max(previous, 0)])
+            if not match or match.end() <= match.start():
+                break
+            match, index = self.__claim(text, match, endpos)
+            if text[pos:match.start()].strip():
+                # The token ends the fragment before it, which can change what matches there.
+                chunks.extend(self.tokenize(text, src_time, pos, match.start(), previous, deadline))
+            chunks.append((match.start(), match.end(), self.factories[index](match.group(), src_time)))
+            pos, previous = match.end(), index
+        if text[pos:endpos].strip():
+            chunks.append((pos, endpos, None))
+        return chunks
+
+    def __index(self, match):
+        return int(match.lastgroup[len(u'atom'):])
+
+    def __claim(self, text, match, endpos):
+        """ Hands the token over to any higher precedence atom that starts inside it."""
+        index = self.__index(match)
+        while index > 0:
+            higher = self.higher_regexes[index]
+            overlap = None
+            for overlap_pos in xrange(match.start() + 1, match.end()):
+                overlap = higher.match(text, overlap_pos, endpos)
+                if overlap and overlap.end() > overlap.start():
+                    break
+                overlap = None
+            if overlap is None:
+                break
+            match, index = overlap, self.__index(overlap)
+        return match, index
 
 class DateGrammarAtomTagger(object):
+    """ Runs each atom class over the text left unclaimed by the atoms before it.
 
-    def __init__(self, src_time, parse_type=u'range'):
-        if src_time:
-            self.src_time = src_time
-            self.parse_type = parse_type
-            if parse_type == u'range':
-                self.atom_precedence = [atoms.AbsoluteInnerDayModifierAtom,
-                        atoms.AbsoluteOneWayInnerDayModifierAtom, atoms.NaturalInnerDayModifierAtom,
-                        atoms.RelativeOneWayMultiDayModifierAtom, atoms.OperandAtom,
-                        atoms.NaturalDaterangeAtom, atoms.CalendarDateRangeAtom, atoms.FillerAtom]
-            elif parse_type == u'exact':
-                self.atom_precedence = [
-                        #atoms.ReferencePointModifierAtom,
-                        atoms.AbsoluteInnerDayModifierAtom,
-                        #atoms.AbsoluteOneWayInnerDayModifierAtom,
-                        #atoms.NaturalInnerDayModifierAtom,
-                        atoms.OperandAtom, atoms.NaturalDaterangeAtom, atoms.CalendarDateRangeAtom, atoms.FillerAtom]
-            else:
-                raise ValueError(u'Invalid parse_type. Try "range" or "exact"')
+    `mode` picks how the text is walked. u'span' (the default) keeps one string and passes offsets
+    around, u'sequential' is the original implementation that copies the remainder after every match
+    and u'lexer' tokenizes the regex based atoms in one scan with DateGrammarLexer.
+
+    tag() and tag_spans() take an optional utils.Deadline. It is checked before every atom class and
+    every match, and once it expires the atoms found so far are returned.
+    """
+
+    MODES = (u'span', u'sequential', u'lexer')
+
+    def __init__(self, src_time=None, parse_type=u'range', atom_precedence=None, mode=u'span'):
+        # src_time may be left out here and passed to tag() instead, which lets a single
+        # tagger be reused across calls.
+        self.src_time = src_time
+        self.parse_type = parse_type
+        if mode not in self.MODES:
+            raise ValueError(u'Invalid mode. Try "span", "sequential" or "lexer"')
+        self.mode = mode
+        if atom_precedence:
+            self.atom_precedence = list(atom_precedence)
+        elif parse_type == u'range':
+            self.atom_precedence = RANGE_ATOM_PRECEDENCE
+        elif parse_type == u'exact':
+            self.atom_precedence = EXACT_ATOM_PRECEDENCE
         else:
-            raise ValueError(u'Insufficient Parameters. `src_time` required or `src_time` and `atom_precedence`')
+            raise ValueError(u'Invalid parse_type. Try "range" or "exact"')
+        self.lexer = DateGrammarLexer(self.atom_precedence) if mode == u'lexer' else None
+
+    def tag(self, nltext, src_time=None, deadline=None):
+        src_time = src_time or self.src_time
+        if not src_time:
+            raise ValueError(u'Insufficient Parameters. `src_time` required either at init or when tagging')
+        with instrumentation.start(u'tag', len(nltext)) as timer:
+            if self.mode == u'span':
+                spans = self.__tag_spans([(0, len(nltext), None)], nltext, src_time, self.atom_precedence, deadline)
+                extractions = [atom for start, end, atom in spans]
+            elif self.mode == u'lexer':
+                chunks = self.__tokenize(nltext, src_time, 0, len(nltext), deadline)
+                spans = self.__tag_spans(chunks, nltext, src_time, self.lexer.remaining_atoms, deadline)
+                extractions = [atom for start, end, atom in spans]
+            else:
+                extractions = self.__tag_sequential(nltext, src_time, deadline)
+            timer.stop(len(extractions))
+        return extractions
 
-    def tag(self, nltext):
+    def __tag_sequential(self, nltext, src_time, deadline=None):
         result = [nltext]
         # Utility to functions to unpack nested lists and only run extract on non-strings.
-        def extract_or_passback(extract_fn, atom_or_str): return extract_fn(atom_or_str, self.src_time, parse_type=self.parse_type) if isinstance(atom_or_str, basestring) else atom_or_str
+        def extract_or_passback(extract_fn, atom_or_str): return extract_fn(atom_or_str, src_time, parse_type=self.parse_type) if isinstance(atom_or_str, basestring) else atom_or_str
         def inner_unpack(maybe_list): return [item for item in maybe_list] if isinstance(maybe_list, list) else [maybe_list]
         def unpack(nested_list): return [item for inner in nested_list for item in inner_unpack(inner)]
         # Run the extract_atom static method for each class in order of precedence.
         for AtomClass in self.atom_precedence:
-            result = unpack([(extract_or_passback(AtomClass.extract_atom, atom_or_str)) for atom_or_str in result])
+            if expired(deadline):
+                break
+            with instrumentation.start(u'tag.' + AtomClass.__name__, len(nltext)) as timer:
+                result = unpack([(extract_or_passback(AtomClass.extract_atom, atom_or_str)) for atom_or_str in result])
+                timer.stop()
         # When we're done, remove any items that are basestrings.
         return filter(lambda r: not isinstance(r, basestring), result)
 
+    def __tag_spans(self, chunks, nltext, src_time, atom_precedence, deadline=None):
+        # Items are (start, end, atom) with atom None for text no atom has claimed yet.
+        for AtomClass in atom_precedence:
+            if expired(deadline):
+                break
+            with instrumentation.start(u'tag.' + AtomClass.__name__, chunks[-1][1] - chunks[0][0] if chunks else 0) as timer:
+                tagged = []
+                found = 0
+                for start, end, atom in chunks:
+                    if atom is None:
+                        spans = AtomClass.extract_atom_spans(nltext, start, end, src_time, parse_type=self.parse_type,
+                                deadline=deadline)
+                        if timer.active:
+                            found += sum(1 for span in spans if span[2] is not None)
+                        tagged.extend(spans)
+                    else:
+                        tagged.append((start, end, atom))
+                chunks = tagged
+                timer.stop(found)
+        return [(start, end, atom) for start, end, atom in chunks if atom is not None]
 
+    def tag_spans(self, nltext, src_time=None, pos=0, endpos=None, deadline=None):
+        """ Returns (start, end, atom) for every atom tag() finds, where nltext[start:end] is the text
+        the atom was made from. With `pos` and `endpos` only nltext[pos:endpos] is tagged, as a
+        fragment of its own."""
+        src_time = src_time or self.src_time
+        if not src_time:
+            raise ValueError(u'Insufficient Parameters. `src_time` required either at init or when tagging')
+        endpos = len(nltext) if endpos is None else endpos
+        with instrumentation.start(u'tag', endpos - pos) as timer:
+            if self.mode == u'span':
+                spans = self.__tag_spans([(pos, endpos, None)], nltext, src_time, self.atom_precedence, deadline)
+            elif self.mode == u'lexer':
+                chunks = self.__tokenize(nltext, src_time, pos, endpos, deadline)
+                spans = self.__tag_spans(chunks, nltext, src_time, self.lexer.remaining_atoms, deadline)
+            else:
+                # The sequential walk does not keep offsets, so look for each match after the one before it.
+                spans = []
+                for atom in self.__tag_sequential(nltext[pos:endpos], src_time, deadline):
+                    start = nltext.find(atom.match, pos, endpos)
+                    if start < 0:
+                        spans.append((pos, pos, atom))
+                    else:
+                        pos = start + len(atom.match)
+                        spans.append((start, pos, atom))
+            timer.stop(len(spans))
+        return spans
 
+    def __tokenize(self, nltext, src_time, pos, endpos, deadline=None):
+        with instrumentation.start(u'tag.lexer', endpos - pos) as timer:
+            chunks = self.lexer.tokenize(nltext, src_time, pos, endpos, deadline=deadline)
+            timer.stop(sum(1 for chunk in chunks if chunk[2] is not None) if timer.active else None)
+        return chunks
@@ -8,7 +8,9 @@ grammar.py declares the grammar of atoms that we're looking for
 as well as the interpretation.
 """
 
-from nltk.chunk import RegexpParser
+import re
+import instrumentation
+from lazyregex import LazyRegex
 
 def handle_bw_dr(tree):
     """Handles subtree with a node type of BW_DR"""
@@ -89,9 +91,16 @@ def handle_mod_dr(tree):
 
 
 def traverse(tree):
+    """ Interprets `tree`, the list of parses for the top node and the parse or None for a chunk."""
+    with instrumentation.start(u'traverse', len(tree)) as timer:
+        parse = traverse_node(tree)
+        timer.stop()
+    return parse
+
+def traverse_node(tree):
     try:
         if tree.node == u'S':
-            return [res for res in [traverse(c) for c in tree] if res]
+            return [res for res in [traverse_node(c) for c in tree] if res]
         elif tree.node == u'MOD_DR':
             return handle_mod_dr(tree)
         elif tree.node == u'BW_DR':
@@ -107,6 +116,27 @@ def traverse(tree):
     except AttributeError:
         return None
 
+def leaves(tree):
+    """ Yields the (match, tag, atom) tuples under `tree` in order."""
+    for child in tree:
+        if isinstance(child, Chunk):
+            for leaf in leaves(child):
+                yield leaf
+        else:
+            yield child
+
+def traverse_chunks(tree):
+    """ Like traverse() on the top node, but returns (parse, leaves) pairs where leaves are the
+    (match, tag, atom) tuples of the chunk the parse was computed from."""
+    with instrumentation.start(u'traverse', len(tree)) as timer:
+        parses = []
+        for child in tree:
+            res = traverse_node(child)
+            if res:
+                parses.append((res, list(leaves(child))))
+        timer.stop()
+    return parses
+
 
 range_grammar = '''
             MOD_DR: {<DR><RANGE|BW|FROM|FOR><MOD.*>|<DR><FILL>?<MOD.*>?|<MOD.*>?<DR>}
@@ -121,8 +151,113 @@ exact_grammar = '''
             BW_DR:  {<BW><MOD_DR><AND><MOD_DR>|<MOD_DR><DASH><MOD_DR>|<FROM><MOD_DR><TO|DASH><MOD_DR>}
             '''
 
-#date_grammar_regex_parser = RegexpParser(date_grammar)
-range_grammar_regex_parser = RegexpParser(range_grammar)
-exact_grammar_regex_parser = RegexpParser(exact_grammar)
+class Chunk(list):
+    """ Chunk is a node of the tree built by TagSequenceChunker. Like nltk's Tree it is a list of its
+    children, which are (match, tag, atom) tuples or other Chunks, with the label in `node`."""
+
+    def __init__(self, node, children=()):
+        list.__init__(self, children)
+        self.node = node
+
+    def subtrees(self, filter=None):
+        """ Yields this chunk and every chunk below it, in preorder, that passes `filter`."""
+        if not filter or filter(self):
+            yield self
+        for child in self:
+            if isinstance(child, Chunk):
+                for subtree in child.subtrees(filter):
+                    yield subtree
+
+    def __repr__(self):
+        return u'(%s %s)' % (self.node, u' '.join(repr(child) if isinstance(child, Chunk) else child[1] for child in self))
+
+def tag_pattern_regex(tag_pattern):
+    """ Turns a tag pattern like <DR><FILL>?<MOD.*>? into a regex over strings of <TAG> items, the way
+    nltk's RegexpParser does. A `.` inside the angle brackets never runs past the tag."""
+    tag_pattern = re.sub(r'\s', u'', tag_pattern)
+    tag_pattern = tag_pattern.replace(u'<', u'(?:<(?:').replace(u'>', u')>)').replace(u'.', u'[^<>]')
+    return LazyRegex(tag_pattern)
+
+class TagSequenceChunker(object):
+    """TagSequenceChunker chunks a sequence of tagged atoms with a grammar written for nltk's
+    RegexpParser, and builds the same tree without nltk.
+
+    Every `NAME: {pattern}` line of the grammar is a stage. A stage writes the tags of the current top
+    level out as <TAG><TAG>..., finds the leftmost non overlapping matches of its pattern and replaces
+    each one with a Chunk named NAME, which later stages see as the tag <NAME>.
+
+    Attributes:
+        stages (list): (node, compiled pattern) in the order they are applied.
+        top_node (unicode): Label of the root Chunk.
+        reach (int): How many tokens past the start of a top level chunk the chunks before it may have
+        looked at. Changing tokens further on than that leaves them as they were, see
+        incremental.ParseSession.
+    """
+
+    RULE_REGEX = re.compile(r'^\s*(?P<node>[^:\s]+)\s*:\s*\{(?P<pattern>.*)\}\s*$')
+    # A `|` between alternatives, as opposed to one between tags inside angle brackets.
+    ALTERNATIVE_REGEX = re.compile(r'\|(?![^<>]*>)')
+    TAG_REGEX = re.compile(r'<([^<>]*)>')
+
+    def __init__(self, grammar, top_node=u'S'):
+        self.top_node = top_node
+        self.stages = []
+        rules = []
+        for line in grammar.splitlines():
+            if not line.strip():
+                continue
+            rule = self.RULE_REGEX.match(line)
+            if not rule:
+                raise ValueError(u'Invalid grammar rule: ' + line.strip())
+            self.stages.append((rule.group(u'node'), tag_pattern_regex(rule.group(u'pattern'))))
+            rules.append((rule.group(u'node'), re.sub(r'\s', u'', rule.group(u'pattern'))))
+        self.reach = self.__reach(rules)
+
+    def __reach(self, rules):
+        # A stage looks at no more items from where it tries a match than its longest alternative has
+        # tags, and every item it looks at may be the widest chunk made so far. What that item turned
+        # out to be was in turn decided by the stages before, looking further still.
+        widths = {}
+        reach = 0
+        for node, pattern in rules:
+            item_width = max(widths.values() or [1])
+            alternatives = [self.TAG_REGEX.findall(alternative) for alternative in self.ALTERNATIVE_REGEX.split(pattern)]
+            reach += max(len(tags) for tags in alternatives) * item_width
+            widths[node] = max(sum(self.__tag_width(tag, widths) for tag in tags) for tags in alternatives)
+        return reach
+
+    def __tag_width(self, tag, widths):
+        tag_regex = re.compile(u'(?:%s)$' % tag.replace(u'.', u'[^<>]'))
+        return max([width for node, width in widths.iteritems() if tag_regex.match(node)] + [1])
 
+    def parse(self, tokens):
+        """ Returns the Chunk tree for a list of (match, tag, atom) tuples."""
+        children = list(tokens)
+        with instrumentation.start(u'chunk', len(children)) as timer:
+            for node, regex in self.stages:
+                # Where each child's <TAG> starts in the tag string.
+                offsets = {}
+                tags = []
+                length = 0
+                for index, child in enumerate(children):
+                    tag = u'<%s>' % (child.node if isinstance(child, Chunk) else child[1])
+                    offsets[length] = index
+                    tags.append(tag)
+                    length += len(tag)
+                offsets[length] = len(children)
+                chunked = []
+                last = 0
+                for match in regex.finditer(u''.join(tags)):
+                    if match.end() == match.start():
+                        continue
+                    start, end = offsets[match.start()], offsets[match.end()]
+                    chunked.extend(children[last:start])
+                    chunked.append(Chunk(node, children[start:end]))
+                    last = end
+                chunked.extend(children[last:])
+                children = chunked
+            timer.stop()
+        return Chunk(self.top_node, children)
 
+range_grammar_regex_parser = TagSequenceChunker(range_grammar)
+exact_grammar_regex_parser = TagSequenceChunker(exact_grammar)
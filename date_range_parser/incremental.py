@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""incremental.py
+
+Parses text that changes a little at a time, like a field being typed into, without starting over on
+every keystroke.
+
+A ParseSession keeps the atoms it tagged in the previous text with their offsets, and the top level
+chunks of the grammar tree with their parses. When the text changes only the atoms within `margin`
+words of the edit are tagged again, along with any atoms up to the nearest LOCAL one (see atoms.Atom)
+on either side. The window is then tagged as the same fragment a full parse would see. The
+grammar is run again from the first new atom, less the `reach` of the grammar, and the chunks before
+that are reused along with their parses.
+Appending to a long text then costs about as much as appending to a short one.
+
+The result of every parse() is what DateRangeParser.parse() returns for the same text and source day.
+"""
+
+import copy
+import bisect
+import itertools
+import grammar
+import preprocessing
+
+# Words, runs of non-whitespace, around an edit whose atoms are tagged again. It has to cover the
+# longest atom that the edit could join up with the text before or after it. That is six words, as in
+# "at 10:30 am - 11:30 pm". It is counted in words because the patterns allow any amount of whitespace
+# between them.
+MARGIN = 8
+
+def common_prefix_length(a, b):
+    """ Length of the longest common prefix of `a` and `b`. Compares halves of slices rather than
+    characters, so the loop runs log(n) times."""
+    lo, hi = 0, min(len(a), len(b))
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[lo:mid] == b[lo:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+def common_suffix_length(a, b, limit):
+    """ Length of the longest common suffix of `a` and `b`, up to `limit`."""
+    lo, hi = 0, min(len(a), len(b), limit)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[len(a) - mid:len(a) - lo] == b[len(b) - mid:len(b) - lo]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+def words_before(text, pos, count):
+    """ Offset of the start of the `count`th word that ends at or before `pos`, counting one partly
+    before it, or 0 when there are fewer."""
+    while count > 0 and pos > 0:
+        while pos > 0 and text[pos - 1].isspace():
+            pos -= 1
+        while pos > 0 and not text[pos - 1].isspace():
+            pos -= 1
+        count -= 1
+    return pos
+
+def words_after(text, pos, count):
+    """ Offset of the end of the `count`th word that starts at or after `pos`, counting one partly
+    after it, or len(text) when there are fewer."""
+    while count > 0 and pos < len(text):
+        while pos < len(text) and text[pos].isspace():
+            pos += 1
+        while pos < len(text) and not text[pos].isspace():
+            pos += 1
+        count -= 1
+    return pos
+
+def leaf_count(child):
+    """ The number of atoms in a top level child of the grammar tree."""
+    return sum(leaf_count(item) for item in child) if isinstance(child, grammar.Chunk) else 1
+
+class ParseSession(object):
+    """ParseSession parses successive versions of one text with a DateRangeParser.
+
+    Attributes:
+        parser (DateRangeParser): Parser whose tagger, grammar and output format are used.
+        src_time (datetime): The source day, resolved once when the session starts.
+        margin (int): Words on either side of an edit whose atoms are tagged again.
+        lowered (unicode): The last text parsed, lowercased.
+        split, head (int, unicode): lowered[:split] normalized, see preprocessing.split_point().
+        text (unicode): The last text parsed, after preprocessing.
+        starts, ends, atoms (list): The atoms tagged in `text` and where they were found. The grammar
+        is handed copies of the ones it could change.
+        children (list): Top level children of the grammar tree of `text`.
+        child_ends (list): Number of atoms up to and including each child.
+        parses (list): The parse of each child, None for children with none.
+        result (dict): What the last parse() returned.
+    """
+
+    def __init__(self, parser, src_time=None, margin=None):
+        self.parser = parser
+        self.src_time = parser.source_time(src_time)
+        self.margin = MARGIN if margin is None else margin
+        self.reset()
+
+    def reset(self):
+        """ Forgets the previous text, so the next parse() starts over."""
+        self.lowered, self.split, self.head = None, 0, u''
+        self.text = None
+        self.starts, self.ends, self.atoms = [], [], []
+        self.children, self.child_ends, self.parses = [], [], []
+        self.result = None
+
+    def parse(self, text):
+        """ Parses `text`, reusing what it has in common with the text parsed before."""
+        text = self.__preprocess(text)
+        if text == self.text:
+            return self.result
+        try:
+            self.__rechunk(self.__retag(text))
+        except Exception:
+            # Whatever was already updated no longer matches self.text.
+            self.reset()
+            raise
+        self.text = text
+        return self.result
+
+    def __preprocess(self, text):
+        """ preprocessing.preprocess_input(), normalizing only what comes after the last split point
+        ahead of the edit. Pipelines with steps of their own are run on the whole text."""
+        if preprocessing.pipeline.steps:
+            return preprocessing.preprocess_input(text)
+        lowered = preprocessing.correct_spelling(preprocessing.sanitize_string(text))
+        prefix = common_prefix_length(self.lowered or u'', lowered)
+        if prefix < self.split:
+            self.split, self.head = 0, u''
+        split = preprocessing.split_point(lowered, prefix)
+        if split > self.split:
+            self.head += preprocessing.normalize(lowered[self.split:split])
+            self.split = split
+        self.lowered = lowered
+        return self.head + preprocessing.normalize(lowered[self.split:])
+
+    def __retag(self, text):
+        """ Tags the edited part of `text` again and returns the index of the first new atom."""
+        old = self.text or u''
+        prefix = common_prefix_length(old, text)
+        suffix = common_suffix_length(old, text, min(len(old), len(text)) - prefix)
+        shift = len(text) - len(old)
+        # Atoms kept before and after the edit, atoms[:first] and atoms[last:]. The window has to start
+        # and end at a LOCAL atom, or it would cut a fragment that the rest look at in one piece.
+        first = bisect.bisect_right(self.ends, words_before(old, prefix, self.margin))
+        while first and not self.atoms[first - 1].LOCAL:
+            first -= 1
+        last = bisect.bisect_left(self.starts, words_after(old, len(old) - suffix, self.margin))
+        while last < len(self.atoms) and not self.atoms[last].LOCAL:
+            last += 1
+        pos = self.ends[first - 1] if first else 0
+        endpos = self.starts[last] + shift if last < len(self.starts) else len(text)
+        spans = self.parser.tagger.tag_spans(text, self.src_time, pos, endpos)
+        self.starts[first:] = [start for start, _, _ in spans] + [start + shift for start in self.starts[last:]]
+        self.ends[first:] = [end for _, end, _ in spans] + [end + shift for end in self.ends[last:]]
+        self.atoms[first:last] = [atom for _, _, atom in spans]
+        return first
+
+    def __rechunk(self, first):
+        """ Chunks the atoms again from far enough before `first` that nothing earlier can change."""
+        kept = bisect.bisect_right(self.child_ends, first - self.parser.grammar_parser.reach)
+        start = self.child_ends[kept - 1] if kept else 0
+        # The grammar may move an atom's source time, see grammar.handle_rel_dr().
+        tokens = [copy.copy(atom) if hasattr(atom, 'change_src_time') else atom for atom in self.atoms[start:]]
+        tree = self.parser.grammar_parser.parse([atom.to_tag() for atom in tokens])
+        self.children[kept:] = tree
+        ends = []
+        for child in tree:
+            start += leaf_count(child)
+            ends.append(start)
+        self.child_ends[kept:] = ends
+        first_parse = next((parse for parse in itertools.islice(self.parses, kept) if parse), None)
+        self.parses[kept:] = [self.parser.interpret(child) for child in tree]
+        parse = [parse for parse in self.parses if parse]
+        # The result only depends on the first parse, reuse it while that is among the kept ones.
+        reused = self.result[u'result'] if first_parse is not None and self.result[u'parse'] else None
+        self.result = self.parser.to_result(parse, reused)
@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+"""instrumentation.py
+
+Reports where the time of a parse goes. Every stage below tells the installed Instrument when it
+starts and when it finishes, with how long it took, the size of its input and, for the stages that
+find atoms, how many it found:
+
+    parse           DateRangeParser.parse(), size in characters
+    preprocess      preprocessing.preprocess_input(), size in characters
+    tag             DateGrammarAtomTagger.tag() and tag_spans(), size in characters
+    tag.<Atom>      One pass of the tagger's atom_precedence, e.g. tag.OperandAtom, and tag.lexer for
+                    DateGrammarLexer, size in characters of the text tagged. The sequential tagger
+                    mode leaves atoms out.
+    parsedatetime   A call into parsedatetime's Calendar.nlp(), size in characters, atoms its matches
+    chunk           TagSequenceChunker.parse(), size in atoms
+    traverse        grammar.traverse() and traverse_chunks(), size in top level children of the tree
+    metadata        Display and reconvertible text of the parses, size in parses
+    format          DateRangeParser.to_result(), size in parses
+
+Stages nest, tag.<Atom> and parsedatetime run inside tag which runs inside parse, and a stage that
+raises still reports its finish. Nothing is reported until install() is given an Instrument, and until
+then each stage costs a global lookup. Instruments are called on whichever thread runs the parse, and are
+not carried over to the worker processes of parallel.ParallelParser.
+
+LoggingInstrument logs stages as they finish and MetricsRegistry keeps Prometheus style histograms
+and counters per stage in process, which MultiInstrument can combine.
+"""
+
+import timeit
+import logging
+import threading
+import contextlib
+
+class Instrument(object):
+    """ Instrument receives the start and finish of every stage. This one does nothing, subclasses
+    override what they need."""
+
+    def started(self, stage, size):
+        pass
+
+    def finished(self, stage, seconds, size, atoms):
+        pass
+
+NULL_INSTRUMENT = Instrument()
+
+# The instrument stages report to, see install().
+current = NULL_INSTRUMENT
+
+def install(instrument):
+    """ Makes every stage report to `instrument`, None for no instrument. Returns the instrument
+    installed before."""
+    global current
+    previous = current
+    current = instrument or NULL_INSTRUMENT
+    return previous
+
+@contextlib.contextmanager
+def installed(instrument):
+    """ Installs `instrument` for the duration of a with block."""
+    previous = install(instrument)
+    try:
+        yield instrument
+    finally:
+        install(previous)
+
+class Timer(object):
+    """ A stage in progress. stop() reports it finished. Used in a `with` block the stage is also
+    reported finished when the block raises before it gets to stop(), so the count of stages in
+    progress stays balanced."""
+
+    __slots__ = ('instrument', 'stage', 'size', 'started')
+
+    active = True
+
+    def __init__(self, instrument, stage, size):
+        self.instrument = instrument
+        self.stage = stage
+        self.size = size
+        self.started = timeit.default_timer()
+
+    def stop(self, atoms=None):
+        self.instrument.finished(self.stage, timeit.default_timer() - self.started, self.size, atoms)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.stop()
+
+class NullTimer(object):
+    """ What start() returns while no instrument is installed. `active` is False so callers can skip
+    counting what would not be reported."""
+
+    active = False
+
+    def stop(self, atoms=None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+NULL_TIMER = NullTimer()
+
+def start(stage, size=None):
+    """ Reports `stage` started and returns the Timer to stop() when it finishes, see Timer."""
+    instrument = current
+    if instrument is NULL_INSTRUMENT:
+        return NULL_TIMER
+    instrument.started(stage, size)
+    return Timer(instrument, stage, size)
+
+class MultiInstrument(Instrument):
+    """ Passes every event on to each of `instruments` in turn."""
+
+    def __init__(self, *instruments):
+        self.instruments = instruments
+
+    def started(self, stage, size):
+        for instrument in self.instruments:
+            instrument.started(stage, size)
+
+    def finished(self, stage, seconds, size, atoms):
+        for instrument in self.instruments:
+            instrument.finished(stage, seconds, size, atoms)
+
+class LoggingInstrument(Instrument):
+    """LoggingInstrument logs every stage that took at least `min_seconds` as it finishes.
+
+    Attributes:
+        logger (Logger): Where to log, the date_range_parser logger by default.
+        level (int): Level to log at.
+        min_seconds (float): Stages faster than this are not logged.
+    """
+
+    def __init__(self, logger=None, level=logging.DEBUG, min_seconds=0.0):
+        self.logger = logger or logging.getLogger(u'date_range_parser')
+        self.level = level
+        self.min_seconds = min_seconds
+
+    def finished(self, stage, seconds, size, atoms):
+        if seconds >= self.min_seconds and self.logger.isEnabledFor(self.level):
+            self.logger.log(self.level, u'%s took %.3fms size=%s atoms=%s', stage, seconds * 1000, size, atoms)
+
+class MetricsRegistry(Instrument):
+    """MetricsRegistry keeps, for every stage, a histogram of its durations along with the total size
+    of its inputs, the atoms it found and how many are running. render() writes them in the Prometheus
+    text format and snapshot() as a dict.
+
+    Attributes:
+        buckets (tuple): Upper bounds in seconds of the histogram buckets, in increasing order.
+        prefix (unicode): Prefix of the metric names.
+        stages (dict): Per stage counters, see snapshot().
+    """
+
+    BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+    def __init__(self, buckets=BUCKETS, prefix=u'date_range_parser'):
+        self.buckets = tuple(buckets)
+        self.prefix = prefix
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def __stage(self, stage):
+        counters = self.stages.get(stage)
+        if counters is None:
+            counters = self.stages[stage] = {u'count': 0, u'seconds': 0.0, u'size': 0, u'atoms': 0,
+                    u'in_progress': 0, u'buckets': [0] * len(self.buckets)}
+        return counters
+
+    def started(self, stage, size):
+        with self._lock:
+            self.__stage(stage)[u'in_progress'] += 1
+
+    def finished(self, stage, seconds, size, atoms):
+        with self._lock:
+            counters = self.__stage(stage)
+            counters[u'in_progress'] -= 1
+            counters[u'count'] += 1
+            counters[u'seconds'] += seconds
+            counters[u'size'] += size or 0
+            counters[u'atoms'] += atoms or 0
+            # Buckets are counted on their own here and summed up in snapshot().
+            for index, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    counters[u'buckets'][index] += 1
+                    break
+
+    def snapshot(self):
+        """ The counters of every stage, with `buckets` as (upper bound, count at or below it) pairs
+        ending in (inf, count)."""
+        with self._lock:
+            stages = dict((stage, dict(counters, buckets=list(counters[u'buckets'])))
+                    for stage, counters in self.stages.iteritems())
+        for counters in stages.itervalues():
+            cumulative = 0
+            buckets = []
+            for bound, count in zip(self.buckets, counters[u'buckets']):
+                cumulative += count
+                buckets.append((bound, cumulative))
+            buckets.append((float('inf'), counters[u'count']))
+            counters[u'buckets'] = buckets
+        return stages
+
+    def render(self):
+        """ The metrics in the Prometheus text exposition format."""
+        stages = sorted(self.snapshot().iteritems())
+        name = self.prefix + u'_stage'
+        lines = [u'# HELP {0}_seconds Time spent in each stage of a parse.'.format(name),
+                 u'# TYPE {0}_seconds histogram'.format(name)]
+        for stage, counters in stages:
+            for bound, count in counters[u'buckets']:
+                le = u'+Inf' if bound == float('inf') else repr(bound)
+                lines.append(u'{0}_seconds_bucket{{stage="{1}",le="{2}"}} {3}'.format(name, stage, le, count))
+            lines.append(u'{0}_seconds_sum{{stage="{1}"}} {2!r}'.format(name, stage, counters[u'seconds']))
+            lines.append(u'{0}_seconds_count{{stage="{1}"}} {2}'.format(name, stage, counters[u'count']))
+        for metric, kind, help_text in ((u'size', u'counter', u'Size of the input of each stage, see instrumentation.py.'),
+                                        (u'atoms', u'counter', u'Atoms found by each stage.'),
+                                        (u'in_progress', u'gauge', u'Stages running right now.')):
+            suffix = u'_total' if kind == u'counter' else u''
+            lines.append(u'# HELP {0}_{1}{2} {3}'.format(name, metric, suffix, help_text))
+            lines.append(u'# TYPE {0}_{1}{2} {3}'.format(name, metric, suffix, kind))
+            for stage, counters in stages:
+                lines.append(u'{0}_{1}{2}{{stage="{3}"}} {4}'.format(name, metric, suffix, stage, counters[metric]))
+        return u'\n'.join(lines) + u'\n'
+
+    def reset(self):
+        with self._lock:
+            self.stages.clear()
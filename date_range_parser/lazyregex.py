@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+"""lazyregex.py
+
+Regexes compiled on first use instead of at import. The atom, preprocessing, natural range and grammar
+modules define their patterns with LazyRegex so importing date_range_parser stays cheap, and
+date_range_parser.warmup() compiles them all up front for long running services.
+"""
+
+import re
+import weakref
+
+class LazyRegex(object):
+    """ LazyRegex stands in for re.compile(pattern, flags) and compiles the pattern the first time
+    one of its attributes is used, so importing a module does not pay for regexes it never runs. The
+    compiled pattern's attributes are then stored on the instance and later lookups go straight to them.
+
+    Attributes:
+        instances (WeakSet): Every LazyRegex still in use, see compile_lazy_regexes(). Patterns of
+        objects that are gone, like the stages of a TagSequenceChunker, drop out of it.
+    """
+    instances = weakref.WeakSet()
+
+    def __init__(self, pattern, flags=0):
+        self.__pattern = pattern
+        self.__flags = flags
+        self.__compiled = None
+        LazyRegex.instances.add(self)
+
+    def compile(self):
+        """ Returns the compiled pattern, compiling it if that has not happened yet."""
+        if self.__compiled is None:
+            self.__compiled = re.compile(self.__pattern, self.__flags)
+        return self.__compiled
+
+    def __getattr__(self, name):
+        value = getattr(self.compile(), name)
+        setattr(self, name, value)
+        return value
+
+def compile_lazy_regexes():
+    """ Compiles every LazyRegex now instead of on first use."""
+    for regex in LazyRegex.instances:
+        regex.compile()
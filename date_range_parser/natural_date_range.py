@@ -6,36 +6,39 @@
 
 Natural date range takes in a plain text string and looks for tokens like
 (this|next) (weekend|week|month) and returns corresponding date ranges.
+
+Ranges are looked up in the day_table around the source day. Counts that reach past the table, like
+"900 months", fall back to the relativedelta arithmetic. Either way the midnights that bound a range
+get the offset in effect on their day, which after a DST change is not the one of the source time.
 """
 import datetime
 import re
 from collections import namedtuple
 
-from dateutil.parser import parse
 from dateutil.relativedelta import relativedelta
 from dateutil.relativedelta import MO as MONDAY, SA as SATURDAY
 import utils
+import day_table
+from lazyregex import LazyRegex
 import pytz
 
+# Finds strings like "this week", "next weekend" or "3 months". One match has the modifier, the count
+# and the range type in its named groups.
+NATURAL_RANGE_EXP = r'''
+                (?P<pos_mod>\b(this|(?P<pos_next>next)|(?P<pos_count>\d+))\b)?\s*
+                (?P<range_type>\b((?P<range_weekend>weekend)|(?P<range_month>month)|(?P<range_week>week))s?)\b
+                '''
+NATURAL_RANGE_REGEX = LazyRegex(NATURAL_RANGE_EXP, flags=re.X|re.I)
+
 def natural_daterange_parser(nltext, src_time, first=True):
-    isolated_datestrings = __isolate_datestrings(nltext)
-    results = [(iso, parse_date_range(iso, src_time)) for iso in isolated_datestrings]
-    if len(results) > 0 and first:
-        return results[0]
+    matches = NATURAL_RANGE_REGEX.finditer(nltext)
+    if first:
+        # Only the first match is parsed, an empty list means there was none.
+        for match in matches:
+            return (match.group(), __parse_range_match(match, src_time))
+        return []
     else:
-        return results
-
-def __isolate_datestrings(text):
-    # Compose strings to put together a more complicated regular expression.
-    natural_range = r'''
-                    (?P<pos_mod>\b(this|next|\d+)\b)?\s*
-                    (?P<range_type>\b(weekend|month|week)s?)\b
-                    '''
-
-    natural_range_exp = re.compile(natural_range, flags=re.X|re.I)
-    # Match and the return a cleaned up version of each match.
-    substr_match = [text[m.start():m.end()] for m in natural_range_exp.finditer(text) if m]
-    return substr_match if substr_match else []
+        return [(match.group(), __parse_range_match(match, src_time)) for match in matches]
 
 __HandleableRange = namedtuple('HandleableRange', ['starts', 'lasts', 'handle_next'])
 """
@@ -53,33 +56,71 @@ def parse_date_range(nltext, src_time):
     representation of time boundaries of this range. Returns None, if valid
     time range cannot be retrieved from the input.
     """
-    hrange = __analyze_range(nltext, src_time)
+    match = NATURAL_RANGE_REGEX.search(nltext)
+    return __parse_range_match(match, src_time) if match else None
+
+def __parse_range_match(match, src_time):
+    """ parse_date_range for a match of NATURAL_RANGE_REGEX."""
+    parsed = __parse_range_from_table(match, src_time)
+    if parsed is None:
+        start, end = __parse_range_arithmetic(match, src_time)
+        parsed = (__localized(start), __localized(end))
+    return parsed
+
+def __localized(dt):
+    return utils.localize_wall(dt.replace(tzinfo=None), dt.tzinfo)
+
+def __parse_range_from_table(match, src_time):
+    """ __parse_range_arithmetic() with day_table lookups, None when the range is not in the table."""
+    if not isinstance(src_time, datetime.datetime):
+        return None
+    day = src_time.toordinal()
+    table = day_table.day_tables.table(src_time.tzinfo, day)
+    pos_count = match.group('pos_count')
+    count = int(pos_count) if pos_count else 1 if match.group('pos_next') else 0
+    if match.group('range_weekend') or match.group('range_week'):
+        if match.group('range_weekend'):
+            start, days = table.weekend_start(day), 2
+        else:
+            start, days = table.week_start(day), 5
+        # A range that is over already is the one a week later.
+        if start + days <= day:
+            start += 7
+        start += 7 * count
+        end = start + days
+    else:
+        month = table.month(day) + count
+        start, end = table.month_start(month), table.month_start(month + 1)
+        if start is None or end is None:
+            return None
+    if start < table.first or end > table.last:
+        return None
+    return (table.midnight(max(start, day), src_time.tzinfo), table.midnight(end, src_time.tzinfo))
+
+def __parse_range_arithmetic(match, src_time):
+    """ Resolves a match of NATURAL_RANGE_REGEX with relativedelta, on the wall clock of `src_time`."""
+    hrange = __analyze_range(match, src_time)
     src_time = utils.start_of_day(src_time)
 
-    if hrange:
+    end_date = hrange.starts + hrange.lasts
+    if end_date <= src_time:
+        start_date = hrange.starts + datetime.timedelta(days=7)
+        hrange = __HandleableRange(start_date, hrange.lasts, hrange.handle_next)
         end_date = hrange.starts + hrange.lasts
-        if end_date <= src_time:
-            start_date = hrange.starts + datetime.timedelta(days=7)
-            hrange = __HandleableRange(start_date, hrange.lasts, hrange.handle_next)
-            end_date = hrange.starts + hrange.lasts
-
-        # See if a positional modifier is present.
-        pos_mod = re.search(r'\b(next|\d+)\b', nltext, flags=re.X|re.I)
-        pos_match = re.search(r'\b\d+\b', nltext, flags=re.X|re.I)
-        pos_count = int(pos_match.group()) if pos_match else 1
-        if not pos_mod:
-            start_date = hrange.starts if hrange.starts > src_time else src_time
-            return (start_date, end_date)
-        else:
-            start_date = hrange.starts
-            d = hrange.handle_next()
-            d = d * pos_count
-            start_date += d
-            end_date += d
-            start_date = start_date if start_date > src_time else src_time
-            return (start_date, end_date)
+
+    # See if a positional modifier is present, "this" does not count as one.
+    pos_count = match.group('pos_count')
+    if not pos_count and not match.group('pos_next'):
+        start_date = hrange.starts if hrange.starts > src_time else src_time
+        return (start_date, end_date)
     else:
-        return None
+        start_date = hrange.starts
+        d = hrange.handle_next()
+        d = d * (int(pos_count) if pos_count else 1)
+        start_date += d
+        end_date += d
+        start_date = start_date if start_date > src_time else src_time
+        return (start_date, end_date)
 
 
 def __get_weekday_datetime(weekday, src_time):
@@ -94,11 +135,9 @@ def __get_weekday_datetime(weekday, src_time):
         today = today + relativedelta(weekday=weekday)
     return today
 
-def __analyze_range(nltext, src_time):
+def __analyze_range(range_match, src_time):
     """
-    Takes a natural language representation of time range and maps it to
-    proper Range object. Returns None, if valid time range cannot be retrieved
-    from the input.
+    Maps a match of NATURAL_RANGE_REGEX to the proper Range object.
     """
     # Construct the current reference time from the source time.
     if isinstance(src_time, datetime.datetime):
@@ -106,33 +145,22 @@ def __analyze_range(nltext, src_time):
     else:
         raise ValueError(u'Invalid `src_time`. Must be of time datetime.datetime')
 
-    # Construct regex to find various range types.
-    range_expr = r'''
-                (?P<weekend>weekend)|
-                (?P<week>week)|
-                (?P<month>month)s?'''
-    range_regex = re.compile(range_expr, flags=re.I|re.X)
-    range_match = range_regex.search(nltext)
-
     # Return a __HandleableRange based on the match group type.
-    if range_match:
-        if range_match.group('weekend'):
-            return __HandleableRange(
-                __get_weekday_datetime(SATURDAY, src_time),
-                datetime.timedelta(days=2),
-                lambda: datetime.timedelta(days=7)
-            )
-        elif range_match.group('week'):
-            return __HandleableRange(
-                __get_weekday_datetime(MONDAY, src_time),
-                datetime.timedelta(days=5),
-                lambda: datetime.timedelta(days=7)
-            )
-        elif range_match.group('month'):
-            return __HandleableRange(
-                src_time.replace(day=1),
-                relativedelta(months=1),
-                lambda: relativedelta(months=1)
-            )
+    if range_match.group('range_weekend'):
+        return __HandleableRange(
+            __get_weekday_datetime(SATURDAY, src_time),
+            datetime.timedelta(days=2),
+            lambda: datetime.timedelta(days=7)
+        )
+    elif range_match.group('range_week'):
+        return __HandleableRange(
+            __get_weekday_datetime(MONDAY, src_time),
+            datetime.timedelta(days=5),
+            lambda: datetime.timedelta(days=7)
+        )
     else:
-        return None
+        return __HandleableRange(
+            src_time.replace(day=1),
+            relativedelta(months=1),
+            lambda: relativedelta(months=1)
+        )
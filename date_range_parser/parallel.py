@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""parallel.py
+
+Spreads large batches of inputs across worker processes.
+
+Parsing is pure python work in regex, parsedatetime and the grammar chunker, so threads do not help.
+ParallelParser sends chunks of inputs to a concurrent.futures.ProcessPoolExecutor (the `futures`
+backport on python 2) and every worker keeps one warmed up DateRangeParser per (tz_name, parse_type).
+Results come back in the compact form described in compact_result() so atoms never have to be pickled.
+shared_parser() keeps ParallelParsers around for date_range_parser.parse_many(), so a batch does not
+pay for starting a pool.
+"""
+
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import date_range_parser
+
+# Parsers held by a worker process, keyed on (tz_name, parse_type, output_format).
+_worker_parsers = {}
+
+# ParallelParsers handed out by shared_parser(), keyed on (workers, tz_name, parse_type, output_format).
+_shared_parsers = {}
+_shared_lock = threading.Lock()
+
+def compact_result(result):
+    """ Reduces a result from DateRangeParser.parse() to plain unicode, lists and dicts.
+
+    The atoms in `components` are dropped and every markup datetime is turned into an isoformat
+    string, leaving dict(result=[...], parse=[dict(grammar, markup, display_text, reconvertible_text)])
+    or parse=None when nothing was found.
+    """
+    parse = result.get(u'parse')
+    if parse is not None:
+        parse = [{u'grammar': p.get(u'grammar'),
+                  u'markup': [tuple(date_range_parser.dt_to_js_json_format(dt) for dt in mu) for mu in p.get(u'markup') or []],
+                  u'display_text': p.get(u'display_text'),
+                  u'reconvertible_text': p.get(u'reconvertible_text')} for p in parse]
+    return dict(result=result.get(u'result'), parse=parse)
+
+def worker_parser(tz_name=None, parse_type=u'range', output_format=u'days'):
+    """ Returns this process' DateRangeParser for `tz_name`, `parse_type` and `output_format`, building
+    and warming it up on first use."""
+    key = (tz_name, parse_type, output_format)
+    parser = _worker_parsers.get(key)
+    if parser is None:
+        parser = _worker_parsers[key] = date_range_parser.DateRangeParser(tz_name, parse_type=parse_type,
+                output_format=output_format)
+        parser.warmup()
+    return parser
+
+def _warm_worker(tz_name, parse_type, output_format):
+    worker_parser(tz_name, parse_type, output_format)
+
+def worker_pool(workers, tz_name=None, parse_type=u'range', output_format=u'days'):
+    """ Returns a ProcessPoolExecutor of `workers` processes that each start out with a warmed up
+    worker_parser() for `tz_name`, `parse_type` and `output_format`. The parser is built in this process
+    before any worker is forked, so they inherit it. Executors that take an initializer (python 3.7 and
+    up) also have every worker build it first thing, for when workers are spawned instead."""
+    worker_parser(tz_name, parse_type, output_format)
+    try:
+        return ProcessPoolExecutor(max_workers=workers, initializer=_warm_worker,
+                initargs=(tz_name, parse_type, output_format))
+    except TypeError:
+        return ProcessPoolExecutor(max_workers=workers)
+
+def _parse_chunk(args):
+    tz_name, parse_type, output_format, src_time, texts = args
+    return [compact_result(r) for r in worker_parser(tz_name, parse_type, output_format).parse_many(texts, src_time)]
+
+class ParallelParser(object):
+    """ParallelParser parses batches of inputs on a pool of worker processes.
+
+    Attributes:
+        workers (int): Number of worker processes.
+        tz_name (string|unicode): Timezone handed to every worker's DateRangeParser.
+        parse_type (unicode): Either u'range' or u'exact'.
+        chunk_size (int): Number of inputs sent to a worker at a time.
+        output_format (unicode): Result format of every worker's DateRangeParser.
+    """
+
+    def __init__(self, workers=None, tz_name=None, parse_type=u'range', chunk_size=64, output_format=u'days'):
+        if chunk_size < 1:
+            raise ValueError(u'Invalid chunk_size. Must be at least 1')
+        self.workers = workers or multiprocessing.cpu_count()
+        self.tz_name = tz_name
+        self.parse_type = parse_type
+        self.chunk_size = chunk_size
+        self.output_format = output_format
+        # Validates parse_type and output_format and computes source times the same way the workers do.
+        self.parser = date_range_parser.DateRangeParser(tz_name, parse_type=parse_type, output_format=output_format)
+        self.executor = worker_pool(self.workers, tz_name, parse_type, output_format)
+
+    def parse_many(self, texts, src_time=None):
+        """ Parses `texts` against one `src_time` and returns compact results in input order."""
+        # Resolve the day here so every chunk agrees on "today".
+        src_time = self.parser.source_time(src_time)
+        texts = list(texts)
+        chunks = [(self.tz_name, self.parse_type, self.output_format, src_time, texts[i:i + self.chunk_size])
+                for i in range(0, len(texts), self.chunk_size)]
+        return [result for chunk in self.executor.map(_parse_chunk, chunks) for result in chunk]
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def shared_parser(workers=None, tz_name=None, parse_type=u'range', output_format=u'days'):
+    """ Returns the ParallelParser kept for `workers`, `tz_name`, `parse_type` and `output_format`,
+    starting it on first use. It stays up until close_shared_parsers()."""
+    workers = workers or multiprocessing.cpu_count()
+    key = (workers, tz_name, parse_type, output_format)
+    parser = _shared_parsers.get(key)
+    if parser is None:
+        # Under the lock so racing callers do not start a pool each.
+        with _shared_lock:
+            parser = _shared_parsers.get(key)
+            if parser is None:
+                parser = _shared_parsers[key] = ParallelParser(workers, tz_name, parse_type,
+                        output_format=output_format)
+    return parser
+
+def close_shared_parsers():
+    """ Shuts down every pool started by shared_parser()."""
+    with _shared_lock:
+        parsers = _shared_parsers.values()
+        _shared_parsers.clear()
+    for parser in parsers:
+        parser.close()
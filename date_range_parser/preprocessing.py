@@ -8,10 +8,77 @@ Basic string preprocessing to improve the accuracy of the date_range_parser.
 
 Applies spelling correction, lowercases the string and maps numeric words into
 numbers like one --> '1'.
+
+Every pattern is compiled once, on first use. preprocess_input() lowercases the string and then does the
+number words, ordinals and stop words in a single substitution. None of those matches can overlap or
+create one another, so this gives the same output as running them one after the other. Extra steps
+can be added to a PreprocessingPipeline, see add_step() and add_substitution().
 """
 
-from textblob import TextBlob
 import re
+import difflib
+import functools
+from lazyregex import LazyRegex
+
+REPLACEMENT_MAP = { u'one': u'1',
+                    u'two': u'2',
+                    u'couple': u'2',
+                    u'three': u'3',
+                    u'four': u'4',
+                    u'five': u'5',
+                    u'six': u'6',
+                    u'seven': u'7',
+                    u'eight': u'8',
+                    u'nine': u'9',
+                    u'ten': u'10',
+                    u'noon': u'12 pm'}
+
+# Numeric words with their replacement in REPLACEMENT_MAP.
+REPLACEMENTS_EXP = r'''
+                (?P<one>\bone\b)|
+                (?P<two>\btwo\b)|
+                (?P<couple>\bcouple\b)|
+                (?P<three>\bthree\b)|
+                (?P<four>\bfour\b)|
+                (?P<five>\bfive\b)|
+                (?P<six>\bsix\b)|
+                (?P<seven>\\bseven\b)|
+                (?P<eight>\beight\b)|
+                (?P<nine>\bnine\b)|
+                (?P<ten>\bten\b)|
+                (?P<noon>\bnoon\b)
+                '''
+REPLACEMENTS_REGEX = LazyRegex(REPLACEMENTS_EXP, flags=re.X|re.I)
+
+# Ordinals next to numbers, the number is kept.
+ORDINALS_EXP = r'\b(?P<number>\d{1,2})(?P<ordinal>th|st|nd|rd)\b'
+ORDINALS_REGEX = LazyRegex(ORDINALS_EXP, flags=re.X|re.I)
+
+STOP_WORDS_EXP = r'(in\sthe|\bat\b)'
+STOP_WORDS_REGEX = LazyRegex(STOP_WORDS_EXP, flags=re.X|re.I)
+
+# All three of the above as one alternation. The `seven` pattern matches a literal "\bseven" and
+# turning that into "7" used to take away the word boundary after an "at" or an ordinal right in front
+# of it, so those two refuse to match there.
+SEVEN_AHEAD_EXP = r'(?!\\bseven\b)'
+NORMALIZE_EXP = r'(?P<stop_word>in\sthe|\bat\b{seven})|{replacements}|{ordinals}{seven}'.format(
+        seven=SEVEN_AHEAD_EXP, replacements=REPLACEMENTS_EXP, ordinals=ORDINALS_EXP)
+NORMALIZE_REGEX = LazyRegex(NORMALIZE_EXP, flags=re.X|re.I)
+
+# The last word of a string, with the whitespace before it.
+LAST_WORD_REGEX = LazyRegex(r'\s\S*$', flags=re.U)
+
+def truncate(nltext, max_length):
+    """ nltext cut down to at most max_length characters. The cut is made at whitespace, when there is
+    any, so that no word is cut in half."""
+    if max_length is None or len(nltext) <= max_length:
+        return nltext
+    head = nltext[:max_length]
+    if not nltext[max_length].isspace():
+        last_word = LAST_WORD_REGEX.search(head)
+        if last_word:
+            head = head[:last_word.start()]
+    return head
 
 def sanitize_string(nltext):
     if isinstance(nltext, basestring):
@@ -21,56 +88,129 @@ def sanitize_string(nltext):
 
 def correct_spelling(nltext):
     return nltext
+    # textblob pulls in all of nltk, only import it if this is turned back on.
+    #from textblob import TextBlob
     #blob = TextBlob(nltext)
     #return blob.correct().string
 
 def remove_stop_words(nltext):
-    stop_words_exp = r'(in\sthe|\bat\b)'
-    stop_words_regex = re.compile(stop_words_exp, flags=re.X|re.I)
-    return stop_words_regex.sub(u'', nltext)
+    return STOP_WORDS_REGEX.sub(u'', nltext)
 
 def replace_ordinals(nltext):
-    def match_function(matchobj):
-        return re.sub(r'th|st|nd|rd', '', matchobj.group(), count=1, flags=re.X|re.I)
     # Replace occurences of ordinals next to numbers.
-    return re.sub(r'\b\d{1,2}(?P<ordinal>th|st|nd|rd)\b', match_function, nltext, flags=re.X|re.I)
+    return ORDINALS_REGEX.sub(r'\g<number>', nltext)
 
-def replace_words(nltext):
-    # Match function sent into re.sub
-    def match_function(matchobj):
-        """ Match function used to substitute based on group type."""
-        replacement_map = { u'one': u'1',
-                            u'two': u'2',
-                            u'couple': u'2',
-                            u'three': u'3',
-                            u'four': u'4',
-                            u'five': u'5',
-                            u'six': u'6',
-                            u'seven': u'7',
-                            u'eight': u'8',
-                            u'nine': u'9',
-                            u'ten': u'10',
-                            u'noon': u'12 pm'}
-        return replacement_map.get(matchobj.lastgroup)
+def __replace_word(matchobj):
+    """ Match function used to substitute based on group type."""
+    return REPLACEMENT_MAP.get(matchobj.lastgroup)
 
+def replace_words(nltext):
     # Replace numeric words with corresponding number string.
-    replacements = r'''
-                (?P<one>\bone\b)|
-                (?P<two>\btwo\b)|
-                (?P<couple>\bcouple\b)|
-                (?P<three>\bthree\b)|
-                (?P<four>\bfour\b)|
-                (?P<five>\bfive\b)|
-                (?P<six>\bsix\b)|
-                (?P<seven>\\bseven\b)|
-                (?P<eight>\beight\b)|
-                (?P<nine>\bnine\b)|
-                (?P<ten>\bten\b)|
-                (?P<noon>\bnoon\b)
-                '''
-    replacement_regex = re.compile(replacements, flags=re.X|re.I)
-    return replacement_regex.sub(match_function, nltext)
+    return REPLACEMENTS_REGEX.sub(__replace_word, nltext)
+
+def __normalize_match(matchobj):
+    group = matchobj.lastgroup
+    if group == u'stop_word':
+        return u''
+    elif group == u'ordinal':
+        return matchobj.group(u'number')
+    else:
+        return REPLACEMENT_MAP.get(group)
+
+def normalize(nltext):
+    """ replace_words, replace_ordinals and remove_stop_words in one pass."""
+    return NORMALIZE_REGEX.sub(__normalize_match, nltext)
+
+def split_point(nltext, pos):
+    """ The last offset i at or before `pos` with normalize(nltext[:i]) + normalize(nltext[i:]) equal to
+    normalize(nltext), whatever comes after `pos`. No match contains whitespace other than the one in
+    "in the", so that is anywhere right after any other whitespace."""
+    while pos > 0 and not (nltext[pos - 1].isspace() and nltext[max(pos - 3, 0):pos - 1] != u'in'):
+        pos -= 1
+    return pos
+
+def normalize_with_offsets(nltext, starts, ends):
+    """ normalize() that also carries offsets along. starts[i] and ends[i] are where the source of
+    nltext[i] begins and ends in the original text. Characters a match is replaced with all get the
+    span of the whole match. Returns (text, starts, ends)."""
+    pieces, new_starts, new_ends = [], [], []
+    last = 0
+    for match in NORMALIZE_REGEX.finditer(nltext):
+        replacement = __normalize_match(match)
+        pieces.append(nltext[last:match.start()])
+        pieces.append(replacement)
+        new_starts.extend(starts[last:match.start()])
+        new_ends.extend(ends[last:match.start()])
+        new_starts.extend([starts[match.start()]] * len(replacement))
+        new_ends.extend([ends[match.end() - 1]] * len(replacement))
+        last = match.end()
+    pieces.append(nltext[last:])
+    new_starts.extend(starts[last:])
+    new_ends.extend(ends[last:])
+    return u''.join(pieces), new_starts, new_ends
+
+def realign_offsets(before, after, starts, ends):
+    """ Carries offsets over an arbitrary step that turned `before` into `after`, by diffing the two.
+    Inserted or replaced characters get the span of the text they took the place of, or of their
+    neighbour when they took the place of nothing."""
+    if len(before) == len(after):
+        return list(starts), list(ends)
+    new_starts, new_ends = [], []
+    matcher = difflib.SequenceMatcher(None, before, after, autojunk=False)
+    for opcode, i1, i2, j1, j2 in matcher.get_opcodes():
+        if opcode == u'equal':
+            new_starts.extend(starts[i1:i2])
+            new_ends.extend(ends[i1:i2])
+        elif j2 > j1:
+            if i2 > i1:
+                start, end = starts[i1], ends[i2 - 1]
+            else:
+                start = end = ends[i1 - 1] if i1 > 0 else (starts[0] if starts else 0)
+            new_starts.extend([start] * (j2 - j1))
+            new_ends.extend([end] * (j2 - j1))
+    return new_starts, new_ends
+
+class PreprocessingPipeline(object):
+    """PreprocessingPipeline runs sanitize_string and normalize followed by any extra steps.
+
+    Attributes:
+        steps (list): Callables taking and returning a unicode string, run in order after the built-in
+        normalization.
+    """
+
+    def __init__(self, steps=None):
+        self.steps = list(steps or [])
+
+    def add_step(self, step):
+        """ Appends a callable taking and returning a unicode string."""
+        self.steps.append(step)
+
+    def add_substitution(self, pattern, replacement, flags=re.X|re.I):
+        """ Appends a regex substitution step. `pattern` is compiled here, not on every call."""
+        self.add_step(functools.partial(re.compile(pattern, flags=flags).sub, replacement))
+
+    def __call__(self, nltext):
+        nltext = normalize(correct_spelling(sanitize_string(nltext)))
+        for step in self.steps:
+            nltext = step(nltext)
+        return nltext
+
+    def with_offsets(self, nltext):
+        """ Returns (text, starts, ends) where text is what calling the pipeline returns and the
+        source of text[i] is nltext[starts[i]:ends[i]]. Lowercasing keeps every character in place, the
+        built-in normalization tracks its replacements and extra steps are realigned by diffing."""
+        nltext = correct_spelling(sanitize_string(nltext))
+        nltext, starts, ends = normalize_with_offsets(nltext, range(len(nltext)), range(1, len(nltext) + 1))
+        for step in self.steps:
+            before, nltext = nltext, step(nltext)
+            starts, ends = realign_offsets(before, nltext, starts, ends)
+        return nltext, starts, ends
+
+# Pipeline used by preprocess_input(). Steps added here apply to every parse.
+pipeline = PreprocessingPipeline()
 
 def preprocess_input(nltext):
-    return remove_stop_words(correct_spelling(replace_ordinals(replace_words(sanitize_string(nltext)))))
+    return pipeline(nltext)
 
+def preprocess_with_offsets(nltext):
+    return pipeline.with_offsets(nltext)
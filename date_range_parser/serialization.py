@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""serialization.py
+
+Turns parse results into JSON. utils.DateRangeParserEncoder tries to_json() and then __dict__ on every
+object json can not encode itself, paying for an exception each time either is missing. Here encoders
+are registered per class up front and looked up by type. Atoms are written straight from their
+JSON_FIELDS, and a datetime is formatted once per call no matter how many atoms point to it, which
+for `src_time` is all of them. dumps() gives the same string as DateRangeParserEncoder. With `compact`
+the atoms leave out `src_time`, the source day the caller already passed in.
+
+dumps_bytes() writes UTF-8 JSON without the spaces after separators, through ujson or simplejson when
+either is installed and through the standard library otherwise.
+"""
+
+import json
+import datetime
+import atoms
+
+# Faster JSON libraries dumps_bytes() uses when they are installed, in order of preference.
+BACKENDS = ('ujson', 'simplejson')
+
+# Encoders keyed on type. Each takes the Serializer and the object and returns something json can
+# encode, which may still hold objects that need an encoder of their own.
+ENCODERS = {}
+
+def register(cls, encoder):
+    """ Makes `encoder` the encoder for `cls` and for subclasses that have none of their own."""
+    ENCODERS[cls] = encoder
+
+class Serializer(json.JSONEncoder):
+    """ Serializer is a JSONEncoder that encodes what json can not through ENCODERS.
+
+    Attributes:
+        compact (bool): When True atoms leave out `src_time`.
+        datetimes (dict): Each datetime seen so far with its isoformat(), keyed on id().
+    """
+
+    def __init__(self, compact=False, **kwargs):
+        json.JSONEncoder.__init__(self, **kwargs)
+        self.compact = compact
+        self.datetimes = {}
+
+    def default(self, obj):
+        cls = type(obj)
+        encoder = ENCODERS.get(cls)
+        if encoder is None:
+            encoder = ENCODERS[cls] = lookup(cls)
+        return encoder(self, obj)
+
+def lookup(cls):
+    """ The encoder registered for the closest base of `cls`, or encode_fallback."""
+    for base in cls.__mro__[1:]:
+        encoder = ENCODERS.get(base)
+        if encoder is not None:
+            return encoder
+    return encode_fallback
+
+def encode_datetime(serializer, obj):
+    # Keyed on id() since datetimes in different zones can compare equal. The datetime is kept with its
+    # text so the id is not reused by one an encoder made and dropped.
+    seen = serializer.datetimes.get(id(obj))
+    if seen is None:
+        seen = serializer.datetimes[id(obj)] = (obj, obj.isoformat())
+    return seen[1]
+
+def encode_timedelta(serializer, obj):
+    return {u'timedelta': {u'total_seconds': obj.total_seconds()}}
+
+def encode_atom(serializer, atom):
+    compact = serializer.compact
+    encoded = {}
+    try:
+        for field in atom.JSON_FIELDS:
+            if field == u'tag':
+                encoded[field] = atom.tag_name()
+            elif not (compact and field == u'src_time'):
+                value = getattr(atom, field)
+                # Formatted here rather than on another trip through default().
+                encoded[field] = encode_datetime(serializer, value) if type(value) is datetime.datetime else value
+    except AttributeError:
+        # Same as DateRangeParserEncoder when to_json() fails: everything the atom has set.
+        return dict((field, value) for field, value in atom.__getstate__().iteritems()
+                if not (compact and field == u'src_time'))
+    return encoded
+
+def encode_fallback(serializer, obj):
+    """ What DateRangeParserEncoder does with a type it does not know."""
+    try:
+        return obj.to_json()
+    except AttributeError:
+        try:
+            return obj.__dict__
+        except AttributeError:
+            pass
+    getstate = getattr(obj, '__getstate__', None)
+    return getstate() if getstate else None
+
+register(datetime.datetime, encode_datetime)
+register(datetime.timedelta, encode_timedelta)
+register(atoms.Atom, encode_atom)
+
+def dumps(obj, compact=False):
+    return Serializer(compact).encode(obj)
+
+def encodable(obj, serializer):
+    """ `obj` with everything json can not encode replaced through `serializer`, for libraries that
+    take no `default` hook."""
+    if isinstance(obj, dict):
+        return dict((key, encodable(value, serializer)) for key, value in obj.iteritems())
+    elif isinstance(obj, (list, tuple)):
+        return [encodable(value, serializer) for value in obj]
+    elif obj is None or isinstance(obj, (basestring, int, long, float)):
+        return obj
+    return encodable(serializer.default(obj), serializer)
+
+_backend = []
+
+def json_backend():
+    """ Returns the module dumps_bytes() encodes with, picked the first time it is asked for."""
+    if not _backend:
+        for name in BACKENDS:
+            try:
+                _backend.append(__import__(name))
+                break
+            except ImportError:
+                pass
+        else:
+            _backend.append(json)
+    return _backend[0]
+
+def dumps_bytes(obj, compact=False):
+    """ `obj` as UTF-8 encoded JSON with no spaces after separators. Keys may come out in another order
+    than dumps() writes them."""
+    backend = json_backend()
+    if backend.__name__ == 'ujson':
+        text = backend.dumps(encodable(obj, Serializer(compact)), ensure_ascii=False, escape_forward_slashes=False)
+    elif backend is json:
+        # ASCII output is valid UTF-8, and the stdlib only escapes in C when it may use it.
+        text = Serializer(compact, separators=(',', ':')).encode(obj)
+    else:
+        text = backend.dumps(obj, default=Serializer(compact).default, ensure_ascii=False, separators=(',', ':'))
+    return text.encode('utf-8') if isinstance(text, unicode) else text
@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+"""server.py
+
+A small HTTP/JSON server around parse() for consumers that would rather not import the package and
+warm it up in every process of their own. It only needs the standard library and listens on
+localhost unless told otherwise.
+
+The server stays up between requests, and so do its warm parsers, compiled patterns, calendars and,
+when main() turns it on, the result cache. Parses run on a service.ParseService, so `workers` bounds how many run at a time and
+identical requests in flight are parsed once. Connections are kept alive between requests.
+
+    GET  /parse?text=...[&tz_name=...][&date=YYYY-MM-DD]
+    POST /parse   {"text": ..., "tz_name": ..., "date": ...}
+    POST /batch   {"texts": [...], "tz_name": ..., "date": ...}
+    GET  /metrics
+
+Results are written by to_json_bytes(), in the compact form of parallel.compact_result() when the
+service runs on processes. When the service is full for longer than `queue_timeout` seconds the
+request gets a 503.
+
+    python -m date_range_parser.server --port 8080 --workers 4
+"""
+
+import json
+import time
+import urlparse
+# datetime.strptime() imports it on first use, which fails when two handler threads race to do so.
+import _strptime
+import argparse
+import threading
+import BaseHTTPServer
+import SocketServer
+import pytz
+import date_range_parser
+import cache
+import utils
+import service
+
+# Largest request body read, in bytes, and most texts in one batch.
+MAX_BODY = 1 << 20
+MAX_BATCH = 1000
+
+class RequestError(Exception):
+    """ Raised for requests the server can not answer, with the HTTP status to answer with."""
+
+    def __init__(self, status, message):
+        Exception.__init__(self, message)
+        self.status = status
+
+class Metrics(object):
+    """Metrics counts requests per route for /metrics. It is shared by every handler thread.
+
+    Attributes:
+        started (float): When the server started.
+        routes (dict): requests, errors, busy and total seconds per route.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.routes = {}
+        self._lock = threading.Lock()
+
+    def record(self, route, status, elapsed):
+        with self._lock:
+            counts = self.routes.get(route)
+            if counts is None:
+                counts = self.routes[route] = {u'requests': 0, u'errors': 0, u'busy': 0, u'seconds': 0.0}
+            counts[u'requests'] += 1
+            counts[u'seconds'] += elapsed
+            if status == 503:
+                counts[u'busy'] += 1
+            elif status >= 400:
+                counts[u'errors'] += 1
+
+    def snapshot(self, parse_service):
+        """ The counters along with the state of `parse_service` and of this process' result cache."""
+        with self._lock:
+            routes = dict((route, dict(counts)) for route, counts in self.routes.iteritems())
+        return {u'uptime_seconds': time.time() - self.started,
+                u'routes': routes,
+                u'service': {u'executor_type': parse_service.executor_type, u'workers': parse_service.workers,
+                             u'max_pending': parse_service.max_pending, u'pending': parse_service.pending(),
+                             u'coalesced': parse_service.coalesced},
+                u'result_cache': cache.result_cache.stats()}
+
+def request_tz_name(request):
+    """ The "tz_name" of `request`. Unknown ones are refused rather than getting a parser each."""
+    tz_name = request.get(u'tz_name')
+    if tz_name is not None and tz_name not in pytz.all_timezones_set:
+        raise RequestError(400, u'Unknown tz_name {0}'.format(tz_name))
+    return tz_name
+
+def source_time(request, tz_name):
+    """ The source day of `request` from its "date" in `tz_name`, or None for today."""
+    day = request.get(u'date')
+    if not day:
+        return None
+    try:
+        return utils.source_day(day, tz_name)
+    except ValueError as e:
+        raise RequestError(400, unicode(e))
+
+def text_field(value):
+    if not isinstance(value, basestring):
+        raise RequestError(400, u'Expected a text')
+    return value
+
+def parse_one(server, request):
+    text = text_field(request.get(u'text'))
+    tz_name = request_tz_name(request) or server.service.tz_name
+    # Only the wait for room is bounded, a parse that has started is waited for.
+    return server.service.submit(text, source_time(request, tz_name), tz_name, block=True,
+            timeout=server.queue_timeout).result()
+
+def parse_batch(server, request):
+    texts = request.get(u'texts')
+    if not isinstance(texts, list):
+        raise RequestError(400, u'Expected a list of texts')
+    if len(texts) > MAX_BATCH:
+        raise RequestError(413, u'At most {0} texts per batch'.format(MAX_BATCH))
+    tz_name = request_tz_name(request) or server.service.tz_name
+    src_time = source_time(request, tz_name)
+    futures = [server.service.submit(text_field(text), src_time, tz_name, block=True,
+            timeout=server.queue_timeout) for text in texts]
+    return [future.result() for future in futures]
+
+ROUTES = {'/parse': parse_one, '/batch': parse_batch}
+
+class ParseRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ Answers the routes in ROUTES and /metrics. HTTP/1.1, so connections are kept alive."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        url = urlparse.urlsplit(self.path)
+        if url.path == '/metrics':
+            self.respond(200, self.server.metrics.snapshot(self.server.service))
+        else:
+            query = urlparse.parse_qs(url.query)
+            try:
+                request = dict((key, values[-1].decode('utf-8')) for key, values in query.iteritems())
+            except UnicodeDecodeError:
+                return self.handle_route(url.path, None, RequestError(400, u'Expected a UTF-8 query'))
+            self.handle_route(url.path, request)
+
+    def do_POST(self):
+        url = urlparse.urlsplit(self.path)
+        try:
+            length = int(self.headers.getheader('content-length') or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            # There is no telling where the body ends, so the connection can not be reused.
+            self.close_connection = 1
+            return self.handle_route(url.path, None, RequestError(400, u'Invalid Content-Length'))
+        if length > MAX_BODY:
+            # The body is left unread, so the connection can not be reused.
+            self.close_connection = 1
+            return self.handle_route(url.path, None, RequestError(413, u'Request body too large'))
+        body = self.rfile.read(length)
+        try:
+            request = json.loads(body.decode('utf-8'))
+        except ValueError:
+            return self.handle_route(url.path, None, RequestError(400, u'Expected a JSON object'))
+        self.handle_route(url.path, request)
+
+    def handle_route(self, route, request, error=None):
+        started = time.time()
+        try:
+            if error is not None:
+                raise error
+            handler = ROUTES.get(route)
+            if handler is None:
+                raise RequestError(404, u'Unknown path {0}'.format(route))
+            if not isinstance(request, dict):
+                raise RequestError(400, u'Expected a JSON object')
+            status, body = 200, handler(self.server, request)
+        except RequestError as e:
+            status, body = e.status, {u'error': unicode(e)}
+        except service.ServiceBusy as e:
+            status, body = 503, {u'error': unicode(e)}
+        except Exception as e:
+            status, body = 500, {u'error': u'{0}: {1}'.format(type(e).__name__, e)}
+        self.respond(status, body)
+        self.server.metrics.record(route if route in ROUTES else u'other', status, time.time() - started)
+
+    def respond(self, status, body):
+        data = date_range_parser.to_json_bytes(body)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        if status == 503:
+            self.send_header('Retry-After', '1')
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+class ParseServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """ParseServer answers each connection on a thread of its own and hands the parses to `service`.
+
+    Attributes:
+        service (ParseService): Runs the parses.
+        metrics (Metrics): Counters reported on /metrics.
+        queue_timeout (float|None): Seconds a request waits for room on a full service before it is
+        answered with a 503.
+        verbose (bool): Log every request to stderr.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+    # Connections waiting to be accepted. Past the default of 5, clients that connect at once wait on
+    # SYN retries.
+    request_queue_size = 128
+
+    def __init__(self, address, parse_service, queue_timeout=1.0, verbose=False):
+        BaseHTTPServer.HTTPServer.__init__(self, address, ParseRequestHandler)
+        self.service = parse_service
+        self.metrics = Metrics()
+        self.queue_timeout = queue_timeout
+        self.verbose = verbose
+
+    def server_close(self):
+        BaseHTTPServer.HTTPServer.server_close(self)
+        self.service.close()
+
+def make_server(host='127.0.0.1', port=8080, workers=4, executor_type=u'thread', max_pending=64, tz_name=None,
+        parse_type=u'range', output_format=u'days', deadline_ms=None, queue_timeout=1.0, verbose=False):
+    """ Builds a warmed up ParseServer bound to `host` and `port`, 0 for any free port. Call
+    serve_forever() on it to start answering."""
+    parse_service = service.ParseService(workers, executor_type, max_pending, tz_name, parse_type, output_format,
+            deadline_ms)
+    if executor_type == u'thread':
+        date_range_parser.default_parser(tz_name, parse_type, output_format).warmup()
+    try:
+        return ParseServer((host, port), parse_service, queue_timeout, verbose)
+    except Exception:
+        parse_service.close()
+        raise
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=u'Serves date_range_parser.parse() over HTTP.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--executor', default=u'thread', choices=service.EXECUTORS)
+    parser.add_argument('--max-pending', type=int, default=64)
+    parser.add_argument('--tz-name')
+    parser.add_argument('--parse-type', default=u'range', choices=(u'range', u'exact'))
+    parser.add_argument('--output-format', default=u'days', choices=date_range_parser.OUTPUT_FORMATS)
+    parser.add_argument('--deadline-ms', type=int)
+    parser.add_argument('--queue-timeout', type=float, default=1.0)
+    parser.add_argument('--cache-size', type=int, default=1024, help=u'Results kept by the thread executor, 0 for none.')
+    parser.add_argument('--verbose', action='store_true')
+    options = parser.parse_args(args)
+    if options.cache_size > 0:
+        cache.result_cache.configure(max_size=options.cache_size)
+    server = make_server(options.host, options.port, options.workers, options.executor, options.max_pending,
+            options.tz_name, options.parse_type, options.output_format, options.deadline_ms, options.queue_timeout,
+            options.verbose)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == '__main__':
+    main()
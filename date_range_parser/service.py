@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""service.py
+
+Runs parses off the caller's thread for servers built around an event loop, where a parse on the
+loop holds up every other request.
+
+ParseService.submit() returns a concurrent.futures.Future right away and the parse runs on a bounded
+pool of threads or worker processes. At most `max_pending` parses are queued or running at a time,
+past that submit() raises ServiceBusy, or waits for room when asked to. A request for the same text,
+day and timezone as one that is still running is handed that parse's Future instead of starting
+another one.
+
+The package runs on python 2, which has no asyncio, so the facade is the Future itself. Event loops
+can wait on it through their own adapters, like asyncio.wrap_future() on python 3, or through
+add_done_callback().
+"""
+
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import date_range_parser
+import parallel
+import cache
+
+EXECUTORS = (u'thread', u'process')
+
+class ServiceBusy(Exception):
+    """ Raised by ParseService.submit() when `max_pending` parses are already queued or running."""
+
+def _parse_compact(tz_name, parse_type, output_format, src_time, text, deadline_ms):
+    parser = parallel.worker_parser(tz_name, parse_type, output_format)
+    return parallel.compact_result(parser.parse(text, src_time, deadline_ms))
+
+class ParseService(object):
+    """ParseService parses on a bounded executor and coalesces identical requests that are in flight.
+
+    Attributes:
+        executor_type (unicode): u'thread' runs parses on threads of this process with the shared
+        default parsers. u'process' runs them on worker processes, which keeps them from competing with
+        the caller for the GIL, and results come back in parallel.compact_result() form.
+        workers (int): Parses run at the same time.
+        max_pending (int): Parses queued or running before submit() pushes back.
+        tz_name (string|unicode): Timezone used when submit() is not given one.
+        parse_type (unicode): Either u'range' or u'exact'.
+        output_format (unicode): One of date_range_parser.OUTPUT_FORMATS.
+        deadline_ms (int|None): Time budget handed to every parse, see DateRangeParser.parse().
+        coalesced (int): Requests answered by a parse that was already in flight.
+    """
+
+    def __init__(self, workers=4, executor_type=u'thread', max_pending=64, tz_name=None, parse_type=u'range',
+            output_format=u'days', deadline_ms=None):
+        if executor_type not in EXECUTORS:
+            raise ValueError(u'Invalid executor_type. Try "thread" or "process"')
+        if workers < 1 or max_pending < workers:
+            raise ValueError(u'Invalid limits. Need at least 1 worker and max_pending of at least workers')
+        self.executor_type = executor_type
+        self.workers = workers
+        self.max_pending = max_pending
+        self.tz_name = tz_name
+        self.parse_type = parse_type
+        self.output_format = output_format
+        self.deadline_ms = deadline_ms
+        self.coalesced = 0
+        # Validates parse_type and output_format and resolves source days the way the workers do.
+        self.parser = date_range_parser.DateRangeParser(tz_name, parse_type=parse_type, output_format=output_format)
+        # Futures of the parses queued or running, keyed like the result cache.
+        self._in_flight = {}
+        self._room = threading.Condition(threading.Lock())
+        if executor_type == u'thread':
+            self.executor = ThreadPoolExecutor(max_workers=workers)
+        else:
+            self.executor = parallel.worker_pool(workers, tz_name, parse_type, output_format)
+
+    def submit(self, text, src_time=None, tz_name=None, block=False, timeout=None):
+        """ Returns a Future for the parse of `text`. Requests for the same text, day and timezone as a
+        parse still in flight share its Future and its result. Raises ServiceBusy when the service is
+        full, unless `block` is set, in which case it waits up to `timeout` seconds for room."""
+        tz_name = tz_name or self.tz_name
+        src_time = self.__parser(tz_name).source_time(src_time)
+        key = cache.result_key(text, src_time, tz_name, self.parse_type, self.output_format)
+        with self._room:
+            waited = 0.0
+            while True:
+                future = self._in_flight.get(key)
+                if future is not None:
+                    self.coalesced += 1
+                    return future
+                if len(self._in_flight) < self.max_pending:
+                    break
+                if not block or (timeout is not None and waited >= timeout):
+                    raise ServiceBusy(u'{0} parses are already pending'.format(self.max_pending))
+                started = time.time()
+                self._room.wait(None if timeout is None else timeout - waited)
+                waited += time.time() - started
+            if self.executor_type == u'thread':
+                future = self.executor.submit(self.__parse, text, src_time, tz_name)
+            else:
+                future = self.executor.submit(_parse_compact, tz_name, self.parse_type, self.output_format, src_time,
+                        text, self.deadline_ms)
+            self._in_flight[key] = future
+        # Outside the lock, a Future that is already done runs the callback right here.
+        future.add_done_callback(lambda done: self.__finish(key))
+        return future
+
+    def parse(self, text, src_time=None, tz_name=None, timeout=None):
+        """ Parses `text` on the service and waits for the result."""
+        return self.submit(text, src_time, tz_name, block=True, timeout=timeout).result(timeout)
+
+    def pending(self):
+        """ Number of distinct parses queued or running."""
+        with self._room:
+            return len(self._in_flight)
+
+    def __parser(self, tz_name):
+        if tz_name == self.tz_name:
+            return self.parser
+        return date_range_parser.default_parser(tz_name, self.parse_type, self.output_format)
+
+    def __parse(self, text, src_time, tz_name):
+        return date_range_parser.default_parser(tz_name, self.parse_type, self.output_format).parse(text, src_time,
+                self.deadline_ms)
+
+    def __finish(self, key):
+        with self._room:
+            del self._in_flight[key]
+            self._room.notify()
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
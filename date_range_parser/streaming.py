@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""streaming.py
+
+Extracts date ranges from documents that are too long, or arrive too slowly, to hand to parse() in one
+piece, like email threads and meeting transcripts.
+
+The text is read a chunk at a time and cut into sentences at safe boundaries: a blank line, or sentence
+punctuation followed by whitespace and an uppercase letter or digit, unless the period ends a day or
+month abbreviation like "Mon." or "Sept.", which can be part of a range. Every sentence is parsed on its own and each date range in it is
+yielded with its offsets in the document. Only the unfinished sentence at the end of what
+has been read is kept around, and a sentence that runs past `max_span` characters is cut at its last
+whitespace, so memory stays bounded however large the document is.
+"""
+
+import re
+import codecs
+import date_range_parser
+from lazyregex import LazyRegex
+
+# Where one sentence may end and the next begin, see _is_boundary().
+SENTENCE_BOUNDARY_REGEX = LazyRegex(r'(?<=[.!?])\s+|\n\s*\n', flags=re.U)
+BLANK_LINE_REGEX = LazyRegex(r'\n\s*\n', flags=re.U)
+# Abbreviations whose period does not end a sentence, matched against the few characters before a boundary.
+ABBREVIATION_REGEX = LazyRegex(r'(?:^|\W)(?:mon|tues?|wed|thu(?:rs?)?|fri|sat|sun|'
+        r'jan|feb|mar|apr|jun|jul|aug|sept?|oct|nov|dec|[ap]\.m)\.\Z', flags=re.I | re.U)
+WHITESPACE_REGEX = LazyRegex(r'\s', flags=re.U)
+
+def iter_text(stream, chunk_size=8192, encoding='utf-8'):
+    """ Yields unicode chunks of `stream`, which can be a file-like object with read(), a string or an
+    iterable of strings such as the lines of a file. Byte strings are decoded with `encoding`, also when
+    a character is split across chunks."""
+    if isinstance(stream, basestring):
+        chunks = [stream]
+    elif hasattr(stream, 'read'):
+        chunks = iter(lambda: stream.read(chunk_size), '')
+    else:
+        chunks = stream
+    decoder = codecs.getincrementaldecoder(encoding)()
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = decoder.decode(chunk)
+        if chunk:
+            yield chunk
+    tail = decoder.decode('', final=True)
+    if tail:
+        yield tail
+
+def iter_sentences(stream, chunk_size=8192, max_span=2000, encoding='utf-8'):
+    """ Yields (start, end, sentence) for every non blank sentence in `stream`, where start and end are
+    offsets of the stripped sentence in the whole document."""
+    if max_span < 1:
+        raise ValueError(u'Invalid max_span. Must be at least 1')
+    buffer = u''
+    # Offset of buffer[0] in the document.
+    offset = 0
+    for chunk in iter_text(stream, chunk_size, encoding):
+        buffer += chunk
+        pos = 0
+        for boundary in SENTENCE_BOUNDARY_REGEX.finditer(buffer):
+            if boundary.end() == len(buffer):
+                # The whitespace may go on in the next chunk.
+                break
+            if not _is_boundary(buffer, boundary):
+                continue
+            for sentence in _stripped(buffer, pos, boundary.start(), offset):
+                yield sentence
+            pos = boundary.end()
+        while len(buffer) - pos > max_span:
+            cut = _last_whitespace(buffer, pos, pos + max_span)
+            for sentence in _stripped(buffer, pos, cut, offset):
+                yield sentence
+            pos = cut
+        buffer = buffer[pos:]
+        offset += pos
+    for sentence in _stripped(buffer, 0, len(buffer), offset):
+        yield sentence
+
+def _is_boundary(text, boundary):
+    """ Whether a sentence ends at `boundary`, a match of SENTENCE_BOUNDARY_REGEX that is followed by
+    more text."""
+    if BLANK_LINE_REGEX.search(boundary.group()):
+        return True
+    start, following = boundary.start(), text[boundary.end()]
+    if not (following.isupper() or following.isdigit()):
+        return False
+    return not ABBREVIATION_REGEX.search(text[max(0, start - 7):start])
+
+def _last_whitespace(text, pos, endpos):
+    """ Offset of the last whitespace in text[pos:endpos], or endpos when there is none."""
+    cut = endpos
+    for match in WHITESPACE_REGEX.finditer(text, pos + 1, endpos):
+        cut = match.start()
+    return cut
+
+def _stripped(text, start, end, offset):
+    """ Yields text[start:end] with surrounding whitespace dropped and document offsets, unless it is blank."""
+    sentence = text[start:end]
+    stripped = sentence.lstrip()
+    start += len(sentence) - len(stripped)
+    stripped = stripped.rstrip()
+    if stripped:
+        yield (offset + start, offset + start + len(stripped), stripped)
+
+def iter_extract(stream, src_time=None, tz_name=None, parse_type=u'range', chunk_size=8192, max_span=2000,
+        encoding='utf-8'):
+    """ Yields a dict(match, start, end, result, parse, spans) for every date range in `stream`, as
+    DateRangeParser.parse_all() finds them sentence by sentence, with `start`, `end` and `spans` moved
+    to offsets in the whole document. The source day is resolved once, when the first sentence is
+    parsed, so a long stream agrees on "today" throughout."""
+    parser = date_range_parser.default_parser(tz_name, parse_type)
+    src_time = parser.source_time(src_time)
+    for offset, _, sentence in iter_sentences(stream, chunk_size, max_span, encoding):
+        for found in parser.parse_all(sentence, src_time):
+            found[u'start'] += offset
+            found[u'end'] += offset
+            found[u'spans'] = [(start + offset, end + offset) for start, end in found[u'spans']]
+            yield found
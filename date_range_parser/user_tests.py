@@ -2,9 +2,14 @@
 import unittest
 import date_range_parser
 
-import pytz, datetime, operator
+import os, ast, pytz, datetime, operator
 from datetime import timedelta
 
+CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), u'data', u'test_inputs.txt')
+
+# Time a cold `import date_range_parser` may take. It is around 0.03s without the deferred modules.
+IMPORT_BUDGET_SECONDS = 0.25
+
 
 class BasicTests(unittest.TestCase):
 
@@ -17,6 +22,18 @@ class BasicTests(unittest.TestCase):
         self.assertEqual((result[u'startDate'], result[u'endDate']), \
                 (truth_dt_tuple[0].isoformat(), truth_dt_tuple[1].isoformat()))
 
+    def _corpus(self):
+        """ The quoted one-per-line inputs of data/test_inputs.txt."""
+        def unquote(line):
+            try:
+                return ast.literal_eval(line)
+            except SyntaxError:
+                # A few lines contain unescaped quotes, just strip the outer ones.
+                return line[1:-1]
+        with open(CORPUS_PATH) as f:
+            lines = [line.strip().rstrip(']') for line in f]
+        return [unicode(unquote(line)) for line in lines if line]
+
     def _compareReconvertibleText(self, nltext, src_time):
         original = date_range_parser.parse(nltext, src_time)
         original_res = original.get(u'result')
@@ -634,6 +651,19 @@ class BasicTests(unittest.TestCase):
         self._compareResults(r2[0], (d8_3+timedelta(hours=(24+12)), d8_3+timedelta(hours=(24+15))))
         self.assertEqual(len(r2), 1)
 
+    def test_preprocessing_pipeline(self):
+        import preprocessing
+        chained = lambda nltext: preprocessing.remove_stop_words(preprocessing.replace_ordinals(
+                preprocessing.replace_words(preprocessing.sanitize_string(nltext))))
+
+        for nltext in self._corpus() + [u'At noon on the 1st', u'two days in the 22nd week', u'3rd\\bseven', None]:
+            self.assertEqual(preprocessing.preprocess_input(nltext), chained(nltext))
+
+        pipeline = preprocessing.PreprocessingPipeline()
+        pipeline.add_substitution(r'\btmrw\b', u'tomorrow')
+        pipeline.add_step(lambda nltext: nltext.strip())
+        self.assertEqual(pipeline(u' Tmrw at Noon '), u'tomorrow  12 pm')
+
     def test_reconvertible_text(self):
 
         src_time = self.timezone.localize(datetime.datetime(2014, 8, 3))
@@ -650,6 +680,637 @@ class BasicTests(unittest.TestCase):
         self._compareReconvertibleText(u"09/12/2014", src_time)
         self._compareReconvertibleText(u"between 9/12/2014 and 9/13/2014", src_time)
 
+    def test_natural_daterange_parser(self):
+        import natural_date_range
+        d8_6 = self.timezone.localize(datetime.datetime(2014, 8, 6))
+        monday = self.timezone.localize(datetime.datetime(2014, 8, 4))
+        saturday = self.timezone.localize(datetime.datetime(2014, 8, 9))
+
+        self.assertEqual(natural_date_range.natural_daterange_parser(u'sometime this week', d8_6),
+                (u'this week', (d8_6, saturday)))
+        self.assertEqual(natural_date_range.natural_daterange_parser(u'NEXT weekend', d8_6),
+                (u'NEXT weekend', (saturday + timedelta(days=7), saturday + timedelta(days=9))))
+        self.assertEqual(natural_date_range.natural_daterange_parser(u'this weekend or in 2 weeks', d8_6, first=False),
+                [(u'this weekend', (saturday, saturday + timedelta(days=2))),
+                 (u'2 weeks', (monday + timedelta(days=14), saturday + timedelta(days=14)))])
+        self.assertEqual(natural_date_range.natural_daterange_parser(u'no ranges', d8_6), [])
+        self.assertEqual(natural_date_range.parse_date_range(u'weekly', d8_6), None)
+
+    def test_reused_parser(self):
+        src_time = self.timezone.localize(datetime.datetime(2014, 8, 3))
+        parser = date_range_parser.DateRangeParser(self.tz_name)
+
+        for nltext in [u'monday morning', u'between monday and wednesday', u'next week after 4 pm']:
+            self.assertEqual(parser.parse(nltext, src_time).get(u'result'),
+                    date_range_parser.parse(nltext, src_time).get(u'result'))
+        self.assertRaises(ValueError, date_range_parser.DateRangeParser, self.tz_name, u'fuzzy')
+
+    def test_parse_many(self):
+        src_time = self.timezone.localize(datetime.datetime(2014, 8, 3))
+        texts = [u'monday morning', u'no dates here', u'Monday Morning', u'between monday and wednesday']
+
+        results = date_range_parser.parse_many(texts, src_time, self.tz_name)
+        self.assertEqual([r.get(u'result') for r in results],
+                [date_range_parser.parse(t, src_time, self.tz_name).get(u'result') for t in texts])
+        # Texts that preprocess to the same string are only parsed once, and each gets its own copy.
+        self.assertEqual(results[0], results[2])
+        self.assertFalse(results[0] is results[2])
+        expected = date_range_parser.parse(texts[2], src_time, self.tz_name)
+        results[0][u'result'].append(None)
+        results[0][u'parse'][0][u'display_text'] = None
+        self.assertEqual(results[2][u'result'], expected[u'result'])
+        self.assertEqual(results[2][u'parse'][0][u'display_text'], expected[u'parse'][0][u'display_text'])
+
+    def test_parallel_parse_many(self):
+        import parallel
+        src_time = self.timezone.localize(datetime.datetime(2014, 8, 3))
+        texts = [u'monday morning', u'no dates here', u'between monday and wednesday'] * 3
+
+        with parallel.ParallelParser(2, self.tz_name, chunk_size=2) as parser:
+            results = parser.parse_many(texts, src_time)
+        expected = [parallel.compact_result(r) for r in date_range_parser.parse_many(texts, src_time, self.tz_name)]
+        self.assertEqual(results, expected)
+        self.assertEqual(results[1][u'parse'], None)
+        self.assertEqual(results[2][u'parse'][0][u'markup'], [(u'2014-08-04T00:00:00-04:00', u'2014-08-07T00:00:00-04:00')])
+
+        # parse_many() with workers keeps its pool for the next batch with the same settings.
+        try:
+            self.assertEqual(date_range_parser.parse_many(texts, src_time, self.tz_name, workers=2), expected)
+            shared = parallel.shared_parser(2, self.tz_name)
+            self.assertEqual(date_range_parser.parse_many(texts[:2], src_time, self.tz_name, workers=2), expected[:2])
+            self.assertTrue(parallel.shared_parser(2, self.tz_name) is shared)
+        finally:
+            parallel.close_shared_parsers()
+        self.assertFalse(parallel.shared_parser(2, self.tz_name) is shared)
+        parallel.close_shared_parsers()
+
+    def test_iter_extract(self):
+        import streaming
+        from StringIO import StringIO
+        src_time = self.timezone.localize(datetime.datetime(2014, 8, 3))
+        document = (u'Hi all,\n\nThanks for the notes. Can we meet monday morning or sunday afternoon?\n'
+                u'I am out tomorrow.  Otherwise 9.12.2014 works!\n\nBest, A')
+
+        for stream in (StringIO(document), iter(document.splitlines(True)), document.encode('utf-8')):
+            found = list(streaming.iter_extract(stream, src_time, self.tz_name, chunk_size=7))
+            self.assertEqual([document[f[u'start']:f[u'end']] for f in found], [f[u'match'] for f in found])
+            self.assertEqual([f[u'match'] for f in found], [u'monday morning or sunday afternoon', u'tomorrow', u'9.12.2014'])
+            self.assertEqual([f[u'result'] for f in found],
+                    [date_range_parser.parse(f[u'match'], src_time, self.tz_name)[u'result'] for f in found])
+            self.assertEqual([document[start:end] for start, end in found[0][u'spans']],
+                    [u'monday', u'morning', u' or ', u'sunday', u'afternoon'])
+
+        # Abbreviations and lowercase words after a period do not start a sentence.
+        for text in (u'Mon. - Fri', u'next wed. or thu. afternoon', u'Sept. 5 - Sept. 9. Oct. 2 maybe.'):
+            expected = [(f[u'match'], f[u'start'], f[u'result']) for f in date_range_parser.parse_all(text, src_time, self.tz_name)]
+            self.assertEqual([(f[u'match'], f[u'start'], f[u'result']) for f in streaming.iter_extract(text, src_time, self.tz_name, chunk_size=3)],
+                    expected)
+        self.assertEqual([s for _, _, s in streaming.iter_sentences(u'Thanks. Friday works. Aug. 5 too? yes.\n\nok.')],
+                [u'Thanks.', u'Friday works.', u'Aug. 5 too? yes.', u'ok.'])
+
+        # Sentences with no boundary in sight are cut at whitespace.
+        sentences = list(streaming.iter_sentences(u'one two three four', chunk_size=3, max_span=8))
+        self.assertEqual(sentences, [(0, 7, u'one two'), (8, 13, u'three'), (14, 18, u'four')])
+
+    def test_parse_all(self):
+        src_time = self.timezone.localize(datetime.datetime(2014, 8, 3))
+        text = u'Can we meet Monday morning or Sunday afternoon? If not, ten am to noon on Tuesday. Or next week.'
+        found = date_range_parser.parse_all(text, src_time, self.tz_name)
+        self.assertEqual([f[u'match'] for f in found],
+                [u'Monday morning or Sunday afternoon', u'ten am to noon on Tuesday', u'next week'])
+        self.assertEqual([text[f[u'start']:f[u'end']] for f in found], [f[u'match'] for f in found])
+        # Offsets survive the number words being replaced during preprocessing.
+        self.assertEqual([text[start:end] for start, end in found[1][u'spans']], [u' ten am to noon', u'on Tuesday'])
+        # The first one is what parse() returns and each of the others agrees with parsing its match alone.
+        self.assertEqual(found[0][u'result'], date_range_parser.parse(text, src_time, self.tz_name)[u'result'])
+        for f in found:
+            self.assertEqual(f[u'result'], date_range_parser.parse(f[u'match'], src_time, self.tz_name)[u'result'])
+        self.assertEqual(date_range_parser.parse_all(u'nothing to see here', src_time, self.tz_name), [])
+
+    def test_slotted_atoms(self):
+        import pickle
+        import extraction
+        d8_3 = self.timezone.localize(datetime.datetime(2014, 8, 3))
+        extractions = extraction.DateGrammarAtomTagger(d8_3).tag(u'between monday 10 am and next friday afternoon')
+        for atom in extractions:
+            self.assertFalse(hasattr(atom, u'__dict__'))
+            # An atom is its own tag, with the same fields the tuple used to have.
+            self.assertTrue(atom.to_tag() is atom)
+            self.assertEqual(list(atom.to_tag()), [atom.match, atom.to_tag()[1], atom])
+            self.assertEqual(atom[:2], (atom.match, atom[-2]))
+            self.assertEqual(pickle.loads(pickle.dumps(atom)).to_json(), atom.to_json())
+        self.assertEqual([atom[1] for atom in extractions], [u'BW', u'DR', u'AND', u'DR', u'MOD'])
+
+    def test_split_by_days(self):
+        import utils
+        d10_31 = self.timezone.localize(datetime.datetime(2014, 10, 31, 17, 0))
+        d11_4 = self.timezone.localize(datetime.datetime(2014, 11, 4))
+        splits = [(s.isoformat(), e.isoformat()) for s, e in utils.split_by_days(d10_31, d11_4)]
+        # Every midnight gets the offset in effect then, before and after the DST change on 11/2.
+        self.assertEqual(splits, [(u'2014-10-31T17:00:00-04:00', u'2014-11-01T00:00:00-04:00'),
+                (u'2014-11-01T00:00:00-04:00', u'2014-11-02T00:00:00-04:00'),
+                (u'2014-11-02T00:00:00-04:00', u'2014-11-03T00:00:00-05:00'),
+                (u'2014-11-03T00:00:00-05:00', u'2014-11-04T00:00:00-05:00')])
+        self.assertTrue(utils.split_by_days(d10_31, d11_4) is not utils.split_by_days(d10_31, d11_4))
+        self.assertEqual(utils.split_by_days(d10_31, d10_31 + timedelta(hours=3)), [(d10_31, d10_31 + timedelta(hours=3))])
+        # A start past the DST change that still carries the offset from before it gets the new one.
+        stale = datetime.datetime(2014, 11, 3, tzinfo=d10_31.tzinfo)
+        splits = [(s.isoformat(), e.isoformat()) for s, e in utils.split_by_days(stale, d11_4 + timedelta(days=1))]
+        self.assertEqual(splits, [(u'2014-11-03T00:00:00-05:00', u'2014-11-04T00:00:00-05:00'),
+                (u'2014-11-04T00:00:00-05:00', u'2014-11-05T00:00:00-05:00')])
+        result = date_range_parser.parse(u'next week', self.timezone.localize(datetime.datetime(2014, 10, 29)), self.tz_name)
+        self.assertEqual(result[u'result'][0], {u'startDate': u'2014-11-03T00:00:00-05:00', u'endDate': u'2014-11-04T00:00:00-05:00'})
+
+        # A day is not lost when the clocks go forward.
+        d3_7 = self.timezone.localize(datetime.datetime(2015, 3, 7))
+        self.assertEqual(len(utils.split_range(d3_7, self.timezone.localize(datetime.datetime(2015, 3, 10)))), 3)
+        # Months without the day are skipped.
+        d1_31 = self.timezone.localize(datetime.datetime(2015, 1, 31))
+        self.assertEqual([s.month for s, e in utils.split_range(d1_31, d1_31 + timedelta(days=70), u'months')], [1, 3])
+        self.assertRaises(ValueError, utils.iter_split, d1_31, d1_31, u'years')
+
+    def test_output_formats(self):
+        import dateutil.parser
+        src_time = self.timezone.localize(datetime.datetime(2014, 8, 3))
+        def expand(runs):
+            days = []
+            for run in runs:
+                start, end = dateutil.parser.parse(run[u'startDate']), dateutil.parser.parse(run[u'endDate'])
+                days.extend({u'startDate': (start + timedelta(days=i)).isoformat(), u'endDate': (end + timedelta(days=i)).isoformat()}
+                        for i in range(run[u'days']))
+            return days
+
+        for nltext in [u'this week', u'next week after 5pm', u'monday morning or sunday afternoon', u'8/10/2014 - 8/20/2014']:
+            days, intervals, runs = [date_range_parser.parse(nltext, src_time, self.tz_name, output_format=output_format)[u'result']
+                    for output_format in date_range_parser.OUTPUT_FORMATS]
+            # Runs fold days in place and intervals merge them.
+            self.assertEqual(expand(runs), days)
+            self.assertEqual(intervals[0][u'startDate'], min(day[u'startDate'] for day in days))
+            self.assertEqual(intervals[-1][u'endDate'], max(day[u'endDate'] for day in days))
+            self.assertTrue(len(intervals) <= len(days) and len(runs) <= len(days))
+
+        result = date_range_parser.parse(u'next week after 5pm', src_time, self.tz_name, output_format=u'runs')[u'result']
+        self.assertEqual(result, [{u'startDate': u'2014-08-11T17:00:00-04:00', u'endDate': u'2014-08-12T00:00:00-04:00', u'days': 5}])
+        result = date_range_parser.parse(u'this week', src_time, self.tz_name, output_format=u'intervals')[u'result']
+        self.assertEqual(result, [{u'startDate': u'2014-08-04T00:00:00-04:00', u'endDate': u'2014-08-09T00:00:00-04:00'}])
+        self.assertRaises(ValueError, date_range_parser.DateRangeParser, self.tz_name, output_format=u'weeks')
+
+    def test_serialization(self):
+        import json, serialization
+        from utils import DateRangeParserEncoder
+        src_time = self.timezone.localize(datetime.datetime(2014, 8, 3))
+        for nltext in [u'monday morning', u'next 3 days after 5pm', u'between 8/4/2014 and 8/6/2014']:
+            response = date_range_parser.parse(nltext, src_time, self.tz_name)
+            self.assertEqual(date_range_parser.to_json(response), DateRangeParserEncoder().encode(response))
+            encoded = date_range_parser.to_json_bytes(response)
+            self.assertTrue(isinstance(encoded, str))
+            self.assertEqual(json.loads(encoded), json.loads(date_range_parser.to_json(response)))
+            self.assertFalse(u'src_time' in date_range_parser.to_json(response, compact=True))
+
+        atom = date_range_parser.parse(u'next 3 days', src_time, self.tz_name)[u'parse'][0][u'daterange']
+        self.assertEqual(sorted(atom.to_json()), sorted(type(atom).JSON_FIELDS))
+        self.assertEqual(json.loads(serialization.dumps(atom))[u'src_time'], src_time.isoformat())
+
+        # Datetimes a registered encoder makes are dropped after encoding, and their ids reused.
+        class Offset(object):
+            def __init__(self, days):
+                self.days = days
+        serialization.register(Offset, lambda serializer, obj: datetime.datetime(2014, 1, 1) + datetime.timedelta(days=obj.days))
+        try:
+            self.assertEqual(json.loads(date_range_parser.to_json([Offset(i) for i in range(5)])),
+                    [u'2014-01-0%dT00:00:00' % (i + 1) for i in range(5)])
+        finally:
+            del serialization.ENCODERS[Offset]
+
+    def test_parse_session(self):
+        import incremental, preprocessing
+        src_time = self.timezone.localize(datetime.datetime(2014, 8, 3))
+        parser = date_range_parser.DateRangeParser(self.tz_name)
+        session = parser.session(src_time)
+        text = u'Thanks for the quick reply. Can we meet next tuesday between 2 and 4pm? Or friday morning.'
+        for i in range(1, len(text) + 1):
+            self.assertEqual(date_range_parser.to_json(session.parse(text[:i])), date_range_parser.to_json(parser.parse(text[:i], src_time)))
+        # Edits in the middle, and a text that has nothing in common with the one before.
+        for edited in [text.replace(u'tuesday', u'wednesday'), text.replace(u'2 and 4pm', u'noon and 3pm'), u'monday', u'']:
+            self.assertEqual(date_range_parser.to_json(session.parse(edited)), date_range_parser.to_json(parser.parse(edited, src_time)))
+        # Atoms can join across any amount of whitespace, like "before" and "2 weeks" here.
+        for spaces in (0, 10, 45, 60, 200):
+            before = u'between before' + u' ' * spaces
+            session = date_range_parser.parse_session(src_time, self.tz_name)
+            session.parse(before)
+            self.assertEqual(session.parse(before + u'2 weeks')[u'result'],
+                    date_range_parser.parse(before + u'2 weeks', src_time, self.tz_name)[u'result'])
+
+        self.assertEqual(incremental.words_before(u'at  10 am - 2', 12, 2), 7)
+        self.assertEqual(incremental.words_after(u'at  10 am - 2', 1, 2), 6)
+        self.assertEqual(incremental.common_prefix_length(u'next tuesday', u'next thursday'), 6)
+        self.assertEqual(incremental.common_suffix_length(u'next tuesday', u'next thursday', 6), 4)
+        lowered = u'at noon in the 2nd week'
+        for pos in range(len(lowered) + 1):
+            split = preprocessing.split_point(lowered, pos)
+            self.assertEqual(preprocessing.normalize(lowered[:split]) + preprocessing.normalize(lowered[split:]), preprocessing.normalize(lowered))
+        self.assertEqual(preprocessing.split_point(lowered, 11), 8)
+
+    def test_deadline(self):
+        import json, cache, utils, extraction, preprocessing
+        src_time = self.timezone.localize(datetime.datetime(2014, 8, 3))
+        text = preprocessing.preprocess_input(u'Can we meet between 2pm-4pm on Saturday? Or friday morning, or 9/11 after 5pm. Thanks!')
+        for mode in extraction.DateGrammarAtomTagger.MODES:
+            tagger = extraction.DateGrammarAtomTagger(mode=mode)
+            full = [(atom.match, atom.tag_name()) for atom in tagger.tag(text, src_time)]
+            # A clock that moves a second on every check runs out after `checks` of them.
+            for checks in range(12):
+                ticks = iter(range(1000))
+                deadline = utils.Deadline(checks * 1000, clock=lambda: next(ticks))
+                partial = [(atom.match, atom.tag_name()) for atom in tagger.tag(text, src_time, deadline)]
+                self.assertTrue(set(partial) <= set(full))
+                self.assertTrue(deadline.reached or partial == full)
+
+        result_cache = cache.ResultCache()
+        parser = date_range_parser.DateRangeParser(self.tz_name, result_cache=result_cache)
+        self.assertEqual(parser.parse(text, src_time, deadline_ms=0), {u'result': [], u'parse': None, u'partial': True})
+        # Partial results are not cached.
+        self.assertEqual(result_cache.stats()[u'size'], 0)
+        result = parser.parse(text, src_time, deadline_ms=60000)
+        self.assertFalse(u'partial' in result)
+        expected = date_range_parser.DateRangeParser(self.tz_name).parse(text, src_time)
+        self.assertEqual(json.loads(date_range_parser.to_json(result)), json.loads(date_range_parser.to_json(expected)))
+
+        # Inputs that are not strings parse to nothing, with or without a max_length.
+        for text in (None, 42):
+            self.assertEqual(date_range_parser.parse(text, src_time, self.tz_name), {u'result': [], u'parse': None})
+            self.assertEqual(parser.parse(text, src_time, max_length=5), {u'result': [], u'parse': None})
+        self.assertEqual(preprocessing.truncate(u'next tuesday afternoon', 15), u'next tuesday')
+        self.assertEqual(preprocessing.truncate(u'next tuesday afternoon', 12), u'next tuesday')
+        self.assertEqual(preprocessing.truncate(u'tuesday', 3), u'tue')
+        result = parser.parse(u'next tuesday afternoon', src_time, max_length=15)
+        self.assertTrue(result[u'truncated'])
+        self.assertEqual(result[u'result'], parser.parse(u'next tuesday', src_time)[u'result'])
+
+    def test_parse_service(self):
+        import time, service, parallel
+        src_time = self.timezone.localize(datetime.datetime(2014, 8, 3))
+        # A long text keeps the only worker busy while the rest queue up behind it.
+        busy = u' '.join([u'Can we meet next tuesday between 2 and 4pm? Thanks for the quick reply.'] * 200)
+        with service.ParseService(workers=1, max_pending=3, tz_name=self.tz_name) as parse_service:
+            first = parse_service.submit(busy, src_time)
+            monday = parse_service.submit(u'monday morning', src_time)
+            self.assertTrue(parse_service.submit(u'monday morning', src_time) is monday)
+            self.assertEqual(parse_service.coalesced, 1)
+            parse_service.submit(u'friday', src_time)
+            self.assertRaises(service.ServiceBusy, parse_service.submit, u'next week', src_time)
+            self.assertRaises(service.ServiceBusy, parse_service.submit, u'next week', src_time, block=True, timeout=0.01)
+            result = parse_service.parse(u'next week', src_time)
+            self.assertEqual(result[u'result'], date_range_parser.parse(u'next week', src_time, self.tz_name)[u'result'])
+            self.assertEqual(monday.result()[u'result'], date_range_parser.parse(u'monday morning', src_time, self.tz_name)[u'result'])
+            first.result()
+            # Futures wake up waiters before they run their callbacks.
+            for _ in range(100):
+                if not parse_service.pending():
+                    break
+                time.sleep(0.01)
+            self.assertEqual(parse_service.pending(), 0)
+
+        with service.ParseService(workers=2, executor_type=u'process', tz_name=self.tz_name) as parse_service:
+            result = parse_service.parse(u'monday morning', src_time)
+            self.assertEqual(result, parallel.compact_result(date_range_parser.parse(u'monday morning', src_time, self.tz_name)))
+        self.assertRaises(ValueError, service.ParseService, executor_type=u'fiber')
+
+    def test_parse_server(self):
+        import json, httplib, threading, server
+        src_time = self.timezone.localize(datetime.datetime(2014, 8, 3))
+        expected = lambda text: json.loads(date_range_parser.to_json(date_range_parser.parse(text, src_time, self.tz_name)))
+        parse_server = server.make_server(port=0, workers=1, tz_name=self.tz_name)
+        thread = threading.Thread(target=parse_server.serve_forever)
+        thread.start()
+        try:
+            # Every request below goes over the one kept alive connection.
+            connection = httplib.HTTPConnection(*parse_server.server_address)
+
+            def request(method, path, body=None):
+                connection.request(method, path, body and json.dumps(body))
+                response = connection.getresponse()
+                return response.status, json.loads(response.read())
+
+            self.assertEqual(request('GET', '/parse?text=monday+morning&date=2014-08-03'), (200, expected(u'monday morning')))
+            self.assertEqual(request('POST', '/parse', {u'text': u'next week', u'date': u'2014-08-03'}), (200, expected(u'next week')))
+            self.assertEqual(request('POST', '/batch', {u'texts': [u'friday', u'monday morning'], u'date': u'2014-08-03'}),
+                    (200, [expected(u'friday'), expected(u'monday morning')]))
+            self.assertEqual(request('POST', '/parse', {u'text': 3})[0], 400)
+            self.assertEqual(request('POST', '/parse', {u'text': u'friday', u'tz_name': u'Mars/Base'})[0], 400)
+            self.assertEqual(request('GET', '/parse?text=friday&date=friday')[0], 400)
+            self.assertEqual(request('GET', '/nowhere')[0], 404)
+            self.assertEqual(request('GET', '/parse?text=%ff')[0], 400)
+            status, metrics = request('GET', '/metrics')
+            self.assertEqual(status, 200)
+            self.assertEqual(metrics[u'routes'][u'/parse'][u'requests'], 6)
+            self.assertEqual(metrics[u'routes'][u'/parse'][u'errors'], 4)
+            self.assertEqual(metrics[u'routes'][u'/batch'][u'requests'], 1)
+            self.assertEqual(metrics[u'service'][u'workers'], 1)
+            connection.close()
+
+            # Content-Lengths that are not lengths, or too long, are answered rather than read.
+            for length, status in (('-1', 400), ('ten', 400), (str(server.MAX_BODY + 1), 413)):
+                connection = httplib.HTTPConnection(*parse_server.server_address)
+                connection.putrequest('POST', '/parse')
+                connection.putheader('Content-Length', length)
+                connection.endheaders()
+                response = connection.getresponse()
+                self.assertEqual(response.status, status)
+                connection.close()
+        finally:
+            parse_server.shutdown()
+            parse_server.server_close()
+            thread.join()
+
+    def test_cli(self):
+        import os, json, shutil, tempfile, StringIO, cli
+        d8_3 = self.timezone.localize(datetime.datetime(2014, 8, 3))
+        paris = pytz.timezone(u'Europe/Paris').localize(datetime.datetime(2014, 8, 10))
+        expected = lambda text, src_time, tz_name: json.loads(date_range_parser.to_json(date_range_parser.parse(text, src_time, tz_name)))[u'result']
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, u'inputs.ndjson')
+            with open(path, 'w') as f:
+                f.write(u'monday morning\n\n{"text": "friday", "id": 1}\n'
+                        u'{"text": "next week", "tz_name": "Europe/Paris", "date": "2014-08-10"}\n'
+                        u'{"text": 3}\n{"text": "friday", "tz_name": "Mars/Base"}\n'.encode('utf-8'))
+            outputs = []
+            for workers in (0, 2):
+                out = StringIO.StringIO()
+                counts, timings = cli.run([path + u'?date=2014-08-03'], out, tz_name=self.tz_name, workers=workers, chunk_size=2)
+                self.assertEqual(counts, {u'records': 5, u'errors': 2})
+                self.assertEqual(sorted(timings), sorted(cli.STAGES))
+                outputs.append([json.loads(line) for line in out.getvalue().splitlines()])
+            self.assertEqual(outputs[0], outputs[1])
+            lines = outputs[0]
+            self.assertEqual([(line[u'line'], line[u'id']) for line in lines], [(1, None), (3, 1), (4, None), (5, None), (6, None)])
+            self.assertEqual(lines[0][u'result'], expected(u'monday morning', d8_3, self.tz_name))
+            self.assertEqual(lines[1][u'result'], expected(u'friday', d8_3, self.tz_name))
+            self.assertEqual(lines[2][u'result'], expected(u'next week', paris, u'Europe/Paris'))
+            self.assertTrue(u'error' in lines[3] and u'error' in lines[4])
+            self.assertEqual(cli.split_input(u'a.txt?tz_name=UTC&date=2014-08-03'), (u'a.txt', u'UTC', u'2014-08-03'))
+
+            # Lines that are not UTF-8 and inputs that can not be opened are errors, not the end of the run.
+            with open(path, 'w') as f:
+                f.write('next tuesday\n\xff\xfe bad\nfriday\n')
+            out = StringIO.StringIO()
+            counts, timings = cli.run([path + u'?date=2014-08-03', os.path.join(directory, u'missing.txt')], out,
+                    tz_name=self.tz_name, workers=0)
+            self.assertEqual(counts, {u'records': 4, u'errors': 2})
+            lines = [json.loads(line) for line in out.getvalue().splitlines()]
+            self.assertEqual([(line[u'line'], u'error' in line) for line in lines], [(1, False), (2, True), (3, False), (None, True)])
+            self.assertEqual(lines[2][u'result'], expected(u'friday', d8_3, self.tz_name))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_instrumentation(self):
+        import json, instrumentation
+
+        class Recorder(instrumentation.Instrument):
+            def __init__(self):
+                self.events = []
+            def started(self, stage, size):
+                self.events.append((u'started', stage, size))
+            def finished(self, stage, seconds, size, atoms):
+                self.events.append((u'finished', stage, size, atoms))
+
+        src_time = self.timezone.localize(datetime.datetime(2014, 8, 3))
+        text = u'between monday 10 am and next friday afternoon'
+        parser = date_range_parser.DateRangeParser(self.tz_name)
+        expected = json.loads(date_range_parser.to_json(parser.parse(text, src_time)))
+        recorder, registry = Recorder(), instrumentation.MetricsRegistry()
+        with instrumentation.installed(instrumentation.MultiInstrument(recorder, registry)):
+            self.assertEqual(json.loads(date_range_parser.to_json(parser.parse(text, src_time))), expected)
+        self.assertTrue(instrumentation.current is instrumentation.NULL_INSTRUMENT)
+
+        finished = [event for event in recorder.events if event[0] == u'finished']
+        stages = [event[1] for event in finished]
+        self.assertEqual(recorder.events[0], (u'started', u'parse', len(text)))
+        self.assertEqual(finished[-1], (u'finished', u'parse', len(text), None))
+        self.assertEqual([stage for stage in stages if not stage.startswith(u'tag.') and stage != u'parsedatetime'],
+                [u'preprocess', u'tag', u'chunk', u'traverse', u'metadata', u'format', u'parse'])
+        self.assertEqual([stage for stage in stages if stage.startswith(u'tag.')],
+                [u'tag.' + AtomClass.__name__ for AtomClass in parser.tagger.atom_precedence])
+        self.assertTrue(u'parsedatetime' in stages)
+        # The atoms of every pass add up to those tag() returned.
+        tag = [event for event in finished if event[1] == u'tag'][0]
+        self.assertEqual(sum(event[3] for event in finished if event[1].startswith(u'tag.')), tag[3])
+        self.assertEqual(len(recorder.events), 2 * len(finished))
+
+        snapshot = registry.snapshot()
+        self.assertEqual(snapshot[u'tag'][u'atoms'], tag[3])
+        self.assertEqual(snapshot[u'parse'][u'count'], 1)
+        self.assertEqual(snapshot[u'parse'][u'in_progress'], 0)
+        self.assertEqual(snapshot[u'parse'][u'buckets'][-1], (float('inf'), 1))
+        rendered = registry.render()
+        self.assertTrue(u'date_range_parser_stage_seconds_count{stage="parse"} 1\n' in rendered)
+        self.assertTrue(u'date_range_parser_stage_seconds_bucket{stage="parse",le="+Inf"} 1\n' in rendered)
+        self.assertTrue(u'date_range_parser_stage_atoms_total{stage="tag"} %d\n' % tag[3] in rendered)
+
+        # Stages that raise are finished all the same, with no atoms.
+        registry = instrumentation.MetricsRegistry()
+        with instrumentation.installed(registry):
+            # Without a timezone parsedatetime results can not be localized to the naive "now", see warmup().
+            self.assertRaises(AttributeError, date_range_parser.DateRangeParser().parse, text)
+        self.assertEqual(registry.snapshot()[u'parse'][u'count'], 1)
+        self.assertEqual([stage for stage, counters in registry.snapshot().iteritems()
+                if isinstance(counters, dict) and counters.get(u'in_progress')], [])
+
+    def test_day_table(self):
+        import calendar, day_table, natural_date_range, utils
+        resolve = natural_date_range.__dict__[u'__parse_range_match']
+        arithmetic = natural_date_range.__dict__[u'__parse_range_arithmetic']
+        texts = [u'this weekend', u'next week', u'this month', u'3 weekends', u'2 months', u'0 weeks', u'900 months']
+        for tz in (None, pytz.utc, self.timezone, pytz.timezone(u'Australia/Sydney')):
+            for days in range(0, 400, 11):
+                day = datetime.datetime(2013, 12, 25) + timedelta(days=days)
+                src_time = tz.localize(day) if tz else day
+                for text in texts:
+                    match = natural_date_range.NATURAL_RANGE_REGEX.search(text)
+                    result = resolve(match, src_time)
+                    walls = [dt.replace(tzinfo=None) for dt in arithmetic(match, src_time)]
+                    self.assertEqual([dt.replace(tzinfo=None) for dt in result], walls)
+                    # Each bound has the offset in effect on its own day.
+                    self.assertEqual([dt.tzinfo for dt in result], [tz.localize(wall).tzinfo if tz else None for wall in walls])
+        start, end = date_range_parser.parse(u'next week', self.timezone.localize(datetime.datetime(2014, 10, 29)),
+                self.tz_name)[u'parse'][0][u'markup'][0]
+        self.assertEqual((start.isoformat(), end.isoformat()), (u'2014-11-03T00:00:00-05:00', u'2014-11-08T00:00:00-05:00'))
+
+        # December ends on the first of January of the next year.
+        end = utils.end_of_month(self.timezone.localize(datetime.datetime(2014, 12, 1, 0, 0, 7)))
+        self.assertEqual(end.replace(tzinfo=None), datetime.datetime(2015, 1, 1, 0, 0, 7))
+        self.assertEqual(utils.end_of_month(datetime.datetime(2016, 2, 1)), datetime.datetime(2016, 3, 1))
+
+        # The day rolls over in the zone of the table, here an hour after 2014-11-02 04:00 UTC.
+        now = [calendar.timegm((2014, 11, 2, 3, 30, 0))]
+        tables = day_table.DayTables(years=1, max_other_tables=1, clock=lambda: now[0])
+        ordinal = datetime.date(2014, 11, 1).toordinal()
+        table = tables.table(self.timezone, ordinal)
+        self.assertEqual(table.anchor, ordinal)
+        self.assertEqual(table.midnight(ordinal + 1).isoformat(), u'2014-11-02T00:00:00-04:00')
+        self.assertEqual(table.midnight(ordinal + 2).isoformat(), u'2014-11-03T00:00:00-05:00')
+        self.assertEqual(day_table.DayTable(None, ordinal).midnight(ordinal, pytz.utc).isoformat(), u'2014-11-01T00:00:00+00:00')
+        self.assertEqual(table.week_start(ordinal), datetime.date(2014, 10, 27).toordinal())
+        self.assertEqual(table.weekend_start(ordinal + 1), ordinal)
+        self.assertTrue(tables.table(self.timezone, ordinal) is table)
+        now[0] += 3600
+        self.assertEqual(tables.table(self.timezone, ordinal).anchor, ordinal + 1)
+        # Days far off get tables of their own, and only the latest is kept.
+        far = tables.table(self.timezone, ordinal + 1000)
+        self.assertEqual(far.anchor, ordinal + 1000)
+        self.assertTrue(tables.table(self.timezone, ordinal + 1000) is far)
+        tables.table(self.timezone, ordinal - 1000)
+        self.assertFalse(tables.table(self.timezone, ordinal + 1000) is far)
+
+    def test_result_cache(self):
+        import cache
+        now = [0]
+        result_cache = cache.ResultCache(max_size=2, ttl=60, clock=lambda: now[0])
+        parser = date_range_parser.DateRangeParser(self.tz_name, result_cache=result_cache)
+        src_time = self.timezone.localize(datetime.datetime(2014, 8, 3, 10, 0, 32))
+
+        r1 = parser.parse(u'monday morning', src_time)
+        # Any time on the same day and the same preprocessed text hit the same entry.
+        self.assertTrue(parser.parse(u'Monday Morning', src_time.replace(hour=18)) is r1)
+        self.assertEqual(r1.get(u'result'), date_range_parser.DateRangeParser(self.tz_name).parse(u'monday morning', src_time).get(u'result'))
+        self.assertFalse(parser.parse(u'monday morning', src_time + timedelta(days=1)) is r1)
+        self.assertEqual(result_cache.stats(), {u'hits': 1, u'misses': 2, u'evictions': 0, u'expirations': 0, u'size': 2})
+
+        # Cached results can not be changed by callers.
+        self.assertRaises(TypeError, r1.__setitem__, u'result', [])
+        self.assertRaises(TypeError, r1[u'result'].append, None)
+        self.assertRaises(TypeError, r1[u'result'][0].update, {})
+        atom = r1[u'parse'][0][u'daterange']
+        self.assertRaises(TypeError, setattr, atom, u'start', None)
+        self.assertRaises(TypeError, delattr, atom, u'end')
+        self.assertEqual(date_range_parser.to_json(r1),
+                date_range_parser.to_json(date_range_parser.DateRangeParser(self.tz_name).parse(u'monday morning', src_time)))
+        import pickle
+        unpickled = pickle.loads(pickle.dumps(r1, 2))[u'parse'][0][u'daterange']
+        self.assertEqual((unpickled.start, unpickled.end), (atom.start, atom.end))
+        self.assertRaises(TypeError, setattr, unpickled, u'start', None)
+
+        parser.parse(u'between monday and wednesday', src_time)
+        self.assertEqual(result_cache.stats()[u'evictions'], 1)
+        now[0] = 61
+        self.assertFalse(parser.parse(u'between monday and wednesday', src_time) is None)
+        self.assertEqual(result_cache.stats()[u'expirations'], 1)
+
+        # Parsers that tag differently do not share entries.
+        import extraction
+        shared = cache.ResultCache()
+        text = u'between monday and wednesday'
+        parsers = [date_range_parser.DateRangeParser(self.tz_name, result_cache=shared),
+                   date_range_parser.DateRangeParser(self.tz_name, result_cache=shared, tagger_mode=u'lexer'),
+                   date_range_parser.DateRangeParser(self.tz_name, result_cache=shared,
+                           atom_precedence=extraction.RANGE_ATOM_PRECEDENCE[1:])]
+        results = [parser.parse(text, src_time) for parser in parsers]
+        self.assertEqual(shared.stats()[u'size'], 3)
+        self.assertTrue(all(parser.parse(text, src_time) is result for parser, result in zip(parsers, results)))
+
+    def test_tag_sequence_chunker(self):
+        import grammar
+        import extraction
+        import preprocessing
+        from nltk.chunk import RegexpParser
+        d8_3 = self.timezone.localize(datetime.datetime(2014, 8, 3))
+        def structure(tree):
+            if not hasattr(tree, u'node'):
+                return tuple(tree[:2])
+            return (tree.node, [structure(child) for child in tree])
+
+        # The chunker has to build the same trees nltk's RegexpParser does for our grammars.
+        for parse_type, rules in ((u'range', grammar.range_grammar), (u'exact', grammar.exact_grammar)):
+            tagger = extraction.DateGrammarAtomTagger(parse_type=parse_type)
+            chunker, reference = grammar.TagSequenceChunker(rules), RegexpParser(rules)
+            for nltext in self._corpus():
+                tags = [e.to_tag() for e in tagger.tag(preprocessing.preprocess_input(nltext), d8_3)]
+                # nltk only takes real tuples.
+                self.assertEqual(structure(chunker.parse(tags)), structure(reference.parse(map(tuple, tags))))
+        tree = grammar.range_grammar_regex_parser.parse([(u'a', u'BW'), (u'b', u'DR'), (u'c', u'AND'), (u'd', u'MOD'), (u'e', u'DR')])
+        self.assertEqual([t.node for t in tree.subtrees()], [u'S', u'BW_DR', u'MOD_DR', u'MOD_DR'])
+        self.assertRaises(ValueError, grammar.TagSequenceChunker, u'MOD_DR <DR>')
+
+    def test_import_budget(self):
+        import os, sys, json, subprocess
+        # Modules that are only loaded on first use, or never for spelling correction.
+        deferred = [u'nltk', u'textblob', u'parsedatetime', u'dateutil.rrule']
+        script = u"""
+import sys, json, time
+t0 = time.time()
+import date_range_parser
+elapsed = time.time() - t0
+loaded = [name for name in %r if name in sys.modules]
+date_range_parser.warmup()
+print json.dumps(dict(elapsed=elapsed, loaded=loaded, warm=[name for name in %r if name in sys.modules]))
+""" % (deferred, deferred)
+        # Import the package the way users do, from the directory above it, in a fresh interpreter.
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        output = subprocess.check_output([sys.executable, u'-c', script], cwd=root)
+        result = json.loads(output.splitlines()[-1])
+        self.assertEqual(result[u'loaded'], [])
+        # Ranges are split without rrule, so it is never loaded.
+        self.assertEqual(result[u'warm'], [u'parsedatetime'])
+        self.assertTrue(result[u'elapsed'] < IMPORT_BUDGET_SECONDS, result[u'elapsed'])
+
+    def test_lazy_regex_registry(self):
+        import gc, grammar, lazyregex
+        grammar.TagSequenceChunker(grammar.range_grammar)
+        gc.collect()
+        registered = len(lazyregex.LazyRegex.instances)
+        # Chunkers that are dropped do not leave their patterns behind.
+        for _ in range(3):
+            grammar.TagSequenceChunker(grammar.range_grammar)
+        gc.collect()
+        self.assertEqual(len(lazyregex.LazyRegex.instances), registered)
+        lazyregex.compile_lazy_regexes()
+
+    def test_calendar_registry(self):
+        import utils, threading
+        registry = utils.CalendarRegistry()
+        calendar = registry.calendar()
+        self.assertTrue(registry.calendar() is calendar)
+        self.assertEqual(registry.stats(), {u'built': 1, u'reused': 1})
+
+        # Calendars are not shared between threads.
+        other = []
+        thread = threading.Thread(target=lambda: other.append(registry.calendar()))
+        thread.start()
+        thread.join()
+        self.assertFalse(other[0] is calendar)
+
+        registry.configure(pooled=False)
+        self.assertFalse(registry.calendar() is registry.calendar())
+
+        # Parsing "before friday" must not change how later weekdays resolve.
+        d8_3 = self.timezone.localize(datetime.datetime(2014, 8, 3))
+        friday = date_range_parser.parse(u'friday', d8_3).get(u'result')
+        date_range_parser.parse(u'before friday', d8_3, parse_type=u'exact')
+        self.assertEqual(date_range_parser.parse(u'friday', d8_3).get(u'result'), friday)
+
+    def test_span_tagger(self):
+        import extraction
+        d8_3 = self.timezone.localize(datetime.datetime(2014, 8, 3))
+        tags = lambda nltext, mode: [e.to_tag()[:2] for e in extraction.DateGrammarAtomTagger(d8_3, mode=mode).tag(nltext)]
+
+        for nltext in [u'between 2-4 and 5-7 on friday', u'monday morning or sunday afternoon', u'before 4 pm next wednesday']:
+            self.assertEqual(tags(nltext, u'span'), tags(nltext, u'sequential'))
+        # The match is located by offset rather than by looking for an earlier copy of its text.
+        self.assertEqual(tags(u'free afteroon after saturday', u'span'), [(u'after', u'MOD'), (u'saturday', u'DR')])
+        self.assertEqual([t[1] for t in tags(u'sometime tomorrow up to', u'span')], [u'DR', u'TO'])
+
+    def test_lexer_tagger(self):
+        import extraction
+        import preprocessing
+        d8_3 = self.timezone.localize(datetime.datetime(2014, 8, 3))
+        tags = lambda nltext, mode, parse_type: [e.to_tag()[:2] for e in
+                extraction.DateGrammarAtomTagger(d8_3, parse_type=parse_type, mode=mode).tag(nltext)]
+
+        for nltext in [preprocessing.preprocess_input(text) for text in self._corpus()] + [u'from 10 pm - 2 am', u'8-5 - 8-10']:
+            for parse_type in (u'range', u'exact'):
+                self.assertEqual(tags(nltext, u'lexer', parse_type), tags(nltext, u'span', parse_type))
+
 
 if __name__ == '__main__':
     unittest.main()\
@@ -9,10 +9,14 @@ This files contains utilities that are use for the date range parser.
 """
 
 
+import re
+import time
+import bisect
 import datetime
-import parsedatetime
-from natural_date_range import natural_daterange_parser
-from dateutil import rrule
+import threading
+import natural_date_range
+import cache
+import instrumentation
 import pytz
 from json import JSONEncoder
 
@@ -30,33 +34,114 @@ class DateRangeParserEncoder(JSONEncoder):
                 try:
                     return o.__dict__
                 except AttributeError:
-                    return None
+                    pass
+                # Atoms keep their attributes in __slots__.
+                getstate = getattr(o, '__getstate__', None)
+                return getstate() if getstate else None
 
 def safe_natural_daterange_parser(text, src_time):
-    result = natural_daterange_parser(text, src_time)
+    result = natural_date_range.natural_daterange_parser(text, src_time)
     if result:
         return {u'start': result[1][0], u'end': result[1][1], u'match': result[0], u'label':u'success'}
     else:
         return {u'start': None, u'end': None, u'match': None, u'label':u'fail'}
 
-def safe_parsedatetime_first_nlp(text, src_time, ignore=None):
+class CalendarRegistry(object):
+    """ CalendarRegistry hands out parsedatetime.Calendar instances keyed on locale so they are built
+    once instead of on every call. A Calendar keeps parse state on the instance, so each thread gets
+    its own pool.
+
+    parsedatetime can leave `DOWParseStyle` changed on the calendar's constants after parsing phrases
+    like "before friday", so pooled calendars get it restored before they are handed out again.
+
+    Attributes:
+        default_locale (string|None): Locale used when none is asked for. None is parsedatetime's default.
+        pooled (bool): When False a new Calendar is built for every request, which is the old behaviour.
+        built (int): Number of calendars built since the last reset_stats().
+        reused (int): Number of times a pooled calendar was handed out again since the last reset_stats().
+    """
+
+    def __init__(self, default_locale=None, pooled=True):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.default_locale = default_locale
+        self.pooled = pooled
+        self.built = 0
+        self.reused = 0
+
+    def configure(self, default_locale=None, pooled=True):
+        """ Change the default locale or turn pooling off. Calendars built so far are dropped."""
+        with self._lock:
+            self.default_locale = default_locale
+            self.pooled = pooled
+            self._local = threading.local()
+
+    def calendar(self, locale=None):
+        """ Returns a Calendar for `locale` that is safe to use from the calling thread."""
+        locale = locale or self.default_locale
+        pool = self.__thread_pool()
+        pooled = pool.get(locale) if self.pooled else None
+        if pooled is None:
+            # parsedatetime is only imported once a calendar is needed.
+            import parsedatetime
+            constants = parsedatetime.Constants(localeID=locale) if locale else None
+            calendar = parsedatetime.Calendar(constants)
+            if self.pooled:
+                pool[locale] = (calendar, calendar.ptc.DOWParseStyle)
+            self.__count(built=1)
+        else:
+            calendar, dow_parse_style = pooled
+            calendar.ptc.DOWParseStyle = dow_parse_style
+            self.__count(reused=1)
+        return calendar
+
+    def stats(self):
+        """ Snapshot of how many calendars were built and reused."""
+        with self._lock:
+            return {u'built': self.built, u'reused': self.reused}
+
+    def reset_stats(self):
+        with self._lock:
+            self.built = 0
+            self.reused = 0
+
+    def __thread_pool(self):
+        local = self._local
+        try:
+            return local.calendars
+        except AttributeError:
+            local.calendars = {}
+            return local.calendars
+
+    def __count(self, built=0, reused=0):
+        with self._lock:
+            self.built += built
+            self.reused += reused
+
+# Registry safe_parsedatetime_first_nlp and parsedatetime_nlp_spans take the calendar for `locale` from.
+calendar_registry = CalendarRegistry()
+
+# Constants for unpacking NLP match tuples.
+NLP_MTC_DT =  0
+NLP_MTC_FLG = 1
+NLP_MTC_BEG = 2
+NLP_MTC_END = 3
+NLP_MTC_MTC = 4
+# Parsedatetime flags for parse type.
+PARSE_TYPE_FAIL = 0
+PARSE_TYPE_DATE = 1
+PARSE_TYPE_TIME = 2
+PARSE_TYPE_DTTM = 3
+PARSE_NAMES = [u'fail', u'date', u'time', u'datetime']
+
+def safe_parsedatetime_first_nlp(text, src_time, ignore=None, locale=None):
     """ SafeParseDatetime is a simple wrapper on the functionality that we need from
     parsedatetime.Calendar().nlp(). It handles parsing and checking all the flags so we don't
     have to clutter client code with the mechanics of dealing with the parse results."""
-    calendar = parsedatetime.Calendar()
-    # Constants for unpacking NLP match tuples.
-    NLP_MTC_DT =  0
-    NLP_MTC_FLG = 1
-    NLP_MTC_BEG = 2
-    NLP_MTC_END = 3
-    NLP_MTC_MTC = 4
-    # Parsedatetime flags for parse type.
-    PARSE_TYPE_FAIL = 0
-    PARSE_TYPE_DATE = 1
-    PARSE_TYPE_TIME = 2
-    PARSE_TYPE_DTTM = 3
-    parse_names = [u'fail', u'date', u'time', u'datetime']
-    parse = calendar.nlp(text, sourceTime=src_time)
+    calendar = calendar_registry.calendar(locale)
+    with instrumentation.start(u'parsedatetime', len(text)) as timer:
+        parse = calendar.nlp(text, sourceTime=src_time)
+        timer.stop(len(parse or ()))
     unacceptable_parses = [PARSE_TYPE_FAIL] if not ignore else [PARSE_TYPE_FAIL, PARSE_TYPE_TIME]
     if parse:
         try:
@@ -65,12 +150,32 @@ def safe_parsedatetime_first_nlp(text, src_time, ignore=None):
             if first_match[NLP_MTC_FLG] not in unacceptable_parses:
                 return {u'datetime': localize_to(src_time, first_match[NLP_MTC_DT]),
                         u'match': first_match[NLP_MTC_MTC],
-                        u'label': parse_names[first_match[NLP_MTC_FLG]]}
+                        u'label': PARSE_NAMES[first_match[NLP_MTC_FLG]]}
         except IndexError:
             pass
     # Always return this if we don't exit in the optimal condition above.
     return {u'datetime': None, u'match':None, u'label': u'fail'}
 
+def parsedatetime_nlp_spans(text, pos, endpos, src_time, ignore=None, locale=None):
+    """ Generates the (start, end) offsets of parsedatetime matches in text[pos:endpos]. Like
+    safe_parsedatetime_first_nlp it stops at the first match that is not an acceptable parse.
+    parsedatetime only accepts strings, so the fragment is sliced once and its matches are walked
+    instead of re-parsing the remainder after every match."""
+    calendar = calendar_registry.calendar(locale)
+    with instrumentation.start(u'parsedatetime', endpos - pos) as timer:
+        parse = calendar.nlp(text[pos:endpos], sourceTime=src_time)
+        timer.stop(len(parse or ()))
+    unacceptable_parses = [PARSE_TYPE_FAIL] if not ignore else [PARSE_TYPE_FAIL, PARSE_TYPE_TIME]
+    last_end = pos
+    for nlp_match in parse or ():
+        start, end = pos + nlp_match[NLP_MTC_BEG], pos + nlp_match[NLP_MTC_END]
+        if start < last_end:
+            continue
+        if nlp_match[NLP_MTC_FLG] in unacceptable_parses:
+            return
+        last_end = end
+        yield (start, end)
+
 def localize_to(src_time, dt):
     user_tz = pytz.timezone(src_time.tzinfo.zone)
     return user_tz.localize(dt)
@@ -92,26 +197,207 @@ def start_of_day(dt):
     """ Returns the corresponding start of a given day."""
     return dt.replace(hour=0, minute=0, second=0, microsecond=0)
 
+def source_day(day, tz_name=None):
+    """ Returns the start of `day`, given as YYYY-MM-DD or as an ISO 8601 time on that day, in `tz_name`.
+    Raises ValueError for anything else and for timezones pytz does not know."""
+    if not isinstance(day, basestring) or len(day) > 10 and day[10] not in u'T ':
+        raise ValueError(u'Invalid date. Try YYYY-MM-DD')
+    try:
+        src_time = datetime.datetime.strptime(day[:10], '%Y-%m-%d')
+    except ValueError:
+        raise ValueError(u'Invalid date. Try YYYY-MM-DD')
+    if not tz_name:
+        return src_time
+    if tz_name not in pytz.all_timezones_set:
+        raise ValueError(u'Unknown tz_name {0}'.format(tz_name))
+    return pytz.timezone(tz_name).localize(src_time)
+
 def end_of_day(dt):
     """ Returns the corresponding end of a given day. """
     end_of_day = dt + datetime.timedelta(days=1)
     return end_of_day.replace(hour=0, minute=0, second=0, microsecond=0)
 
 def end_of_month(dt):
-    """Returns the corresponding end of month."""
-    month_bump = dt.month + 1 if dt.month < 12 else 1
-    return dt.replace(month=month_bump, day=1,hour=0, minute=0, microsecond=0)
+    """Returns the corresponding end of month, the first of the next one."""
+    if dt.month < 12:
+        return dt.replace(month=dt.month + 1, day=1, hour=0, minute=0, microsecond=0)
+    return dt.replace(year=dt.year + 1, month=1, day=1, hour=0, minute=0, microsecond=0)
+
+# Ranges are split by the modifiers and again when results are formatted, usually with the same bounds.
+split_cache = cache.ResultCache(max_size=4096)
+
+SPLIT_ON = (u'days', u'weeks', u'months')
+
+def localize_wall(wall, tzinfo):
+    """ Attaches `tzinfo` to the naive `wall` time. pytz zones look up the offset in effect at that time
+    instead of keeping the one they were created with, so days after a DST change get the right one."""
+    if tzinfo is None:
+        return wall
+    localize = getattr(tzinfo, 'localize', None)
+    return localize(wall) if localize else wall.replace(tzinfo=tzinfo)
+
+def localize_walls(walls, tzinfo):
+    """ Lazily does localize_wall() for increasing naive times. localize() is slow, so it is only called
+    again once a time is past the next DST change in the zone's transition table."""
+    transitions = getattr(tzinfo, '_utc_transition_times', None)
+    if not transitions:
+        for wall in walls:
+            yield localize_wall(wall, tzinfo)
+        return
+    current = None
+    for wall in walls:
+        if current is None or wall - offset >= next_change:
+            aware = tzinfo.localize(wall)
+            current, offset = aware.tzinfo, aware.utcoffset()
+            index = bisect.bisect_right(transitions, wall - offset)
+            next_change = transitions[index] if index < len(transitions) else datetime.datetime.max
+            yield aware
+        else:
+            yield wall.replace(tzinfo=current)
+
+def wall_time(dt, tzinfo):
+    """ `dt` as a naive time on the clock of `tzinfo`."""
+    if dt.tzinfo is not None and tzinfo is not None:
+        dt = dt.astimezone(tzinfo)
+    return dt.replace(tzinfo=None)
+
+def split_walls(first, last, split_on=u'days'):
+    """ Lazily yields the naive `first` and then the same time a day, week or month later, as many times
+    as there are whole days from the midnight before `first` to `last` and never past `last`. These are
+    the occurrences DaterangeAtom.split used to take from dateutil's rrule."""
+    count = (last - start_of_day(first)).days
+    step = 0
+    while count > 0:
+        if split_on == u'days':
+            wall = first + datetime.timedelta(days=step)
+        elif split_on == u'weeks':
+            wall = first + datetime.timedelta(weeks=step)
+        else:
+            month = first.month - 1 + step
+            try:
+                wall = first.replace(year=first.year + month // 12, month=month % 12 + 1)
+            except ValueError:
+                # Like rrule, skip months that do not have the day.
+                step += 1
+                continue
+        if wall > last:
+            return
+        yield wall
+        step += 1
+        count -= 1
+
+def iter_split(start, end, split_on=u'days'):
+    """ Lazily yields the occurrences split_walls() finds between `start` and `end` on the clock of
+    `start`. Each gets the offset in effect on its day, where rrule kept the one `start` had."""
+    if split_on not in SPLIT_ON:
+        raise ValueError(u'split_on value not supported.')
+    walls = split_walls(start.replace(tzinfo=None, microsecond=0), wall_time(end, start.tzinfo), split_on)
+    return localize_walls(walls, start.tzinfo)
+
+def __split_key(start, end, split_on):
+    # Aware datetimes in different zones can compare equal, so the tzinfo is part of the key.
+    return (start.replace(tzinfo=None), start.tzinfo, end.replace(tzinfo=None), end.tzinfo, split_on)
+
+def split_range(start, end, split_on=u'days'):
+    """ Returns (occurrence, end of its day) for every occurrence iter_split() yields. Results are
+    memoized in split_cache."""
+    if split_on not in SPLIT_ON:
+        raise ValueError(u'split_on value not supported.')
+    key = __split_key(start, end, split_on)
+    splits = split_cache.get(key)
+    if splits is None:
+        walls = list(split_walls(start.replace(tzinfo=None, microsecond=0), wall_time(end, start.tzinfo), split_on))
+        ends = (start_of_day(wall) + datetime.timedelta(days=1) for wall in walls)
+        splits = zip(localize_walls(walls, start.tzinfo), localize_walls(ends, start.tzinfo))
+        splits = split_cache.put(key, splits)
+    return list(splits)
 
 def split_by_days(start, end):
-    """ Takes a start and end datetime and splits it into a list of days in between."""
+    """ Takes a start and end datetime and splits it into a list of days in between. The first day
+    starts at the wall time of `start`, the others at midnight, each with the offset in effect then.
+    Results are memoized in split_cache."""
     if (end-start).total_seconds() >= 60*60*24:
-        splits = list(rrule.rrule(rrule.DAILY, count=((end - start_of_day(start)).days),
-                                    dtstart=start,
-                                    until=end))
-        return [(s, end_of_day(s)) for s in splits[0:1]] + [(start_of_day(s), end_of_day(s)) for s in splits[1:]]
+        key = __split_key(start, end, None)
+        splits = split_cache.get(key)
+        if splits is None:
+            wall = start.replace(tzinfo=None, microsecond=0)
+            first = localize_wall(wall, start.tzinfo)
+            days = len(list(split_walls(wall, wall_time(end, start.tzinfo))))
+            # A day with an extra hour can hold 24 hours and still not get to the next midnight.
+            days = max(days, 1)
+            day = start_of_day(wall)
+            midnights = list(localize_walls((day + datetime.timedelta(days=d) for d in xrange(1, days + 1)), start.tzinfo))
+            splits = split_cache.put(key, [(first, midnights[0])] + zip(midnights, midnights[1:]))
+        return list(splits)
     else:
         return [(start, end)]
 
+def merge_intervals(intervals):
+    """ Sorts (start, end) tuples and merges the ones that overlap or touch."""
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+def wall_difference(a, b):
+    """ a - b on the wall clock, also when a DST change gave them different tzinfos."""
+    if a.tzinfo is b.tzinfo:
+        # Python ignores the offset when both sides share a tzinfo, which saves two copies.
+        return a - b
+    return a.replace(tzinfo=None) - b.replace(tzinfo=None)
+
+def daily_runs(intervals):
+    """ Groups (start, end) tuples that repeat the one before them a day later on the wall clock.
+    Returns (start, end, days) with the first tuple of every group and how many days it repeats for."""
+    one_day = datetime.timedelta(days=1)
+    runs = []
+    for start, end in intervals:
+        if runs:
+            last_start, last_end = runs[-1][3:]
+            if wall_difference(start, last_start) == one_day and wall_difference(end, last_end) == one_day:
+                runs[-1][2:] = [runs[-1][2] + 1, start, end]
+                continue
+        runs.append([start, end, 1, start, end])
+    return [(start, end, days) for start, end, days, _, _ in runs]
+
+class Deadline(object):
+    """ Deadline is a time budget that the tagger checks before each stage and each match it looks for.
+
+    Attributes:
+        expires_at (float): When the budget runs out, on `clock`.
+        clock (function): Returns the current time in seconds.
+        reached (bool): Set when a check found the budget spent, so whatever came after was skipped.
+    """
+
+    def __init__(self, budget_ms, clock=time.time):
+        self.clock = clock
+        self.expires_at = clock() + budget_ms / 1000.0
+        self.reached = False
+
+    def expired(self):
+        """ True once the budget has run out. Callers skip the work they were about to do."""
+        if not self.reached:
+            self.reached = self.clock() >= self.expires_at
+        return self.reached
+
+def expired(deadline):
+    return deadline is not None and deadline.expired()
+
+def search_fragment(regex, text, pos, endpos, head_regex=None):
+    """ Searches text[pos:endpos] for `regex` without slicing the string. `re` does not let `^`
+    match at `pos`, so patterns anchored on the start of a fragment pass a `head_regex` with the
+    anchor dropped. It is only tried at `pos` and `regex` handles everything after it."""
+    if head_regex is not None:
+        match = head_regex.match(text, pos, endpos)
+        if match:
+            return match
+        pos += 1
+    return regex.search(text, pos, endpos)
+
 class SequentialMatcher(object):
     """ SequentialMatcher applies a string matching function on an input string and returns
     an ordered list of matches and non-matches where each match as determined by the match_function
@@ -132,10 +418,18 @@ class SequentialMatcher(object):
         before being inserted into the resultant list.
         label (function): If no match_transformer function is provided the default transformation will be to
         use a tuple (match, label) as the inserted result.
+        span_function (function): Used by extract_spans() instead of match_function. Takes `(text, pos, endpos)`
+        and returns the `(start, end)` offsets of the next match in text[pos:endpos] or None.
     """
 
-    def __init__(self, match_function, match_transformer=None, label=None):
+    # Anything that is not whitespace. Used to skip blank leftovers without slicing.
+    NON_BLANK_REGEX = re.compile(r'\S', flags=re.U)
+
+    def __init__(self, match_function=None, match_transformer=None, label=None, span_function=None):
         self.match_function = match_function  # Should return (match or None)
+        self.span_function = span_function  # Should return ((start, end) or None)
+        if not (match_function or span_function):
+            raise ValueError(u'SequentialMatcher requires either a match_function or a span_function.')
         if match_transformer:
             self.match_transformer = match_transformer # f (match_str) --> anyobject you want
         elif label:
@@ -177,3 +471,32 @@ class SequentialMatcher(object):
         # When no more matches, append the remainder to chunks.
         chunks.append(remainder)
         return chunks
+
+    def __is_blank(self, text, pos, endpos):
+        return pos >= endpos or not self.NON_BLANK_REGEX.search(text, pos, endpos)
+
+    def extract_spans(self, text, pos=0, endpos=None, deadline=None):
+        """ Offset based version of extract() that walks text[pos:endpos] with span_function and never
+        copies the remainder. Returns a list of (start, end, result) items in order, where result is the
+        transformed match or None for text in between matches. Blank text in between is left out.
+        Once `deadline` expires the rest of the text is left as it is, unmatched.
+        """
+        endpos = len(text) if endpos is None else endpos
+        chunks = []
+        span = self.__next_span(text, pos, endpos, deadline)
+        # Empty matches can't make progress, treat them like no match as extract() does.
+        while span and span[1] > span[0]:
+            start, end = span
+            if not self.__is_blank(text, pos, start):
+                chunks.append((pos, start, None))
+            chunks.append((start, end, self.match_transformer(text[start:end])))
+            pos = end
+            span = self.__next_span(text, pos, endpos, deadline)
+        if not self.__is_blank(text, pos, endpos):
+            chunks.append((pos, endpos, None))
+        return chunks
+
+    def __next_span(self, text, pos, endpos, deadline):
+        if self.__is_blank(text, pos, endpos) or expired(deadline):
+            return None
+        return self.span_function(text, pos, endpos)
@@ -15,6 +15,13 @@ setup(
         "pytz",
         "textblob",
         "pyyaml",
-        "six"
-    ]
+        "six",
+        "futures; python_version < '3'"
+    ],
+    entry_points={
+        'console_scripts': [
+            'date-range-parser = date_range_parser.cli:main',
+            'date-range-parser-server = date_range_parser.server:main',
+        ]
+    }
 )